@@ -0,0 +1,200 @@
+"""account_service.py
+
+Xóa tài khoản người dùng theo tập hợp (set-based), dùng chung cho admin.delete_user, user.delete và
+lệnh CLI `flask remove-users` (xóa hàng loạt theo khoá sinh viên tốt nghiệp).
+
+Trước đây mỗi route load toàn bộ Borrow của user, gọi `Book.query.get` cho từng lượt chưa trả để hoàn lại
+số lượng rồi xóa từng Borrow một (hàng trăm round-trip với người mượn nhiều). Ở đây mỗi nhóm user chỉ tốn vài
+câu lệnh:
+1. Một SELECT gom nhóm (book_id, count) các lượt đã duyệt chưa trả -> dùng cho audit.
+2. Một UPDATE hoàn lại `available_quantity` bằng subquery đếm tương quan
+   (`SET available_quantity = available_quantity + (SELECT count(*) FROM borrow WHERE borrow.book_id = book.id ...)`).
+   Cú pháp `UPDATE ... FROM (SELECT ...)` chỉ có trên Postgres nên dùng dạng subquery chạy được trên cả MySQL/SQLite.
+   Chỉ lượt 'approved' chưa trả mới hoàn lại vì lượt 'pending' chưa trừ kho.
+3. Lịch sử mượn: mode='delete' xóa hàng loạt; mode='anonymize' giữ lại Borrow (cho thống kê) nhưng đóng các
+   lượt còn mở và xóa thông tin cá nhân trên User.
+4. Dọn các bảng phụ (Notification, NotificationCounter, NotificationPreference, PasswordReset) và bỏ liên kết actor trong Audit
+   (khóa ngoại tới user) bằng DELETE/UPDATE ... WHERE user_id IN (...). Với mode='delete', Audit.target_borrow_id
+   (khóa ngoại tới borrow) của các lượt mượn sắp xóa cũng được đặt NULL trước khi xóa Borrow.
+Mỗi nhóm tối đa ACCOUNT_REMOVAL_BATCH_SIZE user là một transaction; bộ đếm dashboard được cộng trong cùng
+transaction (stats_service.apply_deltas).
+"""
+
+import secrets
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from activity_service import user_names
+import catalog_version
+from models import (
+    db, Audit, Book, Borrow, Notification, NotificationCounter, NotificationPreference, PasswordReset, User
+)
+from stats_service import apply_deltas
+
+REMOVAL_MODES = ('delete', 'anonymize')
+ANONYMIZED_USERNAME = 'Người dùng đã xóa'
+
+
+def _open_loan(book_table_id=None):
+    """Điều kiện lượt mượn đã duyệt nhưng chưa trả (đang giữ sách)."""
+    condition = (Borrow.status == 'approved') & (Borrow.return_date.is_(None))
+    return condition if book_table_id is None else condition & (Borrow.book_id == book_table_id)
+
+
+def _restore_stock(user_ids):
+    """Hoàn lại available_quantity cho mọi sách user đang giữ. Trả về {user_id: {book_id: count}}."""
+    rows = db.session.query(Borrow.user_id, Borrow.book_id, func.count()).filter(
+        Borrow.user_id.in_(user_ids), _open_loan()
+    ).group_by(Borrow.user_id, Borrow.book_id).all()
+    restored = {}
+    for user_id, book_id, count in rows:
+        restored.setdefault(user_id, {})[book_id] = count
+    if not rows:
+        return restored
+
+    held = select(func.count()).where(
+        Borrow.user_id.in_(user_ids), _open_loan(Book.id)
+    ).scalar_subquery()
+    db.session.execute(
+        Book.__table__.update()
+        .where(Book.id.in_(select(Borrow.book_id).where(Borrow.user_id.in_(user_ids), _open_loan())))
+        .values(available_quantity=func.coalesce(Book.available_quantity, 0) + held)
+    )
+    catalog_version.mark_changed(catalog_version.AVAILABILITY)
+    return restored
+
+
+def _borrow_counts(user_ids, now):
+    """Số lượt mượn theo user: (tổng, chưa trả, chờ duyệt, tạo hôm nay) — để trừ khỏi bộ đếm dashboard."""
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = db.session.query(
+        Borrow.user_id,
+        func.count(),
+        func.sum(db.case((Borrow.return_date.is_(None), 1), else_=0)),
+        func.sum(db.case((Borrow.status == 'pending', 1), else_=0)),
+        func.sum(db.case((Borrow.borrow_date >= day_start, 1), else_=0)),
+    ).filter(Borrow.user_id.in_(user_ids)).group_by(Borrow.user_id).all()
+    return {row[0]: (row[1],) + tuple(int(v or 0) for v in row[2:]) for row in rows}
+
+
+def _remove_batch(users, mode, actor_user_id, now):
+    user_ids = [u.id for u in users]
+    restored = _restore_stock(user_ids)
+    counts = _borrow_counts(user_ids, now)
+    total_borrows, active_borrows, pending, today = (sum(c[i] for c in counts.values()) for i in range(4))
+
+    # Bảng phụ: thông báo (và bộ đếm chưa đọc), tuỳ chọn email, mã reset mật khẩu
+    for model in (Notification, NotificationCounter, NotificationPreference, PasswordReset):
+        model.query.filter(model.user_id.in_(user_ids)).delete(synchronize_session=False)
+
+    if mode == 'delete':
+        Audit.query.filter(Audit.actor_user_id.in_(user_ids)).update(
+            {Audit.actor_user_id: None}, synchronize_session=False)
+        # audit.target_borrow_id là FK thật tới borrow: gỡ trước khi xóa các lượt mượn
+        Audit.query.filter(Audit.target_borrow_id.in_(
+            select(Borrow.id).where(Borrow.user_id.in_(user_ids))
+        )).update({Audit.target_borrow_id: None}, synchronize_session=False)
+        Borrow.query.filter(Borrow.user_id.in_(user_ids)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        apply_deltas(db.session.connection(), {
+            'total_users': -len(user_ids),
+            'total_borrows': -total_borrows,
+            'active_borrows': -active_borrows,
+            'pending_requests': -pending,
+            # Chỉ đúng khi dòng thống kê đang ở ngày hôm nay; nếu không get_dashboard_stats đã hiển thị 0
+            'today_checkouts': -today,
+        })
+    else:
+        # Đóng các lượt còn mở: yêu cầu chờ duyệt -> từ chối, đang mượn -> ghi nhận trả
+        Borrow.query.filter(Borrow.user_id.in_(user_ids), Borrow.status == 'pending').update(
+            {Borrow.status: 'rejected'}, synchronize_session=False)
+        Borrow.query.filter(Borrow.user_id.in_(user_ids), Borrow.return_date.is_(None)).update(
+            {Borrow.return_date: now, Borrow.return_notes: 'Tài khoản đã bị xóa'}, synchronize_session=False)
+        db.session.execute(User.__table__.update().where(User.id.in_(user_ids)).values(
+            username=ANONYMIZED_USERNAME,
+            student_staff_id=db.literal('deleted-', type_=db.String) + db.cast(User.id, db.String),
+            email=None,
+            phone=None,
+            avatar_url=None,
+            password_hash=secrets.token_hex(32),
+            is_active=False,
+            email_verified=False,
+            phone_verified=False,
+        ))
+        apply_deltas(db.session.connection(), {
+            'active_borrows': -active_borrows,
+            'pending_requests': -pending,
+        })
+
+    action = 'delete_user' if mode == 'delete' else 'anonymize_user'
+    verb = 'deleted' if mode == 'delete' else 'anonymized'
+    db.session.execute(Audit.__table__.insert(), [{
+        'action': action,
+        'actor_user_id': actor_user_id,
+        'target_user_id': u.id,
+        'timestamp': now,
+        'details': f'Admin {actor_user_id} {verb} user {u.id} ({u.student_staff_id}). '
+                   f'Borrows: {counts.get(u.id, (0,))[0]}. Restored counts: {restored.get(u.id, {})}.',
+        'details_json': {
+            'student_staff_id': u.student_staff_id,
+            'borrows': counts.get(u.id, (0,))[0],
+            'restored_per_book': restored.get(u.id, {}),
+        },
+    } for u in users])
+    db.session.commit()
+
+    for user_id in user_ids:
+        user_names.invalidate(user_id)
+    return {
+        'users': len(user_ids),
+        'borrows': total_borrows,
+        'restored_books': sum(sum(books.values()) for books in restored.values()),
+    }
+
+
+def remove_users(user_ids, mode='delete', actor_user_id=None, batch_size=None):
+    """Xóa (hoặc ẩn danh hoá) các tài khoản không phải admin trong `user_ids`.
+
+    Returns:
+        dict: {'users', 'borrows', 'restored_books', 'skipped'} — skipped là các id không tồn tại hoặc là admin
+    """
+    if mode not in REMOVAL_MODES:
+        raise ValueError(f"mode phải là một trong {REMOVAL_MODES}")
+    batch_size = batch_size or current_app.config.get('ACCOUNT_REMOVAL_BATCH_SIZE', 200)
+    requested = sorted({int(uid) for uid in user_ids})
+    now = datetime.now()
+    totals = {'users': 0, 'borrows': 0, 'restored_books': 0, 'skipped': 0}
+
+    for start in range(0, len(requested), batch_size):
+        chunk = requested[start:start + batch_size]
+        users = db.session.query(User.id, User.student_staff_id).filter(
+            User.id.in_(chunk), User.is_admin == False
+        ).all()
+        totals['skipped'] += len(chunk) - len(users)
+        if not users:
+            continue
+        try:
+            result = _remove_batch(users, mode, actor_user_id, now)
+        except Exception:
+            db.session.rollback()
+            raise
+        for key, value in result.items():
+            totals[key] += value
+    return totals
+
+
+def users_by_student_ids(student_staff_ids=None, prefix=None):
+    """Tìm id user (không phải admin) theo danh sách MSSV/MSCB hoặc tiền tố MSSV (ví dụ khoá 'K19')."""
+    query = db.session.query(User.id).filter(User.is_admin == False)
+    if student_staff_ids is not None:
+        student_staff_ids = list(student_staff_ids)
+        ids = []
+        for start in range(0, len(student_staff_ids), 500):
+            chunk = student_staff_ids[start:start + 500]
+            ids += [user_id for (user_id,) in query.filter(User.student_staff_id.in_(chunk))]
+        return ids
+    if prefix:
+        return [user_id for (user_id,) in query.filter(User.student_staff_id.like(f'{prefix}%'))]
+    return []
@@ -0,0 +1,139 @@
+"""activity_service.py
+
+Dựng activity feed (nhật ký hoạt động) cho trang admin từ bảng Audit.
+
+Trước đây dashboard lấy 10 dòng Audit rồi dùng regex thay "User 123" trong `details` bằng username,
+mỗi lần khớp lại gọi `User.query.get(...)` (N+1 truy vấn). Ở đây:
+- Mỗi dòng audit có tham chiếu kiểu rõ ràng: actor_user_id, target_user_id, target_book_id, target_borrow_id.
+- Với mỗi trang feed, mọi user id (actor, target và các id "User 123" trong details cũ) được gom lại và
+  resolve bằng MỘT truy vấn `IN`, có thêm cache username nhỏ (TTL) dùng chung giữa các request.
+- activity_page() phân trang keyset theo `Audit.id` (cursor `before`) cho infinite scroll.
+"""
+
+import re
+import threading
+import time
+
+from models import db, Audit, User
+
+# Tham chiếu user trong details cũ, ví dụ "Admin 3", "user 12", "Người dùng 7"
+USER_REF_PATTERN = re.compile(r"\b(User|user|Admin|admin|Người dùng|người dùng)\s+(\d+)\b")
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class UserNameCache:
+    """Cache id -> username có TTL, giới hạn kích thước (thread-safe).
+
+    Lưu cả kết quả "không tồn tại" (None) để user đã bị xóa không bị truy vấn lại mỗi trang.
+    """
+
+    def __init__(self, ttl_seconds=300, max_size=2048):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, ids):
+        """Trả về (found, missing): found là dict id -> username (hoặc None), missing là set id cần truy vấn."""
+        now = time.monotonic()
+        found, missing = {}, set()
+        with self._lock:
+            for uid in ids:
+                entry = self._data.get(uid)
+                if entry and entry[1] > now:
+                    found[uid] = entry[0]
+                else:
+                    missing.add(uid)
+        return found, missing
+
+    def set_many(self, names):
+        expires = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if len(self._data) + len(names) > self.max_size:
+                self._data.clear()
+            for uid, name in names.items():
+                self._data[uid] = (name, expires)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(user_id, None)
+
+
+user_names = UserNameCache()
+
+
+def resolve_usernames(user_ids):
+    """Resolve tập user id -> username bằng cache + tối đa một truy vấn `IN`. Id không tồn tại -> None."""
+    ids = {int(uid) for uid in user_ids if uid is not None}
+    if not ids:
+        return {}
+    names, missing = user_names.get_many(ids)
+    if missing:
+        fetched = dict(db.session.query(User.id, User.username).filter(User.id.in_(missing)).all())
+        resolved = {uid: fetched.get(uid) for uid in missing}
+        user_names.set_many(resolved)
+        names.update(resolved)
+    return names
+
+
+def _referenced_user_ids(audit):
+    ids = {audit.actor_user_id, audit.target_user_id}
+    ids.update(int(m.group(2)) for m in USER_REF_PATTERN.finditer(audit.details or ''))
+    ids.discard(None)
+    return ids
+
+
+def build_feed(audits):
+    """Chuyển list Audit thành list dict hiển thị, resolve username theo lô."""
+    ids = set()
+    for audit in audits:
+        ids |= _referenced_user_ids(audit)
+    names = resolve_usernames(ids)
+
+    def _replace_user(match):
+        name = names.get(int(match.group(2)))
+        return f"{match.group(1)} {name}" if name else match.group(0)
+
+    def _user_ref(uid):
+        return {'id': uid, 'username': names.get(uid)} if uid is not None else None
+
+    return [{
+        'id': audit.id,
+        'timestamp': audit.timestamp,
+        'action': audit.action,
+        'actor': _user_ref(audit.actor_user_id),
+        'target_user': _user_ref(audit.target_user_id),
+        'target_book_id': audit.target_book_id,
+        'target_borrow_id': audit.target_borrow_id,
+        'details': USER_REF_PATTERN.sub(_replace_user, audit.details or ''),
+        'data': audit.details_json or {},
+    } for audit in audits]
+
+
+def activity_page(before_id=None, limit=DEFAULT_PAGE_SIZE):
+    """Một trang activity feed (mới nhất trước), phân trang keyset theo Audit.id.
+
+    Returns:
+        tuple: (items, next_before) — next_before là cursor cho trang sau, None nếu đã hết
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    query = Audit.query
+    if before_id:
+        query = query.filter(Audit.id < before_id)
+    audits = query.order_by(Audit.id.desc()).limit(limit + 1).all()
+    has_more = len(audits) > limit
+    audits = audits[:limit]
+    next_before = audits[-1].id if has_more and audits else None
+    return build_feed(audits), next_before
+
+
+def serialize_item(item):
+    """Dạng JSON của một phần tử feed."""
+    data = dict(item)
+    data['timestamp'] = item['timestamp'].strftime('%d/%m/%Y %H:%M') if item['timestamp'] else None
+    return data
@@ -0,0 +1,214 @@
+"""analytics_service.py
+
+Thống kê lưu thông sách (circulation analytics) cho trang admin.
+
+Cách làm:
+- Trích Borrow trong khoảng thời gian thành các mảng NumPy theo cột (book_id, user_id, ngày mượn, thời điểm
+  mượn/trả/hạn trả, trạng thái), đọc theo từng chunk keyset (`id > last_id LIMIT n`) để không giữ cả bảng
+  dưới dạng đối tượng ORM trong bộ nhớ. Book/User chỉ lấy các cột cần thiết.
+- Các chỉ số được tính bằng phép toán vector (bincount, unique, searchsorted, mask) thay vì vòng lặp Python.
+- Kết quả được cache theo cửa sổ thời gian (ANALYTICS_CACHE_SECONDS), nên trang biểu đồ chỉ tốn chi phí
+  tính toán ở lần đầu mỗi chu kỳ cache.
+
+Chỉ số:
+- trend_daily / trend_weekly: số lượt mượn theo ngày / tuần (tuần bắt đầu thứ Hai)
+- top_books / top_authors: được mượn nhiều nhất
+- categories: lượt mượn trong kỳ, số đang mượn so với `quantity` (tỷ lệ sử dụng) theo thể loại
+- avg_loan_days: thời gian mượn trung bình của các lượt đã trả
+- overdue_by_role: tỷ lệ quá hạn theo User.role (trả sau hạn hoặc chưa trả mà đã quá hạn)
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from config import CATEGORY_MAP
+from models import db, Book, Borrow, User
+
+STATUS_CODES = {'pending': 0, 'approved': 1, 'rejected': 2}
+OTHER_STATUS = 3
+SECONDS_PER_DAY = 86400.0
+TOP_N = 10
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _ts(value):
+    return value.timestamp() if value else np.nan
+
+
+def load_borrow_columns(start, end, chunk_size=None):
+    """Đọc các lượt mượn có borrow_date trong [start, end) thành dict các mảng NumPy (đọc theo chunk)."""
+    chunk_size = chunk_size or current_app.config.get('ANALYTICS_CHUNK_SIZE', 5000)
+    columns = {name: [] for name in ('book_id', 'user_id', 'day', 'borrowed', 'returned', 'expected', 'status')}
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            Borrow.id, Borrow.book_id, Borrow.user_id, Borrow.borrow_date,
+            Borrow.return_date, Borrow.expected_return_date, Borrow.status
+        ).filter(
+            Borrow.id > last_id,
+            Borrow.borrow_date >= start,
+            Borrow.borrow_date < end
+        ).order_by(Borrow.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ids, book_ids, user_ids, borrowed, returned, expected, status = zip(*rows)
+        columns['book_id'].append(np.fromiter(book_ids, dtype=np.int64, count=len(rows)))
+        columns['user_id'].append(np.fromiter(user_ids, dtype=np.int64, count=len(rows)))
+        columns['day'].append(np.fromiter((d.toordinal() for d in borrowed), dtype=np.int64, count=len(rows)))
+        columns['borrowed'].append(np.fromiter((_ts(d) for d in borrowed), dtype=np.float64, count=len(rows)))
+        columns['returned'].append(np.fromiter((_ts(d) for d in returned), dtype=np.float64, count=len(rows)))
+        columns['expected'].append(np.fromiter((_ts(d) for d in expected), dtype=np.float64, count=len(rows)))
+        columns['status'].append(np.fromiter((STATUS_CODES.get(s, OTHER_STATUS) for s in status),
+                                             dtype=np.int8, count=len(rows)))
+        if len(rows) < chunk_size:
+            break
+
+    dtypes = {'book_id': np.int64, 'user_id': np.int64, 'day': np.int64, 'status': np.int8}
+    return {name: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes.get(name, np.float64))
+            for name, parts in columns.items()}
+
+
+def _lookup(keys, values, ids, default):
+    """Ánh xạ vector `ids` -> `values` theo `keys` (đã sort); id không có trong keys -> default."""
+    if not len(keys):
+        return np.full(len(ids), default, dtype=values.dtype)
+    pos = np.clip(np.searchsorted(keys, ids), 0, len(keys) - 1)
+    found = keys[pos] == ids
+    return np.where(found, values[pos], default)
+
+
+def _top(ids, labels, n=TOP_N):
+    if not len(ids):
+        return []
+    unique, counts = np.unique(ids, return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:n]
+    return [{'label': labels(unique[i]), 'count': int(counts[i])} for i in order]
+
+
+def compute_analytics(start, end, now=None):
+    """Tính tất cả chỉ số cho các lượt mượn có borrow_date trong [start, end)."""
+    now = now or datetime.now()
+    cols = load_borrow_columns(start, end)
+    lent = cols['status'] != STATUS_CODES['rejected']
+
+    # Xu hướng theo ngày / tuần
+    first_day = start.date().toordinal()
+    n_days = max(1, (end.date().toordinal() - first_day) + (1 if end.time() != datetime.min.time() else 0))
+    day_index = cols['day'][lent] - first_day
+    daily = np.bincount(day_index, minlength=n_days)[:n_days]
+    days = first_day + np.arange(n_days)
+    week_starts = days - (days - 1) % 7  # ordinal 1 (01/01/0001) là thứ Hai
+    weeks, week_inverse = np.unique(week_starts, return_inverse=True)
+    weekly = np.bincount(week_inverse, weights=daily, minlength=len(weeks)).astype(np.int64)
+
+    # Book: id, tác giả, thể loại, số lượng (bảng nhỏ, lấy một lần)
+    book_rows = db.session.query(Book.id, Book.title, Book.author, Book.category, Book.quantity).order_by(Book.id).all()
+    book_keys = np.array([r[0] for r in book_rows], dtype=np.int64)
+    titles = {r[0]: r[1] for r in book_rows}
+    authors = sorted({r[2] for r in book_rows})
+    author_index = {a: i for i, a in enumerate(authors)}
+    categories = sorted({r[3] or '' for r in book_rows})
+    category_index = {c: i for i, c in enumerate(categories)}
+    book_author = np.array([author_index[r[2]] for r in book_rows], dtype=np.int64)
+    book_category = np.array([category_index[r[3] or ''] for r in book_rows], dtype=np.int64)
+    book_quantity = np.array([r[4] or 0 for r in book_rows], dtype=np.int64)
+
+    lent_books = cols['book_id'][lent]
+    top_books = _top(lent_books, lambda book_id: titles.get(int(book_id), f'#{int(book_id)}'))
+    borrow_author = _lookup(book_keys, book_author, lent_books, -1)
+    top_authors = _top(borrow_author[borrow_author >= 0], lambda i: authors[int(i)])
+
+    # Thể loại: lượt mượn trong kỳ và số đang mượn hiện tại so với tổng quantity
+    borrow_category = _lookup(book_keys, book_category, lent_books, -1)
+    period_by_category = np.bincount(borrow_category[borrow_category >= 0], minlength=len(categories))
+    active_book_ids = np.array([book_id for (book_id,) in db.session.query(Borrow.book_id).filter(
+        Borrow.status == 'approved', Borrow.return_date.is_(None)
+    )], dtype=np.int64)
+    active_category = _lookup(book_keys, book_category, active_book_ids, -1)
+    active_by_category = np.bincount(active_category[active_category >= 0], minlength=len(categories))
+    quantity_by_category = np.bincount(book_category, weights=book_quantity, minlength=len(categories))
+    category_stats = [{
+        'category': code,
+        'name': CATEGORY_MAP.get(code, code or 'Khác'),
+        'borrows': int(period_by_category[i]),
+        'active': int(active_by_category[i]),
+        'quantity': int(quantity_by_category[i]),
+        'utilization': round(float(active_by_category[i] / quantity_by_category[i]), 4) if quantity_by_category[i] else 0.0,
+    } for i, code in enumerate(categories)]
+
+    # Thời gian mượn trung bình (các lượt đã trả)
+    approved = cols['status'] == STATUS_CODES['approved']
+    returned = approved & ~np.isnan(cols['returned'])
+    durations = (cols['returned'][returned] - cols['borrowed'][returned]) / SECONDS_PER_DAY
+    avg_loan_days = round(float(durations.mean()), 2) if len(durations) else None
+
+    # Tỷ lệ quá hạn theo role
+    has_due = approved & ~np.isnan(cols['expected'])
+    finished_at = np.where(np.isnan(cols['returned']), now.timestamp(), cols['returned'])
+    overdue = has_due & (finished_at > cols['expected'])
+    user_rows = db.session.query(User.id, User.role).order_by(User.id).all()
+    roles = sorted({r[1] or '' for r in user_rows})
+    role_index = {r: i for i, r in enumerate(roles)}
+    user_keys = np.array([r[0] for r in user_rows], dtype=np.int64)
+    user_role = np.array([role_index[r[1] or ''] for r in user_rows], dtype=np.int64)
+    borrow_role = _lookup(user_keys, user_role, cols['user_id'], -1)
+    known = has_due & (borrow_role >= 0)
+    totals = np.bincount(borrow_role[known], minlength=len(roles))
+    overdues = np.bincount(borrow_role[known & overdue], minlength=len(roles))
+    overdue_by_role = [{
+        'role': role,
+        'loans': int(totals[i]),
+        'overdue': int(overdues[i]),
+        'rate': round(float(overdues[i] / totals[i]), 4) if totals[i] else 0.0,
+    } for i, role in enumerate(roles) if totals[i]]
+
+    return {
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'total_borrows': int(lent.sum()),
+        'trend_daily': [{'date': datetime.fromordinal(int(d)).strftime('%Y-%m-%d'), 'count': int(c)}
+                        for d, c in zip(days, daily)],
+        'trend_weekly': [{'week': datetime.fromordinal(int(w)).strftime('%Y-%m-%d'), 'count': int(c)}
+                         for w, c in zip(weeks, weekly)],
+        'top_books': top_books,
+        'top_authors': top_authors,
+        'categories': category_stats,
+        'avg_loan_days': avg_loan_days,
+        'overdue_by_role': overdue_by_role,
+        'generated_at': now.strftime('%d/%m/%Y %H:%M:%S'),
+    }
+
+
+def get_analytics(days=30, now=None):
+    """Chỉ số cho `days` ngày gần nhất (tính cả hôm nay), có cache theo cửa sổ thời gian."""
+    now = now or datetime.now()
+    end = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    start = end - timedelta(days=days)
+    key = (start, end)
+    ttl = current_app.config.get('ANALYTICS_CACHE_SECONDS', 300)
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+    result = compute_analytics(start, end, now=now)
+    with _cache_lock:
+        # Bỏ các cửa sổ đã hết hạn để cache không lớn dần theo ngày
+        expired = [k for k, (expires, _) in _cache.items() if expires <= time.monotonic()]
+        for k in expired:
+            _cache.pop(k, None)
+        _cache[key] = (time.monotonic() + ttl, result)
+    return result
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
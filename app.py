@@ -12,11 +12,14 @@ Ghi chú nhanh trên các phần chính:
 """
 
 from config import app
-from models import db
+from models import db, ensure_runtime_columns
+from stats_service import register_listeners as register_stats_listeners
+from notification_service import register_listeners as register_notification_listeners
+from catalog_version import register_listeners as register_catalog_listeners
+import click
 from flask import request, flash, redirect, url_for
 from flask_apscheduler import APScheduler
 from datetime import datetime, timedelta
-from email_service import send_return_reminder_email
 from werkzeug.exceptions import RequestEntityTooLarge
 
 # Cấu hình giới hạn kích thước upload
@@ -28,6 +31,14 @@ def handle_file_too_large(e):
     flash('File tải lên quá lớn. Giới hạn là 2MB.', 'danger')
     return redirect(request.url)
 
+# Đếm số câu SQL mỗi request (phát hiện N+1)
+from query_counter import init_query_counter
+init_query_counter(app)
+
+# Metrics vận hành (request rate, độ trễ, hàng đợi...) gộp giữa các worker: /metrics và trang admin Giám sát
+from metrics import init_metrics, observe_job_submitted
+init_metrics(app)
+
 # Initialize Flask-Mail
 from email_service import mail
 mail.init_app(app)
@@ -36,34 +47,123 @@ mail.init_app(app)
 scheduler = APScheduler()
 scheduler.init_app(app)
 scheduler.start()
+from apscheduler.events import EVENT_JOB_SUBMITTED
+scheduler.add_listener(observe_job_submitted, EVENT_JOB_SUBMITTED)
 
 def check_overdue_books():
-    """Kiểm tra và gửi email nhắc nhở cho các sách sắp đến hạn hoặc quá hạn."""
+    """Kiểm tra sách sắp đến hạn trả và gửi email nhắc nhở.
+
+    User chế độ 'digest' nhận một email gộp (nhắc nhở + thông báo chưa đọc), user 'immediate'
+    nhận mỗi lượt mượn một email như trước. Xem digest_service.run_daily_digest.
+    """
     with app.app_context():
-        # Lấy ngày hiện tại
-        today = datetime.now()
-        # Lấy ngày mai (để nhắc trước 1 ngày)
-        tomorrow = today + timedelta(days=1)
-        
-        # Tìm các lượt mượn chưa trả
-        from models import Borrow, User, Book
-        
-        # 1. Nhắc trước 1 ngày
-        upcoming_returns = db.session.query(Borrow, User, Book).join(User).join(Book).filter(
-            Borrow.return_date >= tomorrow.replace(hour=0, minute=0, second=0),
-            Borrow.return_date < tomorrow.replace(hour=23, minute=59, second=59),
-            Borrow.return_date != None,
-            Borrow.return_condition == None  # Chưa trả
-        ).all()
-        
-        for borrow, user, book in upcoming_returns:
-            if user.email:
-                print(f"Sending reminder to {user.email} for book {book.title}")
-                send_return_reminder_email(user.email, user.username, book.title, borrow.return_date)
+        from digest_service import run_daily_digest
+        stats = run_daily_digest()
+        print(f"Daily reminder/digest job: {stats}")
 
 # Lên lịch chạy mỗi ngày vào 8:00 sáng
 scheduler.add_job(id='check_overdue_books', func=check_overdue_books, trigger='cron', hour=8, minute=0)
 
+
+def purge_expired_rows():
+    """Dọn dẹp OTP/mã reset hết hạn và thông báo cũ theo batch (xem retention_service.py)."""
+    with app.app_context():
+        from retention_service import purge_expired_rows as run_retention
+        for result in run_retention():
+            print(f"Retention {result['table']}: deleted {result['rows_deleted']} rows "
+                  f"in {result['batches']} batches ({result['seconds']}s)")
+
+# Dọn dẹp mỗi ngày lúc 3:00 sáng (giờ ít truy cập)
+scheduler.add_job(id='purge_expired_rows', func=purge_expired_rows, trigger='cron', hour=3, minute=0)
+
+
+def reconcile_dashboard_stats():
+    """Đếm lại chính xác bộ đếm dashboard (sửa sai lệch, cập nhật số lượt quá hạn)."""
+    with app.app_context():
+        from retention_service import exclusive_job
+        from stats_service import reconcile_stats
+        with exclusive_job('dashboard_stats') as acquired:
+            if acquired:
+                drift = reconcile_stats()
+                if drift:
+                    print(f"Dashboard stats reconciled, drift: {drift}")
+
+scheduler.add_job(id='reconcile_dashboard_stats', func=reconcile_dashboard_stats, trigger='interval',
+                  minutes=app.config['STATS_RECONCILE_MINUTES'])
+
+
+def sample_metrics():
+    """Lấy mẫu các gauge nguồn DB (yêu cầu mượn chờ duyệt, email tồn) và ghi snapshot metrics của worker."""
+    with app.app_context():
+        from metrics import sample_gauges
+        sample_gauges()
+
+scheduler.add_job(id='sample_metrics', func=sample_metrics, trigger='interval',
+                  seconds=app.config['METRICS_SAMPLE_SECONDS'])
+
+
+def reconcile_notification_counters():
+    """Đếm lại số thông báo chưa đọc của từng user (sửa sai lệch từ xoá/cập nhật hàng loạt)."""
+    with app.app_context():
+        from retention_service import exclusive_job
+        from notification_service import reconcile_unread_counters
+        with exclusive_job('notification_counters') as acquired:
+            if acquired:
+                fixed = reconcile_unread_counters()
+                if fixed:
+                    print(f"Notification counters reconciled: {fixed} users fixed")
+
+scheduler.add_job(id='reconcile_notification_counters', func=reconcile_notification_counters, trigger='interval',
+                  minutes=app.config['NOTIFICATION_COUNTER_RECONCILE_MINUTES'])
+
+
+def archive_cold_audits():
+    """Chuyển audit log cũ hơn AUDIT_HOT_MONTHS ra file nén theo tháng (xem audit_service.py)."""
+    with app.app_context():
+        from audit_service import archive_cold_audits as run_archive
+        for result in run_archive():
+            print(f"Audit archive: moved {result['rows_deleted']} rows to {result['archive_path']}")
+
+# Chạy ngày 1 hằng tháng lúc 3:30 sáng
+scheduler.add_job(id='archive_cold_audits', func=archive_cold_audits, trigger='cron', day=1, hour=3, minute=30)
+
+
+@app.cli.command('purge-expired')
+def purge_expired_command():
+    """Chạy job dọn dẹp ngay: `flask --app app purge-expired`."""
+    purge_expired_rows()
+
+
+@app.cli.command('remove-users')
+@click.option('--ids-file', type=click.File('r', encoding='utf-8'), help='File chứa MSSV/MSCB, mỗi dòng một mã.')
+@click.option('--prefix', help='Tiền tố MSSV của cả khoá, ví dụ K19.')
+@click.option('--mode', type=click.Choice(['delete', 'anonymize']), default='anonymize', show_default=True,
+              help='delete: xóa hẳn lịch sử mượn; anonymize: giữ lịch sử, xóa thông tin cá nhân.')
+@click.option('--dry-run', is_flag=True, help='Chỉ đếm số tài khoản sẽ bị xử lý.')
+def remove_users_command(ids_file, prefix, mode, dry_run):
+    """Xóa tài khoản hàng loạt (ví dụ sinh viên đã tốt nghiệp): `flask --app app remove-users --prefix K19`."""
+    from account_service import remove_users, users_by_student_ids
+    if ids_file:
+        student_ids = [line.strip() for line in ids_file if line.strip()]
+        user_ids = users_by_student_ids(student_staff_ids=student_ids)
+    elif prefix:
+        user_ids = users_by_student_ids(prefix=prefix)
+    else:
+        raise click.UsageError('Cần --ids-file hoặc --prefix.')
+
+    print(f"Tìm thấy {len(user_ids)} tài khoản.")
+    if dry_run or not user_ids:
+        return
+    result = remove_users(user_ids, mode=mode)
+    print(f"Đã xử lý {result['users']} tài khoản ({mode}), {result['borrows']} lượt mượn, "
+          f"hoàn lại {result['restored_books']} cuốn sách.")
+
+
+@app.cli.command('archive-audits')
+def archive_audits_command():
+    """Lưu trữ audit log cũ ngay: `flask --app app archive-audits`."""
+    archive_cold_audits()
+
 # Import blueprints
 from routes.main import main as main_blueprint
 from routes.auth import auth as auth_blueprint
@@ -84,8 +184,17 @@ app.register_blueprint(chatbot_blueprint, name='chatbot_bp')
 app.register_blueprint(google_oauth_blueprint, name='google_oauth_bp')
 app.register_blueprint(notification_bp, name='notification_bp', url_prefix='/notification')
 
-# Khởi tạo available_quantity từ quantity nếu chưa có
+# Tạo các bảng mới (nếu chưa có) và khởi tạo available_quantity từ quantity nếu chưa có
 with app.app_context():
+    try:
+        db.create_all()
+    except Exception as e:
+        print(f"⚠ Skipped db.create_all(): {e}")
+    ensure_runtime_columns()
+    register_stats_listeners()
+    register_notification_listeners(app)
+    register_catalog_listeners(app)
+
     try:
         from models import Book
         from sqlalchemy.exc import ProgrammingError
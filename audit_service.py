@@ -0,0 +1,85 @@
+"""audit_service.py
+
+Lưu trữ (archive) nhật ký Audit theo tháng.
+
+Bảng Audit nhận một dòng cho mọi thao tác quan trọng và trước đây không bao giờ được dọn, nên sẽ trở thành bảng
+lớn nhất. Thay vì partition riêng của từng hệ quản trị (MySQL/Postgres/SQLite cú pháp khác nhau), bảng được chia
+logic theo tháng:
+- Dữ liệu "nóng": AUDIT_HOT_MONTHS tháng gần nhất (tính cả tháng hiện tại) nằm trong bảng, có index
+  (timestamp), (actor_user_id, timestamp), (target_book_id, timestamp). Dashboard và trang nhật ký hoạt động
+  chỉ đọc phần này.
+- Dữ liệu "lạnh": mỗi tháng cũ hơn được ghi ra một file `audit-YYYY-MM.jsonl.gz` trong AUDIT_ARCHIVE_DIR rồi
+  xóa khỏi bảng theo batch (dùng lại retention_service.purge_table). Đọc lại bằng iter_archived_audits().
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_
+
+from models import db, Audit
+from retention_service import RetentionPolicy, exclusive_job, purge_table
+
+
+def _month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _add_months(month_start, months):
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def hot_cutoff(now=None):
+    """Mốc bắt đầu dữ liệu nóng: đầu tháng, lùi AUDIT_HOT_MONTHS - 1 tháng so với tháng hiện tại."""
+    months = max(1, current_app.config.get('AUDIT_HOT_MONTHS', 6))
+    return _add_months(_month_start(now or datetime.now()), -(months - 1))
+
+
+def archive_path(month_start):
+    return os.path.join(current_app.config['AUDIT_ARCHIVE_DIR'], f"audit-{month_start.strftime('%Y-%m')}.jsonl.gz")
+
+
+def archive_cold_audits(now=None):
+    """Chuyển các tháng audit cũ hơn mốc dữ liệu nóng ra file nén, mỗi tháng một file.
+
+    Returns:
+        list: kết quả purge_table của từng tháng ([] nếu không có gì để lưu trữ hoặc worker khác đang chạy)
+    """
+    cutoff = hot_cutoff(now)
+    oldest = db.session.query(db.func.min(Audit.timestamp)).filter(Audit.timestamp < cutoff).scalar()
+    if oldest is None:
+        return []
+
+    results = []
+    with exclusive_job('audit_archive') as acquired:
+        if not acquired:
+            return []
+        month = _month_start(oldest)
+        while month < cutoff:
+            month_end = _add_months(month, 1)
+            policy = RetentionPolicy(
+                Audit,
+                lambda now, config, start=month, end=month_end: and_(Audit.timestamp >= start, Audit.timestamp < end)
+            )
+            results.append(purge_table(
+                policy, now=now,
+                archive_dir=current_app.config['AUDIT_ARCHIVE_DIR'],
+                archive_name=f"audit-{month.strftime('%Y-%m')}"
+            ))
+            month = month_end
+    return results
+
+
+def iter_archived_audits(year, month):
+    """Đọc lại các dòng audit đã lưu trữ của một tháng (dict theo cột; timestamp dạng ISO string)."""
+    path = archive_path(datetime(year, month, 1))
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
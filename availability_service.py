@@ -0,0 +1,72 @@
+"""availability_service.py
+
+Tồn kho thời gian thực cho một danh sách sách (available_quantity, views_count), dùng chung cho mọi nơi cần số liệu
+"sống" theo id — trước hết là Strategy C của chatbot (routes/chatbot.get_rag_context), vốn gọi
+`Book.query.get(book_id)` cho từng kết quả của Chroma (N truy vấn cho mỗi tin nhắn).
+
+- get_availability(book_ids): các id chưa có trong cache được lấy bằng MỘT truy vấn `IN (...)` chỉ chọn các cột cần.
+- Cache trong bộ nhớ của worker, TTL ngắn (AVAILABILITY_CACHE_SECONDS).
+- Mượn/duyệt/trả (mọi thay đổi quantity/available_quantity/is_active qua ORM, và hoàn kho khi xóa tài khoản) tăng
+  phiên bản AVAILABILITY của catalog_version.py sau khi commit; phiên bản đổi thì cache của MỌI worker bị bỏ ở lần
+  đọc kế tiếp — số lượng không bao giờ cũ hơn lần commit gần nhất. views_count chỉ cũ tối đa một TTL.
+"""
+
+import threading
+import time
+
+from flask import current_app
+
+import catalog_version
+from models import db, Book
+
+_cache = {}
+_cache_state = {'version': None}
+_cache_lock = threading.Lock()
+
+
+def get_availability(book_ids):
+    """Trả về {book_id: {'available_quantity', 'views_count', 'is_active'}} cho các sách còn tồn tại trong DB."""
+    book_ids = list(dict.fromkeys(book_ids))
+    if not book_ids:
+        return {}
+    ttl = current_app.config.get('AVAILABILITY_CACHE_SECONDS', 10)
+    version = catalog_version.current(catalog_version.AVAILABILITY)
+    now = time.monotonic()
+
+    result, missing = {}, []
+    with _cache_lock:
+        if _cache_state['version'] != version:
+            _cache.clear()
+            _cache_state['version'] = version
+        for book_id in book_ids:
+            entry = _cache.get(book_id)
+            if entry is not None and entry[0] > now:
+                result[book_id] = entry[1]
+            else:
+                missing.append(book_id)
+
+    if missing:
+        rows = db.session.query(Book.id, Book.available_quantity, Book.views_count, Book.is_active).filter(
+            Book.id.in_(missing)).all()
+        fetched = {
+            book_id: {'available_quantity': available or 0, 'views_count': views or 0, 'is_active': bool(active)}
+            for book_id, available, views, active in rows
+        }
+        result.update(fetched)
+        with _cache_lock:
+            # Phiên bản đổi trong lúc truy vấn thì không lưu (dữ liệu có thể đã cũ)
+            if _cache_state['version'] == version:
+                expires = now + ttl
+                for book_id, data in fetched.items():
+                    _cache[book_id] = (expires, data)
+    return result
+
+
+def invalidate(book_ids=None):
+    """Bỏ cache của worker này (toàn bộ hoặc các id chỉ định)."""
+    with _cache_lock:
+        if book_ids is None:
+            _cache.clear()
+        else:
+            for book_id in book_ids:
+                _cache.pop(book_id, None)
@@ -0,0 +1,138 @@
+"""bench_email.py
+
+Benchmark throughput gửi email, chạy hoàn toàn offline với LocalSMTPSink (smtp_sink.py).
+
+Các kịch bản:
+ - confirmation: send_borrow_confirmation_email (mỗi email một kết nối SMTP, như route mượn sách)
+ - reminder: send_return_reminder_email (như job check_overdue_books)
+ - bulk: đường gửi của bulk_mail_service (mỗi worker dùng lại một kết nối cho cả chunk)
+
+Báo cáo: số message/giây, số kết nối SMTP đã mở, phân phối latency mỗi email (p50/p90/p99/max).
+
+Cách chạy:
+    python bench_email.py --count 500 --concurrency 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from smtp_sink import LocalSMTPSink
+
+
+def percentile(sorted_values, q):
+    """Percentile theo nearest-rank trên list đã sort."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def report(name, sink, latencies, ok_count, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'scenario': name,
+        'messages': sink.message_count,
+        'ok': ok_count,
+        'elapsed_s': elapsed,
+        'msgs_per_s': sink.message_count / elapsed if elapsed else 0.0,
+        'connections': sink.connections,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+
+def run_single_sends(name, app, sink, send_one, count, concurrency):
+    """Gọi `send_one(i)` `count` lần với `concurrency` thread; mỗi lần là một email."""
+    sink.reset()
+
+    def task(i):
+        with app.app_context():
+            started = time.perf_counter()
+            success, _ = send_one(i)
+            return success, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(task, range(count)))
+    elapsed = time.perf_counter() - started
+    return report(name, sink, [lat for _, lat in results], sum(1 for ok, _ in results if ok), elapsed)
+
+
+def run_bulk(app, sink, count, concurrency, rate):
+    """Mô phỏng một batch của bulk_mail_service.run_campaign: chia người nhận thành `concurrency` chunk,
+    mỗi chunk gửi qua một kết nối SMTP, có TokenBucket giới hạn tốc độ."""
+    from bulk_mail_service import _build_message
+    from email_service import mail
+    from rate_limit import TokenBucket
+
+    sink.reset()
+    bucket = TokenBucket(rate, capacity=max(1, concurrency))
+    content = {'subject': 'Thông báo thư viện', 'body': 'Thư viện đóng cửa ngày mai.\nXin cảm ơn.'}
+    recipients = [{'id': i, 'email': f'bulk{i}@example.com', 'username': f'User {i}'} for i in range(count)]
+    chunks = [recipients[i::concurrency] for i in range(concurrency) if recipients[i::concurrency]]
+
+    def send_chunk(chunk):
+        latencies, ok = [], 0
+        with app.app_context():
+            with mail.connect() as conn:
+                for recipient in chunk:
+                    bucket.acquire()
+                    started = time.perf_counter()
+                    conn.send(_build_message(content, recipient))
+                    latencies.append(time.perf_counter() - started)
+                    ok += 1
+        return ok, latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send_chunk, chunks))
+    elapsed = time.perf_counter() - started
+    latencies = [lat for _, lats in results for lat in lats]
+    return report('bulk', sink, latencies, sum(ok for ok, _ in results), elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gửi email qua SMTP sink cục bộ.')
+    parser.add_argument('--count', type=int, default=200, help='số email mỗi kịch bản')
+    parser.add_argument('--concurrency', type=int, default=4, help='số thread / kết nối song song')
+    parser.add_argument('--bulk-rate', type=float, default=1e6,
+                        help='giới hạn email/giây của TokenBucket trong kịch bản bulk')
+    args = parser.parse_args()
+
+    sink = LocalSMTPSink(keep_messages=False).start()
+    # Phải set trước khi import config (config đọc MAIL_* từ biến môi trường lúc import)
+    os.environ.update(sink.mail_config())
+
+    from config import app, LOAN_PERIOD_DAYS
+    from email_service import mail, send_borrow_confirmation_email, send_return_reminder_email
+    mail.init_app(app)
+
+    borrow_date = datetime.now()
+    deadline = borrow_date + timedelta(days=LOAN_PERIOD_DAYS)
+
+    rows = [
+        run_single_sends('confirmation', app, sink, lambda i: send_borrow_confirmation_email(
+            f'user{i}@example.com', f'User {i}', 'Clean Code', 'Robert C. Martin', borrow_date, deadline
+        ), args.count, args.concurrency),
+        run_single_sends('reminder', app, sink, lambda i: send_return_reminder_email(
+            f'user{i}@example.com', f'User {i}', 'Clean Code', deadline
+        ), args.count, args.concurrency),
+        run_bulk(app, sink, args.count, args.concurrency, args.bulk_rate),
+    ]
+    sink.stop()
+
+    header = f"{'scenario':<14}{'msgs':>7}{'ok':>7}{'msg/s':>10}{'conns':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in rows:
+        print(f"{r['scenario']:<14}{r['messages']:>7}{r['ok']:>7}{r['msgs_per_s']:>10.1f}{r['connections']:>8}"
+              f"{r['p50_ms']:>9.2f}{r['p90_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
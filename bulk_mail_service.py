@@ -0,0 +1,306 @@
+"""bulk_mail_service.py
+
+Service gửi email thông báo hàng loạt (đóng cửa thư viện, sách mới về...) tới toàn bộ người dùng.
+
+Thiết kế:
+- Người nhận được lấy từ bảng User theo từng batch keyset (`User.id > last_user_id ORDER BY id LIMIT n`),
+  không bao giờ load toàn bộ bảng User vào bộ nhớ.
+- Mỗi người nhận có một dòng EmailCampaignRecipient (pending/sent/failed) để theo dõi và gửi lại.
+- Việc gửi chạy trong background thread, qua TokenBucket (giới hạn tốc độ tránh bị Gmail chặn) và
+  một ThreadPoolExecutor nhỏ (giới hạn số kết nối SMTP song song; mỗi worker dùng lại 1 kết nối cho cả batch).
+- Pause/resume: worker kiểm tra trạng thái chiến dịch giữa các batch; resume tiếp tục từ con trỏ
+  `last_user_id` và các người nhận còn pending.
+- Mỗi lần chạy giữ một token `run_id` (đặt khi claim, trả về NULL khi worker thoát). Resume bị từ chối khi lần
+  chạy cũ còn đang gửi nốt batch (token chưa được trả và heartbeat chưa cũ) — nếu không, hai worker cùng lấy
+  các người nhận pending và gửi trùng. Worker cũng dừng ngay khi token trong DB không còn là của nó.
+"""
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from markupsafe import escape
+from sqlalchemy import insert
+
+from email_service import mail
+from models import db, EmailCampaign, EmailCampaignRecipient, User
+from rate_limit import TokenBucket
+
+ACTIVE_STATUSES = ('queued', 'running', 'paused')
+
+
+def _recipient_query():
+    """Điều kiện chọn người nhận: có email và tài khoản không bị khoá."""
+    return db.session.query(User.id, User.email, User.username).filter(
+        User.email.isnot(None),
+        User.email != '',
+        User.is_active == True
+    )
+
+
+def create_campaign(subject, body, created_by=None):
+    """Tạo chiến dịch mới ở trạng thái draft.
+
+    Returns:
+        tuple: (campaign, success, message)
+    """
+    subject = (subject or '').strip()
+    body = (body or '').strip()
+    if not subject or not body:
+        return None, False, "Vui lòng nhập tiêu đề và nội dung email."
+
+    campaign = EmailCampaign(
+        subject=subject,
+        body=body,
+        status='draft',
+        created_by=created_by,
+        estimated_recipients=_recipient_query().count()
+    )
+    db.session.add(campaign)
+    db.session.commit()
+    return campaign, True, "Đã tạo chiến dịch email."
+
+
+def _is_stale(campaign):
+    stale_minutes = current_app.config.get('BULK_MAIL_STALE_MINUTES', 5)
+    heartbeat = campaign.heartbeat_at or campaign.started_at
+    return heartbeat is None or heartbeat < datetime.now() - timedelta(minutes=stale_minutes)
+
+
+def start_campaign(campaign_id):
+    """Đưa chiến dịch (draft/paused hoặc running nhưng worker đã chết) vào hàng đợi và chạy nền.
+
+    Returns:
+        tuple: (success, message)
+    """
+    campaign = EmailCampaign.query.get(campaign_id)
+    if not campaign:
+        return False, "Không tìm thấy chiến dịch."
+    if campaign.status == 'running' and not _is_stale(campaign):
+        return False, "Chiến dịch đang chạy."
+    if campaign.status not in ('draft', 'paused', 'queued', 'running'):
+        return False, "Chiến dịch đã kết thúc."
+    if campaign.run_id and not _is_stale(campaign):
+        return False, "Chiến dịch đang gửi nốt batch hiện tại, vui lòng thử lại sau ít giây."
+
+    campaign.status = 'queued'
+    campaign.run_id = None  # lần chạy cũ (nếu còn) đã quá hạn heartbeat: coi như đã chết
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    worker = threading.Thread(
+        target=run_campaign,
+        args=(app, campaign.id),
+        name=f'email-campaign-{campaign.id}',
+        daemon=True
+    )
+    worker.start()
+    return True, "Chiến dịch đã được đưa vào hàng đợi gửi."
+
+
+def pause_campaign(campaign_id):
+    """Tạm dừng chiến dịch; worker sẽ dừng sau batch hiện tại."""
+    updated = EmailCampaign.query.filter(
+        EmailCampaign.id == campaign_id,
+        EmailCampaign.status.in_(('queued', 'running'))
+    ).update({EmailCampaign.status: 'paused'}, synchronize_session=False)
+    db.session.commit()
+    if not updated:
+        return False, "Chiến dịch không ở trạng thái đang chạy."
+    return True, "Đã tạm dừng chiến dịch."
+
+
+def cancel_campaign(campaign_id):
+    """Huỷ chiến dịch; các người nhận còn pending sẽ không được gửi nữa."""
+    updated = EmailCampaign.query.filter(
+        EmailCampaign.id == campaign_id,
+        EmailCampaign.status.in_(('draft',) + ACTIVE_STATUSES)
+    ).update({EmailCampaign.status: 'cancelled', EmailCampaign.finished_at: datetime.now()},
+             synchronize_session=False)
+    db.session.commit()
+    if not updated:
+        return False, "Chiến dịch đã kết thúc."
+    return True, "Đã huỷ chiến dịch."
+
+
+def campaign_progress(campaign):
+    """Trả về dict tiến độ để hiển thị trên dashboard / trả JSON."""
+    expected = max(campaign.estimated_recipients or 0, campaign.total_recipients or 0)
+    done = (campaign.sent_count or 0) + (campaign.failed_count or 0)
+    if campaign.status == 'completed':
+        percent = 100
+    else:
+        percent = int(done * 100 / expected) if expected else 0
+    return {
+        'id': campaign.id,
+        'subject': campaign.subject,
+        'status': campaign.status,
+        'sent': campaign.sent_count or 0,
+        'failed': campaign.failed_count or 0,
+        'queued': campaign.total_recipients or 0,
+        'expected': expected,
+        'percent': min(percent, 100),
+        'stale': campaign.status == 'running' and _is_stale(campaign),
+    }
+
+
+def _build_message(content, recipient):
+    body_html = escape(content['body']).replace('\n', '<br>')
+    return Message(
+        subject=content['subject'],
+        recipients=[recipient['email']],
+        html=f"""
+        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+            <h2 style="color: #333;">{escape(content['subject'])}</h2>
+            <p>Xin chào <strong>{escape(recipient['username'] or '')}</strong>,</p>
+            <div>{body_html}</div>
+            <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
+            <p style="color: #666; font-size: 12px;">Email này được gửi tự động, vui lòng không trả lời.</p>
+        </div>
+        """
+    )
+
+
+def _send_chunk(app, content, recipients, bucket):
+    """Gửi một nhóm người nhận qua MỘT kết nối SMTP. Chạy trong thread của executor.
+
+    Returns:
+        list: [(recipient_id, error_or_None), ...]
+    """
+    results = []
+    with app.app_context():
+        try:
+            with mail.connect() as conn:
+                for recipient in recipients:
+                    bucket.acquire()
+                    try:
+                        conn.send(_build_message(content, recipient))
+                        results.append((recipient['id'], None))
+                    except Exception as e:
+                        results.append((recipient['id'], str(e)[:255]))
+        except Exception as e:
+            # Không mở được kết nối: đánh dấu phần còn lại của chunk là lỗi
+            done = {rid for rid, _ in results}
+            for recipient in recipients:
+                if recipient['id'] not in done:
+                    results.append((recipient['id'], f"SMTP: {e}"[:255]))
+    return results
+
+
+def _next_batch(campaign, batch_size):
+    """Lấy batch người nhận pending tiếp theo; nếu hết thì stream thêm từ bảng User (keyset)."""
+    def pending():
+        return EmailCampaignRecipient.query.filter_by(
+            campaign_id=campaign.id, status='pending'
+        ).order_by(EmailCampaignRecipient.id).limit(batch_size).all()
+
+    batch = pending()
+    if batch:
+        return batch
+
+    users = _recipient_query().filter(
+        User.id > campaign.last_user_id
+    ).order_by(User.id).limit(batch_size).all()
+    if not users:
+        return []
+
+    db.session.execute(insert(EmailCampaignRecipient), [
+        {'campaign_id': campaign.id, 'user_id': u.id, 'email': u.email,
+         'username': u.username, 'status': 'pending'}
+        for u in users
+    ])
+    campaign.last_user_id = users[-1].id
+    campaign.total_recipients = (campaign.total_recipients or 0) + len(users)
+    db.session.commit()
+    return pending()
+
+
+def run_campaign(app, campaign_id):
+    """Vòng lặp gửi của một chiến dịch (chạy trong background thread).
+
+    Chỉ một worker được chạy một chiến dịch: worker "claim" bằng UPDATE có điều kiện queued -> running và
+    gắn token run_id của mình; vòng lặp dừng khi trạng thái khác running hoặc token đã bị thay.
+    """
+    with app.app_context():
+        run_id = uuid.uuid4().hex
+        claimed = EmailCampaign.query.filter(
+            EmailCampaign.id == campaign_id,
+            EmailCampaign.status == 'queued',
+            EmailCampaign.run_id.is_(None)
+        ).update({
+            EmailCampaign.status: 'running',
+            EmailCampaign.run_id: run_id,
+            EmailCampaign.heartbeat_at: datetime.now(),
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return
+
+        config = app.config
+        batch_size = config.get('BULK_MAIL_BATCH_SIZE', 50)
+        concurrency = max(1, config.get('BULK_MAIL_CONCURRENCY', 2))
+        bucket = TokenBucket(config.get('BULK_MAIL_RATE_PER_SECOND', 1), config.get('BULK_MAIL_BURST', 5))
+
+        campaign = EmailCampaign.query.get(campaign_id)
+        # Snapshot nội dung: các thread gửi không được chạm vào ORM object của session này
+        content = {'subject': campaign.subject, 'body': campaign.body}
+        if not campaign.started_at:
+            campaign.started_at = datetime.now()
+            db.session.commit()
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency,
+                                    thread_name_prefix=f'campaign-{campaign_id}') as pool:
+                while True:
+                    db.session.refresh(campaign)
+                    if campaign.status != 'running' or campaign.run_id != run_id:
+                        break  # paused / cancelled / đã có lần chạy khác
+
+                    batch = _next_batch(campaign, batch_size)
+                    if not batch:
+                        EmailCampaign.query.filter_by(id=campaign_id, status='running', run_id=run_id).update({
+                            EmailCampaign.status: 'completed',
+                            EmailCampaign.finished_at: datetime.now(),
+                        }, synchronize_session=False)
+                        db.session.commit()
+                        break
+
+                    snapshot = [{'id': r.id, 'email': r.email, 'username': r.username} for r in batch]
+                    chunks = [snapshot[i::concurrency] for i in range(concurrency) if snapshot[i::concurrency]]
+                    futures = [pool.submit(_send_chunk, app, content, chunk, bucket) for chunk in chunks]
+                    results = [item for f in futures for item in f.result()]
+
+                    now = datetime.now()
+                    sent_ids = [rid for rid, err in results if err is None]
+                    if sent_ids:
+                        EmailCampaignRecipient.query.filter(
+                            EmailCampaignRecipient.id.in_(sent_ids)
+                        ).update({EmailCampaignRecipient.status: 'sent',
+                                  EmailCampaignRecipient.sent_at: now}, synchronize_session=False)
+                    failed = [(rid, err) for rid, err in results if err is not None]
+                    for rid, err in failed:
+                        EmailCampaignRecipient.query.filter_by(id=rid).update({
+                            EmailCampaignRecipient.status: 'failed',
+                            EmailCampaignRecipient.error: err,
+                        }, synchronize_session=False)
+
+                    EmailCampaign.query.filter_by(id=campaign_id).update({
+                        EmailCampaign.sent_count: EmailCampaign.sent_count + len(sent_ids),
+                        EmailCampaign.failed_count: EmailCampaign.failed_count + len(failed),
+                        EmailCampaign.heartbeat_at: now,
+                    }, synchronize_session=False)
+                    db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Lỗi khi chạy chiến dịch email {campaign_id}: {e}")
+            EmailCampaign.query.filter_by(id=campaign_id, status='running', run_id=run_id).update(
+                {EmailCampaign.status: 'paused'}, synchronize_session=False)
+            db.session.commit()
+        finally:
+            # Trả token: từ giờ resume được phép claim chiến dịch
+            EmailCampaign.query.filter_by(id=campaign_id, run_id=run_id).update(
+                {EmailCampaign.run_id: None}, synchronize_session=False)
+            db.session.commit()
@@ -0,0 +1,316 @@
+"""catalog_import_service.py
+
+Import sách hàng loạt (bộ sưu tập quyên góp hàng nghìn cuốn) từ file CSV hoặc JSON.
+
+Luồng xử lý:
+1. Admin upload file -> lưu xuống SHARED_STATE_DIR/imports, tạo dòng CatalogImport (queued).
+2. Background thread đọc file theo kiểu streaming (csv.DictReader / JSON Lines / mảng JSON giải mã dần),
+   không load toàn bộ file vào bộ nhớ.
+3. Mỗi dòng được chuẩn hoá và kiểm tra: title, author bắt buộc; category phải khớp CATEGORY_MAP (chấp nhận
+   mã như `y_hoc` hoặc tên hiển thị như `Y học`, lưu tên hiển thị giống form thêm sách); quantity >= 1.
+4. Trùng lặp theo (tựa, tác giả) không phân biệt hoa thường: trùng trong file thì bỏ qua dòng sau; trùng với
+   sách đã có thì bỏ qua, hoặc cập nhật thông tin nếu bật `update_existing`.
+5. Ghi theo batch CATALOG_IMPORT_BATCH_SIZE bằng executemany (INSERT/UPDATE của SQLAlchemy Core), mỗi batch
+   một transaction; bộ đếm dashboard được cộng trong cùng transaction (stats_service.apply_deltas), phiên bản
+   catalog (catalog_version.py) được tăng sau mỗi batch.
+6. Xong thì chỉ các sách mới/thay đổi được đưa vào RAG index (routes.chatbot.index_books), không build_index lại
+   toàn bộ. Id sách mới được lấy ngay trong transaction của từng batch, nên sách admin thêm trong lúc import không
+   bị tính nhầm, và import lỗi giữa chừng vẫn index các batch đã commit.
+
+Tiến độ (số dòng đã xử lý, thêm, cập nhật, trùng, lỗi) được ghi vào CatalogImport sau mỗi batch.
+"""
+
+import csv
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+import catalog_version
+from config import CATEGORY_MAP
+from models import db, Book, CatalogImport
+from stats_service import apply_deltas
+
+FORMATS = ('csv', 'json')
+# Số lỗi tối đa lưu lại để hiển thị
+MAX_ERRORS = 50
+# Các cột được cập nhật khi sách đã có và update_existing=True (không đụng tới quantity/available_quantity)
+UPDATABLE_FIELDS = ('category', 'description', 'image_url')
+
+_CATEGORY_LOOKUP = {}
+for _code, _name in CATEGORY_MAP.items():
+    _CATEGORY_LOOKUP[_code.lower()] = _name
+    _CATEGORY_LOOKUP[_name.lower()] = _name
+
+
+def _dedupe_key(title, author):
+    return (' '.join(title.split()).lower(), ' '.join(author.split()).lower())
+
+
+def iter_json_records(text_stream, chunk_size=65536):
+    """Đọc JSON Lines hoặc một mảng JSON `[{...}, {...}]` theo từng object, không đọc hết file."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    in_array = None
+    eof = False
+    while True:
+        stripped = buffer.lstrip()
+        if in_array is None and stripped:
+            in_array = stripped[0] == '['
+            buffer = stripped[1:] if in_array else stripped
+            continue
+        # Bỏ khoảng trắng / dấu phẩy / dấu đóng mảng giữa các object
+        buffer = buffer.lstrip(' \t\r\n,')
+        if in_array and buffer.startswith(']'):
+            return
+        if buffer:
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                record = None
+            if record is not None:
+                buffer = buffer[end:]
+                yield record
+                continue
+        if eof:
+            return
+        chunk = text_stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+
+def iter_records(path, file_format):
+    """Generator (số dòng, dict) từ file CSV hoặc JSON."""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if file_format == 'csv':
+            for line_no, row in enumerate(csv.DictReader(f), start=2):  # dòng 1 là header
+                yield line_no, row
+        else:
+            for index, record in enumerate(iter_json_records(f), start=1):
+                yield index, record
+
+
+def normalize_record(record):
+    """Chuẩn hoá và kiểm tra một dòng.
+
+    Returns:
+        tuple: (book_dict, None) nếu hợp lệ, hoặc (None, lý do lỗi)
+    """
+    if not isinstance(record, dict):
+        return None, "Dòng không phải object"
+    record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+
+    title = str(record.get('title') or '').strip()
+    author = str(record.get('author') or '').strip()
+    if not title or not author:
+        return None, "Thiếu tựa sách hoặc tác giả"
+    if len(title) > 150 or len(author) > 100:
+        return None, "Tựa sách (tối đa 150 ký tự) hoặc tác giả (tối đa 100 ký tự) quá dài"
+
+    category_raw = str(record.get('category') or '').strip()
+    category = _CATEGORY_LOOKUP.get(category_raw.lower())
+    if not category:
+        return None, f"Thể loại không hợp lệ: '{category_raw}'"
+
+    try:
+        quantity = int(str(record.get('quantity') or 1).strip())
+    except ValueError:
+        return None, f"Số lượng không hợp lệ: '{record.get('quantity')}'"
+    if quantity < 1:
+        return None, "Số lượng phải >= 1"
+
+    image_url = str(record.get('image_url') or '').strip() or None
+    if image_url and len(image_url) > 255:
+        return None, "image_url quá dài (tối đa 255 ký tự)"
+
+    return {
+        'title': title,
+        'author': author,
+        'category': category,
+        'quantity': quantity,
+        'available_quantity': quantity,
+        'image_url': image_url,
+        'description': str(record.get('description') or '').strip() or None,
+        'is_active': True,
+        'views_count': 0,
+    }, None
+
+
+def _existing_books():
+    """Map (tựa, tác giả) -> (id, {field: value}) của các sách đã có (chỉ các cột cần so sánh)."""
+    rows = db.session.query(Book.id, Book.title, Book.author, *[getattr(Book, f) for f in UPDATABLE_FIELDS])
+    return {_dedupe_key(r[1], r[2]): (r[0], dict(zip(UPDATABLE_FIELDS, r[3:]))) for r in rows}
+
+
+def create_import(file_storage, update_existing=False, created_by=None):
+    """Lưu file upload và tạo job import.
+
+    Returns:
+        tuple: (job, success, message)
+    """
+    filename = os.path.basename(file_storage.filename or '')
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    file_format = 'json' if ext in ('json', 'jsonl') else ext
+    if file_format not in FORMATS:
+        return None, False, "Chỉ hỗ trợ file .csv, .json hoặc .jsonl."
+
+    import_dir = os.path.join(current_app.config['SHARED_STATE_DIR'], 'imports')
+    os.makedirs(import_dir, exist_ok=True)
+    path = os.path.join(import_dir, f'{uuid.uuid4().hex}.{ext}')
+    file_storage.save(path)
+
+    job = CatalogImport(filename=filename, file_format=file_format, file_path=path,
+                        update_existing=update_existing, created_by=created_by)
+    db.session.add(job)
+    db.session.commit()
+    return job, True, "Đã nhận file, đang import trong nền."
+
+
+def start_import(job_id):
+    """Chạy job import trong background thread."""
+    app = current_app._get_current_object()
+    worker = threading.Thread(target=run_import, args=(app, job_id), name=f'catalog-import-{job_id}', daemon=True)
+    worker.start()
+
+
+def _flush_batch(inserts, updates):
+    """Ghi một batch bằng executemany và cập nhật tiến độ trong cùng transaction. Trả về id sách đã thêm/cập nhật."""
+    table = Book.__table__
+    inserted_ids = []
+    if inserts:
+        floor_id = db.session.query(db.func.max(Book.id)).scalar() or 0
+        db.session.execute(table.insert(), inserts)
+        apply_deltas(db.session.connection(), {'total_books': len(inserts)})
+        # executemany không trả về id: đọc lại trong cùng transaction các dòng vừa thêm (id mới hơn và đúng
+        # (tựa, tác giả) của batch), để không lẫn sách admin thêm cùng lúc
+        keys = {_dedupe_key(b['title'], b['author']) for b in inserts}
+        rows = db.session.query(Book.id, Book.title, Book.author).filter(
+            Book.id > floor_id, Book.title.in_({b['title'] for b in inserts})
+        )
+        inserted_ids = [book_id for book_id, title, author in rows if _dedupe_key(title, author) in keys]
+    if updates:
+        stmt = table.update().where(table.c.id == bindparam('b_id')).values(
+            {field: bindparam(field) for field in UPDATABLE_FIELDS}
+        )
+        db.session.execute(stmt, updates)
+    db.session.commit()
+    if inserts or updates:
+        # executemany không đi qua listener ORM: báo catalog đổi cho các worker (title_matcher)
+        catalog_version.bump()
+    return inserted_ids + [u['b_id'] for u in updates]
+
+
+def run_import(app, job_id):
+    """Worker: đọc file, kiểm tra, ghi theo batch, rồi index RAG các sách mới/thay đổi."""
+    with app.app_context():
+        claimed = CatalogImport.query.filter_by(id=job_id, status='queued').update(
+            {CatalogImport.status: 'running', CatalogImport.started_at: datetime.now()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return
+
+        job = CatalogImport.query.get(job_id)
+        batch_size = app.config.get('CATALOG_IMPORT_BATCH_SIZE', 500)
+        errors = []
+        changed_ids = []
+        try:
+            existing = _existing_books()
+            seen = set()
+            inserts, updates = [], []
+            counts = {'processed_rows': 0, 'inserted_count': 0, 'updated_count': 0,
+                      'duplicate_count': 0, 'invalid_count': 0}
+
+            for line_no, record in iter_records(job.file_path, job.file_format):
+                counts['processed_rows'] += 1
+                book, error = normalize_record(record)
+                if error:
+                    counts['invalid_count'] += 1
+                    if len(errors) < MAX_ERRORS:
+                        errors.append({'row': line_no, 'error': error})
+                    continue
+
+                key = _dedupe_key(book['title'], book['author'])
+                if key in seen:
+                    counts['duplicate_count'] += 1
+                    continue
+                seen.add(key)
+
+                if key in existing:
+                    book_id, current = existing[key]
+                    changed = {f: book[f] for f in UPDATABLE_FIELDS if book[f] is not None and book[f] != current[f]}
+                    if job.update_existing and changed:
+                        updates.append({'b_id': book_id, **{f: changed.get(f, current[f]) for f in UPDATABLE_FIELDS}})
+                        counts['updated_count'] += 1
+                    else:
+                        counts['duplicate_count'] += 1
+                else:
+                    inserts.append(book)
+                    counts['inserted_count'] += 1
+
+                if len(inserts) + len(updates) >= batch_size:
+                    changed_ids += _flush_batch(inserts, updates)
+                    inserts, updates = [], []
+                    for field, value in counts.items():
+                        setattr(job, field, value)
+                    db.session.commit()
+
+            changed_ids += _flush_batch(inserts, updates)
+            for field, value in counts.items():
+                setattr(job, field, value)
+            job.errors = json.dumps(errors, ensure_ascii=False) if errors else None
+            db.session.commit()
+            job.status = 'completed'
+        except Exception as e:
+            db.session.rollback()
+            job = CatalogImport.query.get(job_id)
+            errors.append({'row': None, 'error': str(e)[:500]})
+            job.errors = json.dumps(errors[-MAX_ERRORS:], ensure_ascii=False)
+            job.status = 'failed'
+            print(f"Lỗi import sách (job {job_id}): {e}")
+        finally:
+            # Các batch đã commit vẫn được index kể cả khi import dừng giữa chừng
+            job.indexed_count = _index_changed_books(changed_ids)
+            job.finished_at = datetime.now()
+            db.session.commit()
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+
+
+def _index_changed_books(book_ids):
+    """Đưa các sách mới/thay đổi vào RAG index. Trả về số sách đã gửi index (0 nếu RAG chưa sẵn sàng)."""
+    if not book_ids:
+        return 0
+    from routes.chatbot import index_books
+    success, message = index_books(book_ids)
+    if not success:
+        print(f"Không index được sách mới import: {message}")
+        return 0
+    return len(book_ids)
+
+
+def import_progress(job):
+    """Dict tiến độ để hiển thị / trả JSON."""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'processed': job.processed_rows or 0,
+        'inserted': job.inserted_count or 0,
+        'updated': job.updated_count or 0,
+        'duplicates': job.duplicate_count or 0,
+        'invalid': job.invalid_count or 0,
+        'indexed': job.indexed_count or 0,
+        'errors': json.loads(job.errors) if job.errors else [],
+        'created_at': job.created_at.strftime('%d/%m/%Y %H:%M') if job.created_at else None,
+    }
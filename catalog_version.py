@@ -0,0 +1,105 @@
+"""catalog_version.py
+
+Phiên bản catalog sách dùng chung giữa các worker gunicorn — để các cấu trúc/cache dựng sẵn trong bộ nhớ của mỗi
+worker biết khi nào cần dựng lại mà không phải truy vấn DB.
+
+Hai phiên bản độc lập:
+- CATALOG: thêm/xóa Book hoặc đổi tựa, tác giả, thể loại, mô tả, is_active (bộ so khớp tựa sách, title_matcher.py).
+- AVAILABILITY: thêm/xóa Book hoặc đổi quantity, available_quantity, is_active — tức mọi lượt mượn/duyệt/trả
+  (cache tồn kho, availability_service.py). views_count không tính: lượt xem đổi liên tục, cache tự hết hạn theo TTL.
+
+- Phiên bản = mtime (ns) của một file nhỏ trong SHARED_STATE_DIR/versions/ (tmpfs); đọc chỉ tốn một os.stat().
+- Listener session: thay đổi qua ORM được ghi nhận lúc flush và phiên bản chỉ tăng sau khi commit (rollback thì bỏ).
+- Các đường ghi không qua ORM: import hàng loạt gọi bump() sau mỗi batch; UPDATE bằng Core trong một transaction
+  gọi mark_changed() để tăng phiên bản khi transaction đó commit.
+"""
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import db, Book
+
+CATALOG = 'catalog'
+AVAILABILITY = 'availability'
+WATCHED_FIELDS = {
+    CATALOG: ('title', 'author', 'category', 'description', 'is_active'),
+    AVAILABILITY: ('quantity', 'available_quantity', 'is_active'),
+}
+
+_state = {'dir': None}
+_bump_lock = threading.Lock()
+
+
+def _path(name):
+    return os.path.join(_state['dir'], name)
+
+
+def current(name=CATALOG):
+    """Phiên bản hiện tại (0 nếu chưa từng tăng hoặc chưa cấu hình)."""
+    if _state['dir'] is None:
+        return 0
+    try:
+        return os.stat(_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump(name=CATALOG):
+    """Tăng phiên bản: ghi lại file với mtime mới (luôn lớn hơn giá trị cũ)."""
+    if _state['dir'] is None:
+        return
+    path = _path(name)
+    with _bump_lock:
+        previous = current(name)
+        stamp = max(time.time_ns(), previous + 1)
+        with open(path, 'w') as f:
+            f.write(str(stamp))
+        os.utime(path, ns=(stamp, stamp))
+
+
+def mark_changed(name, session=None):
+    """Ghi nhận phiên bản `name` cần tăng khi transaction hiện tại commit (dùng cho UPDATE không qua ORM)."""
+    (session or db.session).info.setdefault('changed_versions', set()).add(name)
+
+
+def _changed_versions(session):
+    changed = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Book):
+            return set(WATCHED_FIELDS)
+    for obj in session.dirty:
+        if isinstance(obj, Book):
+            attrs = sa_inspect(obj).attrs
+            for name, fields in WATCHED_FIELDS.items():
+                if name not in changed and any(attrs[field].history.has_changes() for field in fields):
+                    changed.add(name)
+    return changed
+
+
+def _before_flush(session, flush_context, instances):
+    changed = _changed_versions(session)
+    if changed:
+        session.info.setdefault('changed_versions', set()).update(changed)
+
+
+def _after_commit(session):
+    for name in session.info.pop('changed_versions', None) or ():
+        bump(name)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    session.info.pop('changed_versions', None)
+
+
+def register_listeners(app):
+    """Đặt thư mục phiên bản và gắn listener vào session (gọi một lần lúc khởi động app)."""
+    directory = os.path.join(app.config['SHARED_STATE_DIR'], 'versions')
+    os.makedirs(directory, exist_ok=True)
+    _state['dir'] = directory
+    for name, fn in (('before_flush', _before_flush), ('after_commit', _after_commit),
+                     ('after_soft_rollback', _after_soft_rollback)):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
@@ -0,0 +1,104 @@
+"""circulation_service.py
+
+Bộ lọc / sắp xếp danh sách mượn (admin.borrows, export) và số lượng theo từng bộ lọc.
+
+- Bộ lọc trạng thái: pending, borrowing, returned, overdue (quá hạn), due_soon (đến hạn trong N ngày).
+  overdue / due_soon được tính trong SQL với điều kiện
+  `status = 'approved' AND return_date IS NULL AND expected_return_date <op> :mốc`, khớp thứ tự cột của index
+  `ix_borrow_status_return_expected (status, return_date, expected_return_date)` — DB chỉ quét đúng khoảng
+  cần thiết thay vì toàn bộ lịch sử mượn.
+- filter_counts(): số lượt của mỗi tab, cache trong bộ nhớ tối đa BORROW_COUNT_CACHE_SECONDS. Khoá cache gồm
+  `dashboard_stats.updated_at` (được cập nhật trong cùng transaction với mọi thao tác ghi Borrow, xem
+  stats_service.py), nên cache tự hết hiệu lực khi có mượn/duyệt/trả ở bất kỳ worker nào; TTL chỉ còn để
+  phản ánh các lượt chuyển sang quá hạn theo thời gian.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, Book, Borrow, DashboardStats, User
+
+STATUS_FILTERS = ('pending', 'borrowing', 'overdue', 'due_soon', 'returned')
+SORTS = {
+    'newest': lambda: (Borrow.borrow_date.desc(),),
+    'oldest': lambda: (Borrow.borrow_date.asc(),),
+    'due': lambda: (Borrow.expected_return_date.asc(), Borrow.id.asc()),
+}
+# Sắp xếp mặc định theo bộ lọc: quá hạn lâu nhất / sắp đến hạn nhất lên đầu
+DEFAULT_SORT = {'overdue': 'due', 'due_soon': 'due'}
+
+_counts_cache = {}
+_counts_lock = threading.Lock()
+
+
+def due_soon_days(value=None):
+    default = current_app.config.get('BORROW_DUE_SOON_DAYS', 3)
+    try:
+        days = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        days = default
+    return max(1, min(days, 60))
+
+
+def _open_loans(query):
+    return query.filter(Borrow.status == 'approved', Borrow.return_date.is_(None))
+
+
+def filter_status(query, status, now=None, due_days=None):
+    now = now or datetime.now()
+    if status == 'pending':
+        query = query.filter(Borrow.status == 'pending')
+    elif status == 'borrowing':
+        query = _open_loans(query)
+    elif status == 'returned':
+        query = query.filter(Borrow.return_date != None)
+    elif status == 'overdue':
+        query = _open_loans(query).filter(Borrow.expected_return_date < now)
+    elif status == 'due_soon':
+        query = _open_loans(query).filter(
+            Borrow.expected_return_date >= now,
+            Borrow.expected_return_date < now + timedelta(days=due_soon_days(due_days))
+        )
+    return query
+
+
+def filter_borrows(query, user_filter='', book_filter='', status='', due_days=None, now=None):
+    """Áp dụng bộ lọc của trang admin.borrows (query phải đã join User và Book)."""
+    if user_filter:
+        query = query.filter(User.username.like(f'%{user_filter}%'))
+    if book_filter:
+        query = query.filter(Book.title.like(f'%{book_filter}%'))
+    return filter_status(query, status, now=now, due_days=due_days)
+
+
+def order_borrows(query, sort='', status=''):
+    sort = sort if sort in SORTS else DEFAULT_SORT.get(status, 'newest')
+    return query.order_by(*SORTS[sort]())
+
+
+def _stats_version():
+    return db.session.query(DashboardStats.updated_at).filter(DashboardStats.id == 1).scalar()
+
+
+def filter_counts(due_days=None):
+    """Số lượt mượn của mỗi bộ lọc trạng thái (không kèm lọc user/sách), có cache."""
+    days = due_soon_days(due_days)
+    key = (days, _stats_version())
+    ttl = current_app.config.get('BORROW_COUNT_CACHE_SECONDS', 60)
+    with _counts_lock:
+        entry = _counts_cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+    now = datetime.now()
+    counts = {'all': Borrow.query.count()}
+    for status in STATUS_FILTERS:
+        counts[status] = filter_status(Borrow.query, status, now=now, due_days=days).count()
+
+    with _counts_lock:
+        _counts_cache.clear()  # chỉ giữ phiên bản mới nhất
+        _counts_cache[key] = (time.monotonic() + ttl, counts)
+    return counts
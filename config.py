@@ -10,6 +10,7 @@ Ghi chú:
 """
 
 import os
+import tempfile
 from flask import Flask
 from models import db
 from dotenv import load_dotenv
@@ -49,6 +50,76 @@ app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER') or os.geten
 # OTP expiry time in minutes
 app.config['OTP_EXPIRY_MINUTES'] = int(os.getenv('OTP_EXPIRY_MINUTES', 10))
 app.config['RESET_CODE_EXPIRY_MINUTES'] = int(os.getenv('RESET_CODE_EXPIRY_MINUTES', 15))
+# Bulk announcement mailer: tốc độ gửi (email/giây), burst, số kết nối SMTP song song, kích thước batch
+app.config['BULK_MAIL_RATE_PER_SECOND'] = float(os.getenv('BULK_MAIL_RATE_PER_SECOND', 1))
+app.config['BULK_MAIL_BURST'] = int(os.getenv('BULK_MAIL_BURST', 5))
+app.config['BULK_MAIL_CONCURRENCY'] = int(os.getenv('BULK_MAIL_CONCURRENCY', 2))
+app.config['BULK_MAIL_BATCH_SIZE'] = int(os.getenv('BULK_MAIL_BATCH_SIZE', 50))
+# Worker không báo heartbeat quá số phút này thì coi như đã chết (cho phép resume)
+app.config['BULK_MAIL_STALE_MINUTES'] = int(os.getenv('BULK_MAIL_STALE_MINUTES', 5))
+# Thư mục trạng thái dùng chung giữa các worker trên cùng máy (ưu tiên tmpfs /dev/shm để nằm trong RAM)
+_default_shared_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+app.config['SHARED_STATE_DIR'] = os.getenv('SHARED_STATE_DIR', os.path.join(_default_shared_dir, 'library_app'))
+# OTP store: 'shared' (TTL trong bộ nhớ, dùng chung giữa các worker) hoặc 'database' (bảng EmailVerification/PhoneVerification)
+app.config['OTP_STORE_BACKEND'] = os.getenv('OTP_STORE_BACKEND', 'shared')
+# Chế độ email mặc định cho user chưa chọn: 'digest' (gộp nhắc nhở + thông báo thành 1 email/ngày) hoặc 'immediate'
+app.config['DEFAULT_EMAIL_MODE'] = os.getenv('DEFAULT_EMAIL_MODE', 'digest')
+# Retention (dọn dẹp OTP/mã reset hết hạn, thông báo cũ): kích thước batch xóa, thư mục lưu trữ (để trống = không lưu)
+app.config['RETENTION_BATCH_SIZE'] = int(os.getenv('RETENTION_BATCH_SIZE', 500))
+app.config['RETENTION_ARCHIVE_DIR'] = os.getenv('RETENTION_ARCHIVE_DIR', '')
+app.config['NOTIFICATION_RETENTION_DAYS'] = int(os.getenv('NOTIFICATION_RETENTION_DAYS', 90))
+# Chu kỳ (phút) đếm lại chính xác bộ đếm dashboard và số lượt quá hạn (stats_service)
+app.config['STATS_RECONCILE_MINUTES'] = int(os.getenv('STATS_RECONCILE_MINUTES', 15))
+# Analytics (analytics_service): số dòng Borrow mỗi chunk khi trích xuất, thời gian cache kết quả (giây)
+app.config['ANALYTICS_CHUNK_SIZE'] = int(os.getenv('ANALYTICS_CHUNK_SIZE', 5000))
+app.config['ANALYTICS_CACHE_SECONDS'] = int(os.getenv('ANALYTICS_CACHE_SECONDS', 300))
+# Audit log: số tháng giữ trong DB (tính cả tháng hiện tại), thư mục lưu file nén các tháng cũ hơn
+app.config['AUDIT_HOT_MONTHS'] = int(os.getenv('AUDIT_HOT_MONTHS', 6))
+app.config['AUDIT_ARCHIVE_DIR'] = os.getenv('AUDIT_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive', 'audit'))
+# Import sách hàng loạt: số dòng mỗi batch INSERT/UPDATE (executemany)
+app.config['CATALOG_IMPORT_BATCH_SIZE'] = int(os.getenv('CATALOG_IMPORT_BATCH_SIZE', 500))
+# Gemini embedding (embedding_service): số văn bản mỗi lần gọi API, số lần gọi song song,
+# giới hạn request/phút cho MỖI worker process, số lần thử lại khi gặp 429/5xx
+app.config['EMBEDDING_BATCH_SIZE'] = int(os.getenv('EMBEDDING_BATCH_SIZE', 100))
+app.config['EMBEDDING_CONCURRENCY'] = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+app.config['EMBEDDING_REQUESTS_PER_MINUTE'] = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', 1500))
+app.config['EMBEDDING_MAX_RETRIES'] = int(os.getenv('EMBEDDING_MAX_RETRIES', 5))
+# Cache embedding câu hỏi chatbot (embedding_cache): số mục LRU mỗi process, file SQLite dùng chung ('' = tắt), số dòng tối đa
+app.config['QUERY_EMBEDDING_CACHE_SIZE'] = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', 1000))
+app.config['QUERY_EMBEDDING_CACHE_PATH'] = os.getenv('QUERY_EMBEDDING_CACHE_PATH',
+                                                     os.path.join(BASE_DIR, 'chroma_db', 'query_embeddings.sqlite3'))
+app.config['QUERY_EMBEDDING_CACHE_MAX_ROWS'] = int(os.getenv('QUERY_EMBEDDING_CACHE_MAX_ROWS', 50000))
+# Cache tồn kho theo id sách (availability_service): TTL giây; mượn/trả làm mới ngay qua catalog_version
+app.config['AVAILABILITY_CACHE_SECONDS'] = int(os.getenv('AVAILABILITY_CACHE_SECONDS', 10))
+# Cache câu trả lời chatbot theo ngữ nghĩa (response_cache): ngưỡng cosine similarity, TTL giây, số mục mỗi worker (0 = tắt)
+app.config['CHAT_CACHE_SIMILARITY'] = float(os.getenv('CHAT_CACHE_SIMILARITY', 0.95))
+app.config['CHAT_CACHE_TTL_SECONDS'] = int(os.getenv('CHAT_CACHE_TTL_SECONDS', 600))
+app.config['CHAT_CACHE_MAX_ENTRIES'] = int(os.getenv('CHAT_CACHE_MAX_ENTRIES', 500))
+# RAG index (rag_index_service): gom các thay đổi sách của admin trong bao nhiêu giây trước khi embedding lại
+app.config['RAG_REINDEX_DELAY_SECONDS'] = int(os.getenv('RAG_REINDEX_DELAY_SECONDS', 5))
+# Xóa tài khoản hàng loạt (account_service): số user mỗi transaction
+app.config['ACCOUNT_REMOVAL_BATCH_SIZE'] = int(os.getenv('ACCOUNT_REMOVAL_BATCH_SIZE', 200))
+# Đếm số câu SQL mỗi request (query_counter.py): header X-Query-Count và ngưỡng cảnh báo trong log
+app.config['QUERY_COUNTER_HEADER'] = os.getenv('QUERY_COUNTER_HEADER', 'False') == 'True'
+app.config['QUERY_COUNT_WARN'] = int(os.getenv('QUERY_COUNT_WARN', 30))
+# Metrics (metrics.py): chu kỳ ghi snapshot của mỗi worker, chu kỳ lấy mẫu gauge từ DB (giây),
+# token cho /metrics (để trống = chỉ session admin)
+app.config['METRICS_FLUSH_SECONDS'] = int(os.getenv('METRICS_FLUSH_SECONDS', 5))
+app.config['METRICS_SAMPLE_SECONDS'] = int(os.getenv('METRICS_SAMPLE_SECONDS', 15))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+# Thông báo realtime (SSE, notification_service.py): số kết nối tối đa mỗi worker (phải < số thread gthread),
+# thời gian sống của một kết nối, chu kỳ heartbeat, chu kỳ relay sự kiện giữa các worker (giây)
+app.config['NOTIFICATION_STREAM_MAX'] = int(os.getenv('NOTIFICATION_STREAM_MAX', 48))
+app.config['NOTIFICATION_STREAM_SECONDS'] = int(os.getenv('NOTIFICATION_STREAM_SECONDS', 300))
+app.config['NOTIFICATION_HEARTBEAT_SECONDS'] = int(os.getenv('NOTIFICATION_HEARTBEAT_SECONDS', 25))
+app.config['NOTIFICATION_RELAY_SECONDS'] = float(os.getenv('NOTIFICATION_RELAY_SECONDS', 1))
+# Gộp thông báo cùng loại (vd. yêu cầu mượn gửi admin) chưa đọc trong khoảng thời gian này (phút)
+app.config['NOTIFICATION_COALESCE_MINUTES'] = int(os.getenv('NOTIFICATION_COALESCE_MINUTES', 30))
+# Chu kỳ (phút) đếm lại bộ đếm thông báo chưa đọc (notification_counter)
+app.config['NOTIFICATION_COUNTER_RECONCILE_MINUTES'] = int(os.getenv('NOTIFICATION_COUNTER_RECONCILE_MINUTES', 60))
+# Trang admin.borrows: mặc định "sắp đến hạn" trong bao nhiêu ngày, thời gian cache số lượng theo bộ lọc (giây)
+app.config['BORROW_DUE_SOON_DAYS'] = int(os.getenv('BORROW_DUE_SOON_DAYS', 3))
+app.config['BORROW_COUNT_CACHE_SECONDS'] = int(os.getenv('BORROW_COUNT_CACHE_SECONDS', 60))
 # Loan period in days
 LOAN_PERIOD_DAYS = 14
 
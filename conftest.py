@@ -0,0 +1,28 @@
+"""conftest.py
+
+Cấu hình pytest dùng chung.
+
+- Khởi động LocalSMTPSink (smtp_sink.py) NGAY KHI conftest được import, trước khi các file test
+  import `config`/`app`, và trỏ MAIL_* về sink qua biến môi trường. Nhờ vậy test không bao giờ
+  gửi email thật tới Gmail (load_dotenv không ghi đè biến môi trường đã có).
+- Fixture `smtp_sink`: trả về sink đã được reset cho từng test.
+"""
+
+import os
+
+import pytest
+
+from smtp_sink import LocalSMTPSink
+
+_sink = LocalSMTPSink().start()
+os.environ.update(_sink.mail_config())
+
+
+@pytest.fixture
+def smtp_sink():
+    _sink.reset()
+    yield _sink
+
+
+def pytest_unconfigure(config):
+    _sink.stop()
@@ -0,0 +1,177 @@
+"""digest_service.py
+
+Service gộp email nhắc nhở theo ngày (digest).
+
+Trước đây `check_overdue_books` gửi một email cho MỖI lượt mượn sắp đến hạn, nên user mượn 5 cuốn
+nhận 5 email. Digest gộp tất cả nhắc nhở trả sách và thông báo (Notification) chưa đọc của một user
+thành MỘT email mỗi ngày.
+
+Chức năng:
+- get_email_mode / set_email_mode: tuỳ chọn của user ('immediate' hoặc 'digest').
+- run_daily_digest: job hằng ngày (gọi từ app.check_overdue_books).
+
+Ghi chú:
+- User chưa có dòng NotificationPreference dùng DEFAULT_EMAIL_MODE (mặc định 'digest').
+- Mỗi user digest chỉ nhận tối đa một email mỗi ngày: trước khi gửi phải "claim" bằng UPDATE có điều kiện
+  trên `last_digest_at`, nên nhiều worker (gunicorn -w 4, mỗi worker có scheduler riêng) không gửi trùng.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from email_service import send_digest_email, send_return_reminder_email
+from models import db, Book, Borrow, Notification, NotificationPreference, User
+
+EMAIL_MODES = ('immediate', 'digest')
+# Số thông báo tối đa liệt kê trong một email digest
+MAX_NOTIFICATIONS_PER_DIGEST = 20
+
+
+def default_email_mode():
+    mode = current_app.config.get('DEFAULT_EMAIL_MODE', 'digest')
+    return mode if mode in EMAIL_MODES else 'digest'
+
+
+def get_email_mode(user_id):
+    pref = NotificationPreference.query.get(user_id)
+    return pref.email_mode if pref else default_email_mode()
+
+
+def set_email_mode(user_id, mode):
+    """Lưu tuỳ chọn email của user.
+
+    Returns:
+        tuple: (success, message)
+    """
+    if mode not in EMAIL_MODES:
+        return False, "Tuỳ chọn email không hợp lệ."
+    pref = NotificationPreference.query.get(user_id)
+    if pref:
+        pref.email_mode = mode
+    else:
+        db.session.add(NotificationPreference(user_id=user_id, email_mode=mode))
+    db.session.commit()
+    return True, "Đã lưu tuỳ chọn nhận email."
+
+
+def due_reminders(day):
+    """Các lượt mượn chưa trả có hạn trả trong ngày `day`: list (borrow, user, book)."""
+    start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=1)
+    return db.session.query(Borrow, User, Book).join(User, Borrow.user_id == User.id).join(
+        Book, Borrow.book_id == Book.id
+    ).filter(
+        Borrow.return_date >= start,
+        Borrow.return_date < end,
+        Borrow.return_date != None,
+        Borrow.return_condition == None  # Chưa trả
+    ).all()
+
+
+def _claim_digest(user_id, now, day_start):
+    """Đánh dấu user đã nhận digest hôm nay. Trả về False nếu worker khác đã gửi."""
+    if not NotificationPreference.query.get(user_id):
+        try:
+            db.session.add(NotificationPreference(user_id=user_id, email_mode=default_email_mode()))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # worker khác vừa tạo
+
+    claimed = NotificationPreference.query.filter(
+        NotificationPreference.user_id == user_id,
+        NotificationPreference.email_mode == 'digest',
+        or_(NotificationPreference.last_digest_at.is_(None),
+            NotificationPreference.last_digest_at < day_start)
+    ).update({NotificationPreference.last_digest_at: now}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+
+def run_daily_digest(now=None):
+    """Gửi nhắc nhở trả sách (hạn trả vào ngày mai) và thông báo chưa đọc.
+
+    - User 'digest': một email gộp mọi nhắc nhở + thông báo chưa đọc kể từ digest trước (tối đa 1 ngày).
+    - User 'immediate': giữ hành vi cũ, mỗi lượt mượn một email nhắc nhở.
+
+    Returns:
+        dict: thống kê {'digest_emails', 'immediate_emails', 'reminders', 'notifications', 'failed'}
+    """
+    now = now or datetime.now()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    window_start = now - timedelta(days=1)
+    stats = {'digest_emails': 0, 'immediate_emails': 0, 'reminders': 0, 'notifications': 0, 'failed': 0}
+
+    users = {}
+    reminders = defaultdict(list)
+    for borrow, user, book in due_reminders(now + timedelta(days=1)):
+        if user.email:
+            users[user.id] = user
+            reminders[user.id].append((book.title, borrow.return_date))
+    stats['reminders'] = sum(len(items) for items in reminders.values())
+
+    # User có thông báo chưa đọc trong cửa sổ cũng là ứng viên nhận digest
+    notified_ids = {uid for (uid,) in db.session.query(Notification.user_id).filter(
+        Notification.is_read == False,
+        Notification.created_at >= window_start
+    ).distinct()}
+    candidate_ids = set(reminders) | notified_ids
+    if not candidate_ids:
+        return stats
+
+    missing = candidate_ids - set(users)
+    if missing:
+        for user in User.query.filter(User.id.in_(missing), User.email.isnot(None), User.email != '').all():
+            users[user.id] = user
+
+    prefs = {p.user_id: p for p in NotificationPreference.query.filter(
+        NotificationPreference.user_id.in_(list(users))
+    ).all()} if users else {}
+    default_mode = default_email_mode()
+
+    digest_ids = [uid for uid in users if (prefs[uid].email_mode if uid in prefs else default_mode) == 'digest']
+    since = {uid: max(window_start, prefs[uid].last_digest_at or window_start) if uid in prefs else window_start
+             for uid in digest_ids}
+
+    notifications = defaultdict(list)
+    if digest_ids:
+        rows = Notification.query.filter(
+            Notification.user_id.in_(digest_ids),
+            Notification.is_read == False,
+            Notification.created_at >= window_start
+        ).order_by(Notification.created_at.desc()).all()
+        for n in rows:
+            if n.created_at >= since[n.user_id] and len(notifications[n.user_id]) < MAX_NOTIFICATIONS_PER_DIGEST:
+                notifications[n.user_id].append((n.message, n.created_at))
+
+    for uid in digest_ids:
+        if not reminders[uid] and not notifications[uid]:
+            continue
+        if not _claim_digest(uid, now, day_start):
+            continue
+        user = users[uid]
+        print(f"Sending digest to {user.email}: {len(reminders[uid])} reminders, {len(notifications[uid])} notifications")
+        success, message = send_digest_email(user.email, user.username, reminders[uid], notifications[uid])
+        if success:
+            stats['digest_emails'] += 1
+            stats['notifications'] += len(notifications[uid])
+        else:
+            stats['failed'] += 1
+            print(f"Lỗi gửi digest cho {user.email}: {message}")
+
+    for uid, items in reminders.items():
+        if uid in digest_ids:
+            continue
+        user = users[uid]
+        for book_title, return_date in items:
+            print(f"Sending reminder to {user.email} for book {book_title}")
+            success, _ = send_return_reminder_email(user.email, user.username, book_title, return_date)
+            if success:
+                stats['immediate_emails'] += 1
+            else:
+                stats['failed'] += 1
+
+    return stats
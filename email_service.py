@@ -3,7 +3,7 @@
 Service để xử lý gửi email và quản lý OTP/reset codes.
 
 Chức năng:
-- Tạo và lưu OTP code cho email verification
+- Tạo và lưu OTP code cho email verification (qua OTP store, xem otp_store.py)
 - Tạo và lưu reset code cho password reset
 - Gửi email qua Flask-Mail
 - Verify OTP/reset codes
@@ -11,7 +11,9 @@ Chức năng:
 """
 
 from flask_mail import Mail, Message
-from models import db, EmailVerification, PasswordReset, User
+from markupsafe import escape
+from models import db, PasswordReset, User
+from otp_store import get_otp_store
 from datetime import datetime, timedelta
 import random
 import string
@@ -27,37 +29,20 @@ def generate_otp_code(length=6):
 def create_email_verification(email):
     """Tạo OTP code mới cho email verification.
     
+    Lưu trữ qua OTP store (xem otp_store.py), mặc định nằm trong bộ nhớ dùng chung thay vì DB.
+    
     Args:
         email: Email cần xác thực
         
     Returns:
         tuple: (otp_code, success, message)
     """
-    # Kiểm tra rate limiting: tối đa 3 lần trong 10 phút
-    ten_minutes_ago = datetime.now() - timedelta(minutes=10)
-    recent_attempts = EmailVerification.query.filter(
-        EmailVerification.email == email,
-        EmailVerification.created_at >= ten_minutes_ago
-    ).count()
-    
-    if recent_attempts >= 3:
-        return None, False, "Bạn đã gửi quá nhiều yêu cầu. Vui lòng thử lại sau 10 phút."
-    
-    # Xóa các OTP cũ chưa verify của email này
-    EmailVerification.query.filter_by(email=email, verified=False).delete()
-    
-    # Tạo OTP mới
     otp_code = generate_otp_code()
-    expires_at = datetime.now() + timedelta(minutes=10)
-    
-    verification = EmailVerification(
-        email=email,
-        otp_code=otp_code,
-        expires_at=expires_at
-    )
-    
-    db.session.add(verification)
-    db.session.commit()
+    # Rate limiting: tối đa 3 lần trong 10 phút; OTP mới thay thế OTP cũ chưa verify, hết hạn sau 10 phút
+    issued = get_otp_store().issue('email', email, otp_code,
+                                   ttl_seconds=10 * 60, max_sends=3, window_seconds=10 * 60)
+    if not issued:
+        return None, False, "Bạn đã gửi quá nhiều yêu cầu. Vui lòng thử lại sau 10 phút."
     
     return otp_code, True, "OTP đã được tạo thành công."
 
@@ -72,22 +57,14 @@ def verify_otp_code(email, otp_code):
     Returns:
         tuple: (success, message)
     """
-    verification = EmailVerification.query.filter_by(
-        email=email,
-        otp_code=otp_code,
-        verified=False
-    ).first()
+    result = get_otp_store().verify('email', email, otp_code)
     
-    if not verification:
+    if result == 'invalid':
         return False, "Mã OTP không hợp lệ."
     
-    if datetime.now() > verification.expires_at:
+    if result == 'expired':
         return False, "Mã OTP đã hết hạn. Vui lòng yêu cầu mã mới."
     
-    # Đánh dấu đã verify
-    verification.verified = True
-    db.session.commit()
-    
     return True, "Xác thực email thành công!"
 
 
@@ -417,3 +394,57 @@ def send_borrow_rejected_email(email, username, book_title, book_author):
     except Exception as e:
         return False, f"Lỗi khi gửi email: {str(e)}"
 
+
+def send_digest_email(email, username, reminders, notifications):
+    """Gửi email tổng hợp (digest): gộp tất cả nhắc nhở trả sách và thông báo chưa đọc vào một email.
+
+    Args:
+        email: Email người nhận
+        username: Tên người dùng
+        reminders: list (book_title, return_date) các sách sắp đến hạn trả
+        notifications: list (message, created_at) các thông báo chưa đọc
+
+    Returns:
+        tuple: (success, message)
+    """
+    try:
+        # Tựa sách và nội dung thông báo là dữ liệu người dùng/admin nhập: escape trước khi ghép vào HTML
+        reminder_rows = ''.join(
+            f'<li><strong>"{escape(book_title)}"</strong> — hạn trả <span style="color: #856404;">{return_date.strftime("%d/%m/%Y")}</span></li>'
+            for book_title, return_date in reminders
+        )
+        notification_rows = ''.join(
+            f'<li>{escape(message)} <span style="color: #888; font-size: 12px;">({created_at.strftime("%d/%m/%Y %H:%M")})</span></li>'
+            for message, created_at in notifications
+        )
+        reminder_block = f"""
+                <h3 style="color: #333;">📚 Sách cần trả</h3>
+                <div style="background-color: #fff3cd; padding: 15px; border-left: 4px solid #ffc107; margin: 10px 0 20px 0;">
+                    <ul style="margin: 0; padding-left: 20px;">{reminder_rows}</ul>
+                </div>
+                <p>Vui lòng sắp xếp thời gian đến thư viện để trả sách đúng hạn.</p>
+        """ if reminders else ''
+        notification_block = f"""
+                <h3 style="color: #333;">🔔 Thông báo chưa đọc</h3>
+                <ul style="padding-left: 20px;">{notification_rows}</ul>
+        """ if notifications else ''
+
+        msg = Message(
+            subject="Tổng hợp thông báo hằng ngày - Hệ thống Thư viện",
+            recipients=[email],
+            html=f"""
+            <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+                <h2 style="color: #333;">Tổng hợp thông báo</h2>
+                <p>Xin chào <strong>{escape(username)}</strong>,</p>
+                {reminder_block}
+                {notification_block}
+                <p>Bạn có thể chuyển sang nhận email ngay lập tức trong trang Thông tin cá nhân.</p>
+                <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
+                <p style="color: #666; font-size: 12px;">Email này được gửi tự động, vui lòng không trả lời.</p>
+            </div>
+            """
+        )
+        mail.send(msg)
+        return True, "Email tổng hợp đã được gửi thành công."
+    except Exception as e:
+        return False, f"Lỗi khi gửi email: {str(e)}"
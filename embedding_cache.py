@@ -0,0 +1,153 @@
+"""embedding_cache.py
+
+Cache embedding của câu hỏi chatbot (Strategy C trong routes/chatbot.get_rag_context), dùng bởi
+embedding_service.EmbeddingClient.embed_query.
+
+Mỗi tin nhắn tới bước vector search trước đây đều tốn một lượt gọi Gemini để embedding câu hỏi, kể cả các câu hỏi
+lặp lại liên tục ("sách lập trình nào hay"). Embedding của cùng một văn bản với cùng model là cố định, nên:
+
+- Khoá = sha256(model + task_type + câu hỏi đã chuẩn hoá). Chuẩn hoá: Unicode NFC, chữ thường, gộp khoảng trắng,
+  bỏ dấu câu ở cuối — "Sách lập trình nào hay?" và "sách  lập trình nào hay" dùng chung một embedding. Văn bản
+  đem đi embedding cũng là bản đã chuẩn hoá, để giá trị trong cache đúng với khoá.
+- Tầng 1: LRU trong bộ nhớ của process (QUERY_EMBEDDING_CACHE_SIZE mục).
+- Tầng 2: SQLite trên đĩa (QUERY_EMBEDDING_CACHE_PATH, mặc định cạnh chroma_db/) — dùng chung giữa các worker và
+  còn nguyên sau khi restart. Giữ tối đa QUERY_EMBEDDING_CACHE_MAX_ROWS dòng, bỏ các dòng lâu không dùng nhất.
+  Không mở được file thì chỉ dùng tầng bộ nhớ.
+- Tỉ lệ trúng cache: counter `query_embedding_cache_total{result="memory|disk|miss"}` trong metrics.py.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from flask import current_app
+
+from metrics import query_embedding_cache
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = '?!.,;:… '
+
+
+def normalize_query(text):
+    text = unicodedata.normalize('NFC', text or '').lower()
+    return _WHITESPACE.sub(' ', text).strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+def cache_key(model, task_type, normalized):
+    return hashlib.sha256(f'{model}\x1f{task_type}\x1f{normalized}'.encode('utf-8')).hexdigest()
+
+
+class DiskEmbeddingStore:
+    """Bảng query_embedding(key, vector float32, last_used) trong SQLite, an toàn giữa nhiều process."""
+
+    # Số lần ghi giữa hai lần dọn bảng về QUERY_EMBEDDING_CACHE_MAX_ROWS
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_rows):
+        self.path = path
+        self.max_rows = max_rows
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS query_embedding ('
+                     'key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_query_embedding_last_used ON query_embedding (last_used)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT vector FROM query_embedding WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE query_embedding SET last_used = ? WHERE key = ?', (time.time(), key))
+        return array('f', row[0]).tolist()
+
+    def put(self, key, vector):
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO query_embedding (key, vector, last_used) VALUES (?, ?, ?)',
+                     (key, array('f', vector).tobytes(), time.time()))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM query_embedding WHERE key IN (SELECT key FROM query_embedding '
+                         'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_rows,))
+
+
+class QueryEmbeddingCache:
+    """LRU trong bộ nhớ + DiskEmbeddingStore (có thể None)."""
+
+    def __init__(self, max_entries, disk=None):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                query_embedding_cache.inc(result='memory')
+                return vector
+        if self.disk is not None:
+            try:
+                vector = self.disk.get(key)
+            except sqlite3.Error as e:
+                print(f"⚠ Lỗi đọc cache embedding trên đĩa: {e}")
+                vector = None
+            if vector is not None:
+                self._remember(key, vector)
+                query_embedding_cache.inc(result='disk')
+                return vector
+        query_embedding_cache.inc(result='miss')
+        return None
+
+    def put(self, key, vector):
+        self._remember(key, vector)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vector)
+            except sqlite3.Error as e:
+                print(f"⚠ Lỗi ghi cache embedding trên đĩa: {e}")
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_cache():
+    """Cache embedding câu hỏi của process, khởi tạo một lần từ config."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = current_app.config
+                disk = None
+                path = config.get('QUERY_EMBEDDING_CACHE_PATH')
+                if path:
+                    try:
+                        disk = DiskEmbeddingStore(path, config.get('QUERY_EMBEDDING_CACHE_MAX_ROWS', 50000))
+                    except (OSError, sqlite3.Error) as e:
+                        print(f"⚠ Không mở được cache embedding trên đĩa ({e}), chỉ dùng bộ nhớ.")
+                _cache = QueryEmbeddingCache(config.get('QUERY_EMBEDDING_CACHE_SIZE', 1000), disk)
+    return _cache
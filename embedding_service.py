@@ -0,0 +1,129 @@
+"""embedding_service.py
+
+Client gọi Gemini embedding API cho RAG (routes/chatbot.py, rag_index_service.py).
+
+Trước đây GeminiEmbeddingFunction gửi cả danh sách văn bản trong MỘT lần genai.embed_content, gặp lỗi thì trả về
+vector rỗng (làm hỏng collection mà không ai biết) và dùng task_type 'retrieval_document' cho cả câu hỏi. Giờ:
+
+- Tách input thành batch theo giới hạn API (EMBEDDING_BATCH_SIZE, Gemini cho tối đa 100 văn bản/lần) và chạy
+  tối đa EMBEDDING_CONCURRENCY batch song song; thứ tự vector giữ đúng thứ tự input.
+- Mỗi lần gọi API lấy một token từ TokenBucket (EMBEDDING_REQUESTS_PER_MINUTE, tính cho mỗi worker process).
+- Lỗi tạm thời (429, 5xx, timeout, mất kết nối) được thử lại với backoff lũy thừa + jitter (full jitter), tối đa
+  EMBEDDING_MAX_RETRIES lần; lỗi khác hoặc hết lượt thử thì raise EmbeddingError — không bao giờ trả vector rỗng.
+- embed_documents() dùng 'retrieval_document' (khi index), embed_query() dùng 'retrieval_query' (khi tìm kiếm).
+- embed_query() đi qua cache embedding câu hỏi (embedding_cache.py): câu hỏi lặp lại không gọi API.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+from flask import current_app
+
+from embedding_cache import normalize_query, cache_key, get_query_cache
+from rate_limit import TokenBucket
+
+DOCUMENT_TASK = 'retrieval_document'
+QUERY_TASK = 'retrieval_query'
+
+# Mã HTTP đáng thử lại (google.api_core.exceptions.*.code)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class EmbeddingError(Exception):
+    """Không lấy được embedding (hết lượt thử lại hoặc API trả kết quả không hợp lệ)."""
+
+
+def _status_code(error):
+    code = getattr(error, 'code', None)
+    if callable(code):  # lỗi gRPC: code() trả về enum
+        code = getattr(code(), 'value', (None,))[0]
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error):
+    code = _status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+
+class EmbeddingClient:
+    """Client embedding dùng chung trong process (thread-safe).
+
+    Cấu hình đọc từ current_app.config ở mỗi lần gọi; TokenBucket tạo một lần cho cả process.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _rate_limiter(self, config):
+        with self._lock:
+            if self._bucket is None:
+                per_minute = config.get('EMBEDDING_REQUESTS_PER_MINUTE', 1500)
+                self._bucket = TokenBucket(per_minute / 60.0, max(1, config.get('EMBEDDING_CONCURRENCY', 4)))
+            return self._bucket
+
+    def embed_documents(self, texts):
+        """Embedding danh sách văn bản để lưu vào collection. Trả về list vector cùng thứ tự với `texts`."""
+        return self._embed(list(texts), DOCUMENT_TASK)
+
+    def embed_query(self, text):
+        """Embedding một câu hỏi để tìm kiếm (câu hỏi được chuẩn hoá rồi tra cache trước khi gọi API)."""
+        normalized = normalize_query(text) or text
+        cache = get_query_cache()
+        key = cache_key(self.model, QUERY_TASK, normalized)
+        vector = cache.get(key)
+        if vector is None:
+            vector = self._embed([normalized], QUERY_TASK)[0]
+            cache.put(key, vector)
+        return vector
+
+    def _embed(self, texts, task_type):
+        if not texts:
+            return []
+        config = current_app.config
+        batch_size = max(1, config.get('EMBEDDING_BATCH_SIZE', 100))
+        concurrency = max(1, config.get('EMBEDDING_CONCURRENCY', 4))
+        retry = {
+            'bucket': self._rate_limiter(config),
+            'max_retries': config.get('EMBEDDING_MAX_RETRIES', 5),
+            'base_delay': config.get('EMBEDDING_RETRY_BASE_SECONDS', 1.0),
+            'max_delay': config.get('EMBEDDING_RETRY_MAX_SECONDS', 30.0),
+        }
+
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0], task_type, **retry)
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches)),
+                                thread_name_prefix='embedding') as pool:
+            results = pool.map(lambda batch: self._embed_batch(batch, task_type, **retry), batches)
+            return [vector for vectors in results for vector in vectors]
+
+    def _embed_batch(self, batch, task_type, bucket, max_retries, base_delay, max_delay):
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                result = genai.embed_content(model=self.model, content=batch, task_type=task_type)
+                break
+            except Exception as e:
+                if attempt >= max_retries or not _is_retryable(e):
+                    raise EmbeddingError(
+                        f"Embedding {len(batch)} texts failed after {attempt + 1} attempt(s): {e}") from e
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+                attempt += 1
+                time.sleep(delay)
+
+        vectors = result.get('embedding') if isinstance(result, dict) else None
+        if not vectors or len(vectors) != len(batch) or not all(vectors):
+            raise EmbeddingError(f"Embedding API returned missing or empty vectors for {len(batch)} texts")
+        return vectors
@@ -0,0 +1,126 @@
+"""export_service.py
+
+Xuất dữ liệu (borrows, users, audit) cho admin dưới dạng CSV hoặc JSON Lines, có thể nén gzip.
+
+Dữ liệu không bao giờ được dựng toàn bộ trong bộ nhớ:
+- Truy vấn dùng `yield_per` (server-side cursor / stream_results trên MySQL, Postgres) và chỉ chọn các cột cần
+  xuất, nên mỗi lần chỉ giữ một batch dòng.
+- Response là generator: mỗi nhóm dòng được encode (và nén gzip tăng dần bằng zlib) rồi gửi ngay cho client.
+Bộ nhớ dùng vì vậy gần như không đổi theo kích thước file xuất.
+
+Bộ lọc borrows dùng chung filter_borrows()/order_borrows() (circulation_service.py) với trang admin.borrows để file xuất khớp với những gì đang xem.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+
+from flask import Response, stream_with_context
+
+from circulation_service import filter_borrows, order_borrows
+from models import db, Audit, Book, Borrow, User
+
+FORMATS = ('csv', 'jsonl')
+# Số dòng mỗi batch đọc từ DB và mỗi lần flush ra response
+STREAM_BATCH_SIZE = 1000
+
+
+def borrows_export_query(user_filter='', book_filter='', status='', due_days=None, sort=''):
+    columns = [
+        Borrow.id, Borrow.user_id, User.username, User.student_staff_id, Borrow.book_id, Book.title,
+        Borrow.status, Borrow.borrow_date, Borrow.expected_return_date, Borrow.approved_at,
+        Borrow.return_date, Borrow.return_condition, Borrow.return_notes,
+    ]
+    query = db.session.query(*columns).join(User, Borrow.user_id == User.id).join(Book, Borrow.book_id == Book.id)
+    query = filter_borrows(query, user_filter, book_filter, status, due_days=due_days)
+    return order_borrows(query, sort, status)
+
+
+def users_export_query(search=''):
+    columns = [
+        User.id, User.username, User.student_staff_id, User.role, User.email, User.phone,
+        User.is_active, User.email_verified, User.phone_verified,
+    ]
+    query = db.session.query(*columns).filter(User.is_admin == False)
+    if search:
+        query = query.filter(User.username.like(f'%{search}%'))
+    return query.order_by(User.id.desc())
+
+
+def audit_export_query(actor_user_id=None, target_book_id=None):
+    columns = [
+        Audit.id, Audit.timestamp, Audit.action, Audit.actor_user_id, Audit.target_user_id,
+        Audit.target_book_id, Audit.target_borrow_id, Audit.details, Audit.details_json,
+    ]
+    query = db.session.query(*columns)
+    if actor_user_id:
+        query = query.filter(Audit.actor_user_id == actor_user_id)
+    if target_book_id:
+        query = query.filter(Audit.target_book_id == target_book_id)
+    return query.order_by(Audit.id.desc())
+
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(header, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM để Excel nhận đúng UTF-8 (tiếng Việt)
+    buffer.write('﻿')
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(['' if v is None else (json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else _plain(v))
+                         for v in row])
+        if i % STREAM_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl_chunks(header, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({k: _plain(v) for k, v in zip(header, row)}, ensure_ascii=False))
+        if len(lines) >= STREAM_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: định dạng gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(query, name, fmt='csv', compress=False):
+    """Tạo Response streaming cho `query` (query theo cột). `name` là tên file không kèm đuôi."""
+    fmt = fmt if fmt in FORMATS else 'csv'
+    header = [column['name'] for column in query.column_descriptions]
+
+    def generate():
+        rows = query.yield_per(STREAM_BATCH_SIZE)
+        chunks = _csv_chunks(header, rows) if fmt == 'csv' else _jsonl_chunks(header, rows)
+        encoded = (chunk.encode('utf-8') for chunk in chunks)
+        yield from (_gzip_stream(encoded) if compress else encoded)
+
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}" + ('.gz' if compress else '')
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson; charset=utf-8'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,486 @@
+"""metrics.py
+
+Registry metric vận hành trong process, gộp giữa các worker gunicorn (dùng cho `/metrics` và trang admin Giám sát).
+
+- Counter / Gauge / Histogram ghi vào "shard" riêng của từng thread (threading.local) nên đường ghi không cần lock:
+  chỉ thread sở hữu ghi vào shard của nó, thread đọc chỉ sao chép (`dict.copy()` nguyên tử dưới GIL).
+  Shard của thread đã kết thúc được gộp vào một shard "retired" khi chụp snapshot.
+- Histogram giữ cả bộ đếm tích luỹ (xuất dạng histogram Prometheus) lẫn các slot SLOT_SECONDS giây cho cửa sổ
+  trượt (WINDOWS: 1 phút, 5 phút) — request rate, tỉ lệ lỗi, p50/p95 tính trên cửa sổ, không phải từ lúc khởi động.
+- Gauge có hai kiểu gộp: 'sum' (vd. số request đang xử lý của mỗi worker) và 'max' (giá trị được lấy mẫu
+  giống nhau ở mọi worker, vd. số yêu cầu mượn chờ duyệt).
+- Mỗi worker định kỳ (tối đa mỗi METRICS_FLUSH_SECONDS, sau request hoặc job lấy mẫu) ghi snapshot ra
+  `SHARED_STATE_DIR/metrics/<pid>.json`; khi đọc, snapshot của mọi worker còn sống được cộng lại. File của worker
+  đã chết bị xoá (counter của nó biến mất — Prometheus coi như reset, `rate()` vẫn đúng).
+- Các gauge lấy từ DB (hàng đợi mượn, email tồn) chỉ được đọc bởi job sample_gauges() mỗi METRICS_SAMPLE_SECONDS,
+  không phải mỗi lần xem `/metrics` hay trang admin.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import Response, abort, current_app, g, request, session
+
+SLOT_SECONDS = 10
+WINDOWS = (60, 300)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _new_shard():
+    return {'values': {}, 'hist': {}}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    """Tập các metric của process hiện tại."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = _new_shard()
+        self._set_values = {}
+        self._fold_lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        metric.registry = self
+        return metric
+
+    def shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _new_shard()
+            ident = threading.get_ident()
+            with self._fold_lock:
+                old = self._shards.get(ident)
+                if old is not None:  # ident của thread đã chết được tái sử dụng
+                    _merge_shard(self._retired, old)
+                self._shards[ident] = shard
+        return shard
+
+    def snapshot(self):
+        """Gộp mọi shard của process thành {'values', 'hist'} (key = (name, labels))."""
+        alive = {t.ident for t in threading.enumerate()}
+        with self._fold_lock:
+            for ident in [i for i in self._shards if i not in alive]:
+                _merge_shard(self._retired, self._shards.pop(ident))
+            shards = [self._retired] + list(self._shards.values())
+            merged = _new_shard()
+            for shard in shards:
+                _merge_shard(merged, shard)
+        merged['values'].update(self._set_values.copy())
+        return merged
+
+
+def _merge_shard(target, shard):
+    values = target['values']
+    for key, value in shard['values'].copy().items():
+        values[key] = values.get(key, 0) + value
+    for key, state in shard['hist'].copy().items():
+        into = target['hist'].setdefault(key, {'total': None, 'slots': {}})
+        into['total'] = _add_lists(into['total'], list(state['total']))
+        for slot, counts in state['slots'].copy().items():
+            into['slots'][slot] = _add_lists(into['slots'].get(slot), list(counts))
+
+
+def _add_lists(a, b):
+    return list(b) if a is None else [x + y for x, y in zip(a, b)]
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = None
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.shard()['values']
+        key = _key(self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge: inc()/dec() (cộng dồn theo thread) hoặc set() (giá trị lấy mẫu của process) — không dùng lẫn."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), mode='sum'):
+        super().__init__(name, documentation, labelnames)
+        self.mode = mode
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.shard()['values']
+        key = _key(self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self.registry._set_values[_key(self.name, labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        # Mỗi list: [đếm theo bucket..., đếm +Inf, sum, count]
+        hist = self.registry.shard()['hist']
+        key = _key(self.name, labels)
+        state = hist.get(key)
+        if state is None:
+            state = hist[key] = {'total': [0] * (len(self.buckets) + 3), 'slots': {}}
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        slot = int(time.time() // SLOT_SECONDS)
+        slots = state['slots']
+        counts = slots.get(slot)
+        if counts is None:
+            oldest = slot - max(WINDOWS) // SLOT_SECONDS
+            for old in [s for s in slots if s <= oldest]:
+                del slots[old]
+            counts = slots[slot] = [0] * (len(self.buckets) + 3)
+        for target in (state['total'], counts):
+            target[index] += 1
+            target[-2] += value
+            target[-1] += 1
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.register(Counter(
+    'http_requests_total', 'Số request HTTP đã xử lý.', ('endpoint', 'method', 'status')))
+http_duration = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Thời gian xử lý request HTTP.', ('status_class',)))
+http_in_flight = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'Số request HTTP đang xử lý.'))
+chat_in_flight = REGISTRY.register(Gauge(
+    'chat_requests_in_flight', 'Số request chatbot đang chờ mô hình trả lời.'))
+chat_duration = REGISTRY.register(Histogram(
+    'chat_request_duration_seconds', 'Thời gian trả lời một request chatbot.'))
+notification_streams = REGISTRY.register(Gauge(
+    'notification_streams_open', 'Số kết nối SSE thông báo đang mở.'))
+pending_borrows = REGISTRY.register(Gauge(
+    'borrow_requests_pending', 'Số yêu cầu mượn đang chờ duyệt.', mode='max'))
+email_backlog = REGISTRY.register(Gauge(
+    'email_campaign_backlog', 'Số email chiến dịch chưa gửi.', mode='max'))
+query_embedding_cache = REGISTRY.register(Counter(
+    'query_embedding_cache_total', 'Số lần tra cache embedding câu hỏi chatbot theo kết quả.', ('result',)))
+chat_response_cache = REGISTRY.register(Counter(
+    'chat_response_cache_total', 'Số lần tra cache câu trả lời chatbot theo kết quả.', ('result',)))
+scheduler_lag = REGISTRY.register(Histogram(
+    'scheduler_job_lag_seconds', 'Độ trễ từ thời điểm lên lịch đến lúc job được đưa vào executor.', ('job',)))
+
+
+# --- Gộp giữa các worker ---
+
+def _metrics_dir():
+    return os.path.join(current_app.config['SHARED_STATE_DIR'], 'metrics')
+
+
+def _encode(snapshot):
+    return {
+        'pid': os.getpid(),
+        'written_at': time.time(),
+        'values': [[name, list(labels), value] for (name, labels), value in snapshot['values'].items()],
+        'hist': [[name, list(labels), state['total'], list(state['slots'].items())]
+                 for (name, labels), state in snapshot['hist'].items()],
+    }
+
+
+def _decode(data):
+    return {
+        'values': {(name, tuple(map(tuple, labels))): value for name, labels, value in data['values']},
+        'hist': {(name, tuple(map(tuple, labels))): {'total': total, 'slots': {int(s): c for s, c in slots}}
+                 for name, labels, total, slots in data['hist']},
+    }
+
+
+def flush(force=False):
+    """Ghi snapshot của worker này ra SHARED_STATE_DIR (tối đa mỗi METRICS_FLUSH_SECONDS trừ khi force)."""
+    now = time.monotonic()
+    if not force and now - REGISTRY._last_flush < current_app.config.get('METRICS_FLUSH_SECONDS', 5):
+        return
+    REGISTRY._last_flush = now
+    directory = _metrics_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(_encode(REGISTRY.snapshot()), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Không ghi được metrics: {e}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Snapshot gộp của mọi worker còn sống. Returns: (snapshot, số worker)."""
+    snapshots = [REGISTRY.snapshot()]
+    directory = _metrics_dir()
+    own = f'{os.getpid()}.json'
+    for filename in os.listdir(directory) if os.path.isdir(directory) else []:
+        if not filename.endswith('.json') or filename == own:
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            pid = int(filename[:-5])
+            if not _pid_alive(pid):
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(_decode(json.load(f)))
+        except (ValueError, OSError):
+            continue
+
+    merged = _new_shard()
+    for snap in snapshots:
+        for key, value in snap['values'].items():
+            metric = REGISTRY.metrics.get(key[0])
+            if isinstance(metric, Gauge) and metric.mode == 'max':
+                merged['values'][key] = max(merged['values'].get(key, value), value)
+            else:
+                merged['values'][key] = merged['values'].get(key, 0) + value
+        _merge_shard(merged, {'values': {}, 'hist': snap['hist']})
+    return merged, len(snapshots)
+
+
+def window_counts(state, window, now=None):
+    """Cộng các slot trong `window` giây gần nhất: list [bucket..., +Inf, sum, count] hoặc None."""
+    current = int((now or time.time()) // SLOT_SECONDS)
+    first = current - window // SLOT_SECONDS + 1
+    result = None
+    for slot, counts in state['slots'].items():
+        if slot >= first:
+            result = _add_lists(result, counts)
+    return result
+
+
+def quantile(buckets, counts, q):
+    """Ước lượng quantile từ số đếm theo bucket (nội suy tuyến tính trong bucket)."""
+    total = counts[-1] if counts else 0
+    if not total:
+        return None
+    target, seen, lower = q * total, 0, 0.0
+    for bound, count in zip(buckets, counts):
+        if count and seen + count >= target:
+            return lower + (bound - lower) * (target - seen) / count
+        seen += count
+        lower = bound
+    return buckets[-1]
+
+
+# --- Xuất dữ liệu ---
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+    return '{' + body + '}'
+
+
+def render_prometheus():
+    snapshot, workers = collect()
+    now = time.time()
+    lines = ['# HELP metrics_workers Số worker đang báo cáo metrics.', '# TYPE metrics_workers gauge',
+             f'metrics_workers {workers}']
+    for metric in REGISTRY.metrics.values():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if metric.kind != 'histogram':
+            for (name, labels), value in sorted(snapshot['values'].items()):
+                if name == metric.name:
+                    lines.append(f'{name}{_format_labels(labels)} {value:g}')
+            continue
+
+        series = sorted((labels, state) for (name, labels), state in snapshot['hist'].items() if name == metric.name)
+        for labels, state in series:
+            total, cumulative = state['total'], 0
+            for bound, count in zip(metric.buckets + (float('inf'),), total):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{metric.name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{metric.name}_sum{_format_labels(labels)} {total[-2]:g}')
+            lines.append(f'{metric.name}_count{_format_labels(labels)} {total[-1]}')
+        lines.append(f'# HELP {metric.name}_window {metric.documentation} (cửa sổ trượt)')
+        lines.append(f'# TYPE {metric.name}_window gauge')
+        for labels, state in series:
+            for window in WINDOWS:
+                counts = window_counts(state, window, now)
+                if not counts:
+                    continue
+                for q in QUANTILES:
+                    extra = (('window', f'{window}s'), ('quantile', f'{q:g}'))
+                    lines.append(f'{metric.name}_window{_format_labels(labels + extra)} '
+                                 f'{quantile(metric.buckets, counts, q):g}')
+                lines.append(f'{metric.name}_window_count{_format_labels(labels + (("window", f"{window}s"),))} '
+                             f'{counts[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _series_window(snapshot, metric, window, now, **match):
+    """Cộng cửa sổ của mọi series của `metric` có label khớp `match`."""
+    result = None
+    for (name, labels), state in snapshot['hist'].items():
+        if name == metric.name and all((k, v) in labels for k, v in match.items()):
+            result = _add_lists(result, window_counts(state, window, now) or [0] * (len(metric.buckets) + 3))
+    return result or [0] * (len(metric.buckets) + 3)
+
+
+def _hit_rate(values, metric, hits):
+    """Tổng số lần tra và tỉ lệ trúng (từ lúc khởi động) của một counter cache có label `result`."""
+    counts = {}
+    for (name, labels), value in values.items():
+        if name == metric.name:
+            result = dict(labels).get('result')
+            counts[result] = counts.get(result, 0) + value
+    total = sum(counts.values())
+    hit = sum(counts.get(result, 0) for result in hits)
+    return {'lookups': total, 'hit_rate': round(hit / total, 4) if total else 0.0}
+
+
+def panel_data():
+    """Số liệu cho trang admin Giám sát (đọc từ registry, không truy vấn DB)."""
+    snapshot, workers = collect()
+    now = time.time()
+    values = snapshot['values']
+
+    def gauge(metric):
+        return sum(v for (name, _), v in values.items() if name == metric.name)
+
+    windows = {}
+    for window in WINDOWS:
+        counts = _series_window(snapshot, http_duration, window, now)
+        errors = _series_window(snapshot, http_duration, window, now, status_class='5xx')[-1]
+        chat = _series_window(snapshot, chat_duration, window, now)
+        lag = _series_window(snapshot, scheduler_lag, window, now)
+        windows[f'{window}s'] = {
+            'requests': counts[-1],
+            'request_rate': round(counts[-1] / window, 3),
+            'error_rate': round(errors / counts[-1], 4) if counts[-1] else 0.0,
+            'latency_p50': quantile(http_duration.buckets, counts, 0.5),
+            'latency_p95': quantile(http_duration.buckets, counts, 0.95),
+            'chat_requests': chat[-1],
+            'chat_p95': quantile(chat_duration.buckets, chat, 0.95),
+            'scheduler_runs': lag[-1],
+            'scheduler_lag_p95': quantile(scheduler_lag.buckets, lag, 0.95),
+        }
+    return {
+        'workers': workers,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'in_flight': gauge(http_in_flight),
+        'chat_in_flight': gauge(chat_in_flight),
+        'notification_streams': gauge(notification_streams),
+        'pending_borrows': gauge(pending_borrows),
+        'email_backlog': gauge(email_backlog),
+        'query_embedding_cache': _hit_rate(values, query_embedding_cache, hits=('memory', 'disk')),
+        'chat_response_cache': _hit_rate(values, chat_response_cache, hits=('hit',)),
+        'windows': windows,
+    }
+
+
+# --- Tích hợp Flask / scheduler ---
+
+def sample_gauges():
+    """Lấy mẫu các gauge nguồn DB rồi ghi snapshot (job định kỳ, cần app context)."""
+    from models import db, DashboardStats, EmailCampaign, EmailCampaignRecipient
+    stats = DashboardStats.query.get(1)
+    pending_borrows.set(stats.pending_requests if stats else 0)
+    email_backlog.set(db.session.query(db.func.count(EmailCampaignRecipient.id)).join(
+        EmailCampaign, EmailCampaign.id == EmailCampaignRecipient.campaign_id
+    ).filter(
+        EmailCampaign.status.in_(('queued', 'running', 'paused')),
+        EmailCampaignRecipient.status == 'pending'
+    ).scalar() or 0)
+    db.session.remove()
+    flush(force=True)
+
+
+def observe_job_submitted(event):
+    """Listener EVENT_JOB_SUBMITTED của APScheduler: ghi độ trễ so với giờ đã lên lịch."""
+    for run_time in event.scheduled_run_times:
+        lag = (datetime.now(run_time.tzinfo) - run_time).total_seconds()
+        scheduler_lag.observe(max(lag, 0.0), job=event.job_id)
+
+
+def _metrics_allowed():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        return True
+    # Không tin remote_addr: sau reverse proxy mọi request đều đến từ 127.0.0.1
+    return bool(session.get('is_admin'))
+
+
+def metrics_endpoint():
+    """GET /metrics (định dạng text Prometheus).
+
+    Truy cập: header `Authorization: Bearer <METRICS_TOKEN>`, hoặc session admin.
+    """
+    if not _metrics_allowed():
+        abort(403)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+        http_in_flight.inc()
+
+    @app.teardown_request
+    def _end_request(exc):
+        if g.pop('metrics_started', None) is not None:
+            http_in_flight.dec()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.get('metrics_started')
+        if started is not None:
+            http_requests.inc(endpoint=request.endpoint or 'unknown', method=request.method,
+                              status=response.status_code)
+            http_duration.observe(time.perf_counter() - started, status_class=f'{response.status_code // 100}xx')
+            flush()
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
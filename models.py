@@ -5,9 +5,15 @@ Chứa các model SQLAlchemy cho ứng dụng thư viện:
  - Book: thông tin sách (title, author, quantity, category, views_count,...).
  - Borrow: lịch sử mượn trả (snapshot book_title để giữ lịch sử khi sách bị xóa).
  - Audit: ghi log các hành động admin/user để theo dõi.
+ - EmailCampaign / EmailCampaignRecipient: chiến dịch email hàng loạt và trạng thái gửi của từng người nhận.
+ - NotificationPreference: user chọn nhận email ngay (immediate) hay gộp theo ngày (digest).
+ - RetentionRun: thống kê mỗi lần job dọn dẹp các bảng hết hạn (xem retention_service.py).
+ - DashboardStats: một dòng duy nhất chứa các bộ đếm của dashboard admin (xem stats_service.py).
+ - CatalogImport: job import sách hàng loạt từ CSV/JSON và tiến độ của nó (xem catalog_import_service.py).
 
 Hàm tiện ích:
  - remove_username_unique_constraint(): cố gắng xóa ràng buộc UNIQUE trên cột username (nếu tồn tại) — thao tác schema runtime, nên dùng migration nếu cần thay đổi chính thức.
+ - ensure_runtime_columns(): thêm các cột/index mới (RUNTIME_COLUMNS, RUNTIME_INDEX_TABLES) vào bảng đã tồn tại, vì db.create_all() không ALTER bảng cũ.
 
 Gợi ý: dùng Flask-Migrate/Alembic cho production thay vì gọi trực tiếp ALTER TABLE từ code.
 """
@@ -35,6 +41,53 @@ def remove_username_unique_constraint():
         pass
 
 
+# Các cột được thêm sau khi bảng đã có dữ liệu: (bảng, cột, kiểu SQL). db.create_all() chỉ tạo bảng mới,
+# nên ensure_runtime_columns() bổ sung các cột này cho DB cũ.
+RUNTIME_COLUMNS = [
+    ('audit', 'target_user_id', 'INTEGER'),
+    ('audit', 'details_json', 'JSON'),
+    ('notification', 'version', 'INTEGER'),
+    ('notification_counter', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('notification', 'group_key', 'VARCHAR(100)'),
+    ('notification', 'group_count', 'INTEGER NOT NULL DEFAULT 1'),
+    ('email_campaign', 'run_id', 'VARCHAR(32)'),
+]
+# Bảng có index được thêm sau (tạo nếu chưa có, sau khi đã bổ sung cột)
+RUNTIME_INDEX_TABLES = ['audit', 'borrow', 'notification']
+
+
+def ensure_runtime_columns():
+    """Thêm các cột trong RUNTIME_COLUMNS nếu bảng tồn tại nhưng chưa có cột (ALTER TABLE ... ADD COLUMN),
+    sau đó tạo các index khai báo trên model của RUNTIME_INDEX_TABLES nếu còn thiếu.
+
+    Tương tự remove_username_unique_constraint: thao tác schema runtime, lỗi được bỏ qua.
+    """
+    try:
+        inspector = db.inspect(db.engine)
+        tables = set(inspector.get_table_names())
+        existing = {}
+        with db.engine.connect() as conn:
+            for table, column, ddl in RUNTIME_COLUMNS:
+                if table not in tables:
+                    continue
+                if table not in existing:
+                    existing[table] = {c['name'] for c in inspector.get_columns(table)}
+                if column in existing[table]:
+                    continue
+                conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                existing[table].add(column)
+            conn.commit()
+    except Exception as e:
+        print(f"⚠ Không bổ sung được cột mới: {e}")
+
+    for table in RUNTIME_INDEX_TABLES:
+        for index in db.metadata.tables[table].indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"⚠ Không tạo được index {index.name}: {e}")
+
+
 class User(db.Model):
     """Model User
 
@@ -89,7 +142,12 @@ class Borrow(db.Model):
     """Model Borrow: lưu lịch sử mượn trả của user
 
     Ghi chú: snapshot `book_title` tại thời điểm mượn để đảm bảo lịch sử còn nguyên vẹn nếu book record bị xóa.
+    Quan hệ: `borrow.user`, `borrow.book`.
+    Index (status, return_date, expected_return_date): cho bộ lọc quá hạn / sắp đến hạn (circulation_service.py).
     """
+    __table_args__ = (
+        db.Index('ix_borrow_status_return_expected', 'status', 'return_date', 'expected_return_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
@@ -108,19 +166,37 @@ class Borrow(db.Model):
     approved_at = db.Column(db.DateTime, nullable=True)
     expected_return_date = db.Column(db.DateTime, nullable=True)
 
+    # Quan hệ many-to-one; mỗi view chọn chiến lược load riêng (joinedload / contains_eager) để tránh N+1.
+    user = db.relationship('User', foreign_keys=[user_id], lazy='select')
+    book = db.relationship('Book', foreign_keys=[book_id], lazy='select')
+
 
 class Audit(db.Model):
     """Model Audit: ghi nhận các hoạt động quan trọng (admin/user)
 
     Fields bổ sung: actor_user_id, target ids, timestamp, details
+
+    target_user_id: user bị tác động (khoá/mở khoá, đổi MSSV, xóa...). Không dùng khóa ngoại để
+    audit vẫn giữ được khi user đã bị xóa.
+    details_json: chi tiết có cấu trúc (dict) bên cạnh `details` dạng văn bản để hiển thị.
+
+    Bảng chỉ giữ dữ liệu "nóng": job archive_cold_audits (audit_service.py) chuyển từng tháng cũ hơn
+    AUDIT_HOT_MONTHS ra file nén rồi xóa khỏi bảng.
     """
+    __table_args__ = (
+        db.Index('ix_audit_timestamp', 'timestamp'),
+        db.Index('ix_audit_actor_timestamp', 'actor_user_id', 'timestamp'),
+        db.Index('ix_audit_book_timestamp', 'target_book_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     action = db.Column(db.String(50), nullable=False)
     actor_user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     target_borrow_id = db.Column(db.Integer, db.ForeignKey('borrow.id'), nullable=True)
     target_book_id = db.Column(db.Integer, db.ForeignKey('book.id'), nullable=True)
+    target_user_id = db.Column(db.Integer, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.now)
     details = db.Column(db.Text)
+    details_json = db.Column(db.JSON, nullable=True)
 
 
 class EmailVerification(db.Model):
@@ -190,7 +266,13 @@ class Notification(db.Model):
     - link: đường dẫn liên kết (optional)
     - is_read: trạng thái đã đọc
     - type: loại thông báo (info, success, warning, error)
+    - version: phiên bản thay đổi theo từng user (lấy từ NotificationCounter.version khi tạo/sửa), dùng cho delta sync
+    - group_key, group_count: thông báo gộp (cùng loại + đối tượng trong một khoảng thời gian) và số sự kiện đã gộp
     """
+    __table_args__ = (
+        db.Index('ix_notification_user_version', 'user_id', 'version'),
+        db.Index('ix_notification_user_group', 'user_id', 'group_key', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.String(255), nullable=False)
@@ -198,3 +280,175 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     type = db.Column(db.String(20), default='info')
+    version = db.Column(db.Integer, nullable=True)
+    group_key = db.Column(db.String(100), nullable=True)
+    group_count = db.Column(db.Integer, nullable=False, default=1)
+
+
+class EmailCampaign(db.Model):
+    """Model EmailCampaign: chiến dịch gửi email thông báo hàng loạt tới người dùng
+
+    Fields:
+    - subject, body: nội dung email (body là văn bản thuần, được escape khi gửi)
+    - status: draft/queued/running/paused/completed/cancelled
+    - last_user_id: con trỏ keyset trên User.id (người nhận đã được đưa vào hàng đợi tới đâu)
+    - estimated_recipients: ước lượng số người nhận tại thời điểm tạo (để hiển thị tiến độ)
+    - total_recipients/sent_count/failed_count: bộ đếm tiến độ
+    - heartbeat_at: lần cuối worker báo còn chạy (phát hiện worker chết để cho phép resume)
+    - run_id: token của lần chạy đang giữ chiến dịch (NULL khi không có worker nào); worker dừng khi token đổi
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='draft', index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    run_id = db.Column(db.String(32), nullable=True)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)
+    estimated_recipients = db.Column(db.Integer, default=0)
+    total_recipients = db.Column(db.Integer, default=0)
+    sent_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+
+
+class EmailCampaignRecipient(db.Model):
+    """Model EmailCampaignRecipient: trạng thái gửi của từng người nhận trong một chiến dịch
+
+    Fields:
+    - campaign_id, user_id: (unique) mỗi user chỉ nhận một lần trong một chiến dịch
+    - email: snapshot email tại thời điểm đưa vào hàng đợi
+    - status: pending/sent/failed
+    - error: lỗi SMTP (nếu có)
+    """
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'user_id', name='uq_campaign_recipient'),
+        db.Index('ix_campaign_recipient_status', 'campaign_id', 'status', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('email_campaign.id'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    username = db.Column(db.String(80), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    error = db.Column(db.String(255), nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+
+class NotificationPreference(db.Model):
+    """Model NotificationPreference: tuỳ chọn nhận email của từng user
+
+    Fields:
+    - user_id: khoá chính (mỗi user tối đa một dòng; chưa có dòng = dùng DEFAULT_EMAIL_MODE)
+    - email_mode: 'immediate' (mỗi nhắc nhở một email) hoặc 'digest' (gộp thành một email mỗi ngày)
+    - last_digest_at: lần cuối gửi digest (dùng làm mốc lấy thông báo chưa đọc và chống gửi trùng)
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    email_mode = db.Column(db.String(20), nullable=False, default='digest')
+    last_digest_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class RetentionRun(db.Model):
+    """Model RetentionRun: kết quả mỗi lần job dọn dẹp (retention) chạy trên một bảng
+
+    Fields:
+    - table_name: bảng được dọn
+    - rows_deleted, batches: số dòng đã xóa và số batch
+    - archive_path: file lưu trữ (nếu bật RETENTION_ARCHIVE_DIR)
+    - error: lỗi (nếu lần chạy bị dừng giữa chừng)
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False, index=True)
+    started_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    rows_deleted = db.Column(db.Integer, default=0)
+    batches = db.Column(db.Integer, default=0)
+    archive_path = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+
+
+class DashboardStats(db.Model):
+    """Model DashboardStats: bộ đếm tổng hợp cho dashboard admin (chỉ một dòng, id=1)
+
+    Fields:
+    - total_books, total_users (không tính admin), active_borrows (chưa trả), total_borrows, pending_requests:
+      cập nhật cộng dồn trong cùng transaction với thao tác ghi (stats_service)
+    - overdue_borrows: phụ thuộc thời gian nên chỉ được tính lại bởi job reconcile
+    - today_checkouts + stats_date: số lượt mượn tạo trong ngày `stats_date`
+    - reconciled_at: lần cuối đếm lại chính xác
+    """
+    __tablename__ = 'dashboard_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    total_books = db.Column(db.Integer, nullable=False, default=0)
+    total_users = db.Column(db.Integer, nullable=False, default=0)
+    active_borrows = db.Column(db.Integer, nullable=False, default=0)
+    total_borrows = db.Column(db.Integer, nullable=False, default=0)
+    pending_requests = db.Column(db.Integer, nullable=False, default=0)
+    overdue_borrows = db.Column(db.Integer, nullable=False, default=0)
+    today_checkouts = db.Column(db.Integer, nullable=False, default=0)
+    stats_date = db.Column(db.Date, nullable=True)
+    reconciled_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class NotificationCounter(db.Model):
+    """Model NotificationCounter: số thông báo chưa đọc của mỗi user (badge chuông thông báo)
+
+    Fields:
+    - user_id: khoá chính (chưa có dòng = chưa đếm; notification_service tạo bằng số đếm chính xác khi cần)
+    - unread_count: cộng/trừ trong cùng transaction với thao tác ghi Notification (notification_service)
+    - version: tăng mỗi khi thông báo của user được tạo/sửa (con trỏ của delta sync)
+    - updated_at: lần cuối thay đổi hoặc đối chiếu
+    """
+    __tablename__ = 'notification_counter'
+    user_id = db.Column(db.Integer, primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class RagIndexState(db.Model):
+    """Model RagIndexState: trạng thái của từng sách trong RAG index (ChromaDB)
+
+    Fields:
+    - book_id: khoá chính (không FK để vẫn dọn được index khi sách bị xóa hẳn)
+    - content_hash: sha256 của văn bản đã embedding (+ model); không đổi thì không embedding lại
+    - indexed_at: lần cuối embedding
+    """
+    __tablename__ = 'rag_index_state'
+    book_id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    indexed_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class CatalogImport(db.Model):
+    """Model CatalogImport: một lần import sách hàng loạt (chạy nền)
+
+    Fields:
+    - filename, file_format ('csv' | 'json'), file_path: file đã upload (xóa sau khi xong)
+    - update_existing: sách trùng (cùng tựa + tác giả) thì cập nhật thông tin thay vì bỏ qua
+    - status: queued / running / completed / failed
+    - processed_rows, inserted_count, updated_count, duplicate_count, invalid_count: tiến độ
+    - indexed_count: số sách mới/thay đổi đã được đưa vào RAG index
+    - errors: JSON list các lỗi đầu tiên (dòng, lý do)
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    file_format = db.Column(db.String(10), nullable=False)
+    file_path = db.Column(db.String(500), nullable=True)
+    update_existing = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    processed_rows = db.Column(db.Integer, default=0)
+    inserted_count = db.Column(db.Integer, default=0)
+    updated_count = db.Column(db.Integer, default=0)
+    duplicate_count = db.Column(db.Integer, default=0)
+    invalid_count = db.Column(db.Integer, default=0)
+    indexed_count = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text, nullable=True)
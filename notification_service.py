@@ -0,0 +1,513 @@
+"""notification_service.py
+
+Kênh đẩy thông báo thời gian thực (Server-Sent Events) thay cho việc mọi tab gọi /notification/notifications mỗi 30 giây.
+
+- Pub/sub trong process (NotificationBus): mỗi kết nối SSE `/notification/stream` đăng ký một hàng đợi theo user_id.
+- Listener session: mọi Notification được thêm qua ORM (mượn sách, duyệt, từ chối...) được gom lúc flush và chỉ
+  publish sau khi transaction commit thành công (rollback thì bỏ) — các route không cần gọi gì thêm.
+- Giữa các worker gunicorn: sự kiện được ghi vào một SQLite nhỏ trên tmpfs (SHARED_STATE_DIR, như otp_store.py);
+  mỗi worker có MỘT thread relay đọc sự kiện mới mỗi NOTIFICATION_RELAY_SECONDS (chỉ khi có kết nối đang mở) và
+  phân phát cho các kết nối của nó. Tab đang mở nhưng không có thông báo mới không tạo truy vấn DB nào.
+- Mỗi sự kiện mang id = `notification_counter.version` của user (xem Delta sync bên dưới), và khung đầu tiên của
+  mỗi kết nối là sự kiện `sync` với version hiện tại. Khi EventSource kết nối lại, header Last-Event-ID là con trỏ
+  delta: notification_delta() gửi bù mọi thay đổi trong khoảng ngắt (thông báo mới, bản gộp, số chưa đọc).
+- Polling vẫn là phương án dự phòng phía client (trình duyệt không hỗ trợ EventSource hoặc server trả 503 khi
+  worker đã đủ NOTIFICATION_STREAM_MAX kết nối).
+
+Bộ đếm chưa đọc (badge):
+- Bảng `notification_counter` (một dòng mỗi user) được cộng/trừ trong cùng flush với thao tác ghi Notification
+  (thêm chưa đọc, đổi is_read, xoá) nên commit/rollback cùng nhau; mark_all_read đặt về 0 trong transaction của nó.
+- unread_count(): đọc một dòng theo khoá chính (không cache trong worker: cache chỉ được làm mới ở worker có relay
+  đang chạy nên có thể cũ); dòng chưa có thì đếm chính xác một lần và tạo dòng. Số mới sau mỗi commit được đẩy cho
+  client qua sự kiện SSE `unread`.
+- reconcile_unread_counters(): job định kỳ đếm lại bằng GROUP BY, sửa sai lệch từ các câu DELETE/UPDATE hàng loạt
+  (retention, xoá tài khoản) vốn không đi qua listener.
+
+Gộp thông báo (create_notifications với group_key):
+- Thông báo cùng group_key (cùng loại + đối tượng) còn chưa đọc và được tạo trong NOTIFICATION_COALESCE_MINUTES
+  được cập nhật tại chỗ (group_count + 1, nội dung "12 yêu cầu mượn sách mới...", đưa lên đầu) thay vì thêm dòng
+  mới — một đợt cao điểm chỉ để lại một dòng cho mỗi admin. Bản cập nhật cũng được đẩy qua SSE (cùng id).
+
+Delta sync (con trỏ version):
+- Mỗi lần flush tạo/sửa/xoá Notification, `notification_counter.version` của user tăng và các dòng được gán version mới
+  (listener before_flush); mark_all_read gán một version chung cho cả lô.
+- notification_delta(user_id, since): probe một dòng theo khoá chính; version không đổi -> None (route trả 204).
+  Có thay đổi -> chỉ các thông báo `version > since` (index (user_id, version)) kèm con trỏ mới; quá DELTA_LIMIT
+  thay đổi thì yêu cầu client tải lại danh sách đầy đủ.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+
+from metrics import notification_streams
+from models import db, Notification, NotificationCounter
+
+# Sự kiện trong store dùng chung được giữ bấy nhiêu giây (đủ cho relay của mọi worker đọc kịp)
+EVENT_RETENTION_SECONDS = 120
+STREAM_QUEUE_SIZE = 100
+DELTA_LIMIT = 50
+
+
+def serialize_notification(n):
+    return {
+        'id': n.id,
+        'message': n.message,
+        'link': n.link,
+        'is_read': bool(n.is_read),
+        'type': n.type,
+        'version': n.version,
+        'group_count': n.group_count or 1,
+        'created_at': n.created_at.isoformat(timespec='seconds') if n.created_at else None,
+    }
+
+
+class SharedEventLog:
+    """Nhật ký sự kiện ngắn hạn dùng chung giữa các process (SQLite trên tmpfs)."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS notification_event ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, origin INTEGER NOT NULL, user_id INTEGER NOT NULL, '
+                     'name TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def append(self, events):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO notification_event (origin, user_id, name, data, created_at) VALUES (?, ?, ?, ?, ?)',
+                [(os.getpid(), user_id, name, json.dumps(data, ensure_ascii=False), now)
+                 for user_id, name, data in events]
+            )
+            conn.execute('DELETE FROM notification_event WHERE created_at < ?', (now - EVENT_RETENTION_SECONDS,))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def last_id(self):
+        return self._conn().execute('SELECT COALESCE(MAX(id), 0) FROM notification_event').fetchone()[0]
+
+    def read_after(self, last_id):
+        return self._conn().execute(
+            'SELECT id, origin, user_id, name, data FROM notification_event WHERE id > ? ORDER BY id', (last_id,)
+        ).fetchall()
+
+
+class NotificationBus:
+    """Pub/sub trong process: user_id -> tập hàng đợi của các kết nối SSE đang mở."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._log = None
+        self._log_failed = False
+        self._relay = None
+        self._relay_interval = 1.0
+        self._cursor = None  # id sự kiện dùng chung cuối cùng relay đã đọc (None = không có ai nghe)
+
+    def configure(self, app):
+        self._relay_interval = app.config.get('NOTIFICATION_RELAY_SECONDS', 1.0)
+        if self._log is None and not self._log_failed:
+            path = os.path.join(app.config['SHARED_STATE_DIR'], 'notification_events.sqlite3')
+            try:
+                self._log = SharedEventLog(path)
+            except (OSError, sqlite3.Error) as e:
+                self._log_failed = True
+                print(f"⚠ Không khởi tạo được kênh thông báo dùng chung ({e}), chỉ phát trong worker hiện tại.")
+
+    @property
+    def connection_count(self):
+        with self._lock:  # subscribe/unsubscribe ở thread khác có thể thêm/xoá key giữa lúc duyệt
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id):
+        q = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self._lock:
+            if self._log is not None and self._cursor is None:
+                try:
+                    self._cursor = self._log.last_id()
+                except sqlite3.Error:
+                    pass
+            self._subscribers.setdefault(user_id, set()).add(q)
+            self._ensure_relay()
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues:
+                queues.discard(q)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def publish(self, events):
+        """Phát list (user_id, name, data) cho kết nối trong worker này và ghi vào store dùng chung."""
+        if not events:
+            return
+        self._deliver(events)
+        if self._log is not None:
+            try:
+                self._log.append(events)
+            except sqlite3.Error as e:
+                print(f"Lỗi ghi sự kiện thông báo dùng chung: {e}")
+
+    def _deliver(self, events):
+        for user_id, name, data in events:
+            with self._lock:
+                queues = list(self._subscribers.get(user_id, ()))
+            for q in queues:
+                try:
+                    q.put_nowait((name, data))
+                except queue.Full:
+                    pass  # client quá chậm: sẽ nhận bù qua Last-Event-ID khi kết nối lại
+
+    def _ensure_relay(self):
+        if self._log is None or (self._relay is not None and self._relay.is_alive()):
+            return
+        self._relay = threading.Thread(target=self._relay_loop, name='notification-relay', daemon=True)
+        self._relay.start()
+
+    def _relay_loop(self):
+        pid = os.getpid()
+        while True:
+            time.sleep(self._relay_interval)
+            try:
+                with self._lock:
+                    if not self._subscribers:
+                        self._cursor = None  # không ai nghe: bỏ qua sự kiện cũ thay vì phát lại khi có kết nối mới
+                        continue
+                    if self._cursor is None:
+                        self._cursor = self._log.last_id()
+                        continue
+                rows = self._log.read_after(self._cursor)
+            except sqlite3.Error as e:
+                print(f"Lỗi đọc sự kiện thông báo dùng chung: {e}")
+                continue
+            events = []
+            for event_id, origin, user_id, name, data in rows:
+                self._cursor = event_id
+                if origin == pid:
+                    continue
+                if user_id in self._subscribers:
+                    events.append((user_id, name, json.loads(data)))
+            self._deliver(events)
+
+
+bus = NotificationBus()
+
+
+def format_sse(name, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {name}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_events(user_id, since=None):
+    """Generator SSE cho một kết nối; `since` là con trỏ version client đang có (Last-Event-ID), None nếu chưa có.
+
+    Khung đầu tiên là sự kiện `sync`: các thay đổi kể từ `since` (như notification_delta) hoặc chỉ con trỏ hiện tại.
+    Kết nối tự đóng sau NOTIFICATION_STREAM_SECONDS để thread của worker được giải phóng định kỳ; trình duyệt
+    kết nối lại sau `retry` ms và gửi Last-Event-ID.
+    """
+    app = current_app._get_current_object()
+    config = app.config
+    lifetime = config.get('NOTIFICATION_STREAM_SECONDS', 300)
+    heartbeat = config.get('NOTIFICATION_HEARTBEAT_SECONDS', 25)
+
+    def generate():
+        # Đăng ký trong generator: nếu response bị bỏ trước khi chạy (client ngắt ngay), không để lại hàng đợi
+        # mồ côi trong bus — finally chỉ chạy khi generator đã bắt đầu
+        q = bus.subscribe(user_id)
+        notification_streams.inc()
+        try:
+            # Đọc DB sau khi đăng ký: thay đổi commit trong lúc đọc đã nằm trong hàng đợi, không lọt khoảng trống.
+            # Request context đã đóng khi response bắt đầu stream nên cần app context riêng (giải phóng ngay).
+            with app.app_context():
+                synced = sync_cursor(user_id)
+                delta = notification_delta(user_id, since) if since is not None else None
+            if delta is not None:
+                synced = delta['cursor']
+            yield 'retry: 5000\n\n'
+            yield format_sse('sync', delta or {'cursor': synced}, synced)
+            deadline = time.monotonic() + lifetime
+            while time.monotonic() < deadline:
+                try:
+                    name, data = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                version = data.get('version')
+                if version is not None and version <= synced:
+                    continue  # đã có trong sự kiện sync
+                yield format_sse(name, data, version)
+        finally:
+            bus.unsubscribe(user_id, q)
+            notification_streams.dec()
+
+    return generate()
+
+
+# --- Tạo thông báo (có gộp) ---
+
+def create_notifications(user_ids, message, link=None, type='info', group_key=None, group_message=None):
+    """Thêm thông báo cho nhiều user vào session hiện tại (caller commit).
+
+    group_key: gộp vào thông báo chưa đọc cùng khoá trong NOTIFICATION_COALESCE_MINUTES nếu có;
+    group_message: mẫu nội dung khi đã gộp, nhận `{count}` và `{message}` (thông báo mới nhất).
+
+    Returns:
+        tuple: (số dòng thêm mới, số dòng được gộp)
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return 0, 0
+    now = datetime.now()
+    existing = {}
+    if group_key:
+        window = timedelta(minutes=current_app.config.get('NOTIFICATION_COALESCE_MINUTES', 30))
+        rows = Notification.query.filter(
+            Notification.user_id.in_(user_ids),
+            Notification.group_key == group_key,
+            Notification.is_read == False,
+            Notification.created_at >= now - window
+        ).order_by(Notification.created_at.desc()).with_for_update().all()
+        for n in rows:
+            existing.setdefault(n.user_id, n)
+
+    for user_id in user_ids:
+        n = existing.get(user_id)
+        if n is None:
+            db.session.add(Notification(user_id=user_id, message=message, link=link, type=type,
+                                        group_key=group_key, group_count=1, created_at=now))
+            continue
+        n.group_count = (n.group_count or 1) + 1
+        n.message = (group_message or '{count} thông báo mới: {message}').format(
+            count=n.group_count, message=message)[:255]
+        n.link = link
+        n.type = type
+        n.created_at = now
+    return len(user_ids) - len(existing), len(existing)
+
+
+# --- Bộ đếm chưa đọc ---
+
+def unread_count(user_id):
+    """Số thông báo chưa đọc của user: một dòng notification_counter -> (lần đầu) đếm chính xác."""
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is None:
+        count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
+        try:
+            db.session.add(NotificationCounter(user_id=user_id, unread_count=count, updated_at=datetime.now()))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # request khác vừa tạo
+    else:
+        count = max(counter.unread_count, 0)
+    return count
+
+
+def mark_all_read(user_id):
+    """Đánh dấu đã đọc mọi thông báo của user trong transaction hiện tại (một UPDATE hàng loạt).
+
+    Bộ đếm về 0 và version tăng một bậc; các dòng vừa đổi nhận version đó để delta sync thấy được.
+    """
+    table = NotificationCounter.__table__
+    db.session.execute(table.update().where(table.c.user_id == user_id).values(
+        unread_count=0, version=table.c.version + 1, updated_at=datetime.now()))
+    version = db.session.query(NotificationCounter.version).filter_by(user_id=user_id).scalar()
+    Notification.query.filter_by(user_id=user_id, is_read=False).update(
+        {Notification.is_read: True, Notification.version: version}, synchronize_session=False)
+    db.session.info.setdefault('unread_counts', {})[user_id] = (0, version)
+
+
+def sync_cursor(user_id):
+    """Version hiện tại của user (con trỏ cho lần delta sync tiếp theo); tạo dòng bộ đếm nếu chưa có."""
+    version = db.session.query(NotificationCounter.version).filter_by(user_id=user_id).scalar()
+    if version is None:
+        unread_count(user_id)
+        version = db.session.query(NotificationCounter.version).filter_by(user_id=user_id).scalar() or 0
+    return version
+
+
+def notification_delta(user_id, since):
+    """Thay đổi kể từ con trỏ `since`.
+
+    Returns:
+        None nếu không có gì mới (chỉ tốn một truy vấn theo khoá chính), hoặc dict
+        {'cursor', 'unread_count', 'notifications'} / {'cursor', 'reset': True} khi có quá nhiều thay đổi.
+    """
+    # Số chưa đọc lấy cùng dòng với version (không qua cache của worker: có thể cũ hơn version)
+    row = db.session.query(NotificationCounter.version, NotificationCounter.unread_count).filter_by(
+        user_id=user_id).first()
+    if row is None or row.version == since:
+        return None
+    version, count = row
+    if version < since:
+        return {'cursor': version, 'reset': True}
+    changed = Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.version > since
+    ).order_by(Notification.version).limit(DELTA_LIMIT + 1).all()
+    if len(changed) > DELTA_LIMIT:
+        return {'cursor': version, 'reset': True}
+    return {
+        'cursor': version,
+        'unread_count': max(count, 0),
+        'notifications': [serialize_notification(n) for n in changed],
+    }
+
+
+def _assign_versions(session):
+    """before_flush: tăng version của user và gán cho các thông báo mới/đã sửa trong lần flush này."""
+    changed = {}
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Notification) and (obj in session.new or session.is_modified(obj)):
+            changed.setdefault(obj.user_id, []).append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Notification):
+            changed.setdefault(obj.user_id, [])  # xoá: chỉ tăng version để delta/SSE gửi bù số chưa đọc mới
+    if not changed:
+        return
+    table = NotificationCounter.__table__
+    connection = session.connection()
+    for user_id, objs in changed.items():
+        result = connection.execute(table.update().where(table.c.user_id == user_id).values(
+            version=table.c.version + max(len(objs), 1)))
+        if not result.rowcount:
+            continue  # chưa có dòng bộ đếm: user chưa từng đồng bộ, không cần version
+        top = connection.execute(db.select(table.c.version).where(table.c.user_id == user_id)).scalar()
+        for offset, obj in enumerate(objs):
+            obj.version = top - len(objs) + 1 + offset
+
+
+def _unread_deltas(session):
+    deltas = {}
+
+    def add(user_id, delta):
+        deltas[user_id] = deltas.get(user_id, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, Notification) and not obj.is_read:
+            add(obj.user_id, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Notification):
+            history = sa_inspect(obj).attrs.is_read.history
+            was_read = history.deleted[0] if history.deleted else obj.is_read
+            if not was_read:
+                add(obj.user_id, -1)
+    for obj in session.dirty:
+        if not isinstance(obj, Notification):
+            continue
+        history = sa_inspect(obj).attrs.is_read.history
+        if history.deleted and bool(history.deleted[0]) != bool(obj.is_read):
+            add(obj.user_id, -1 if obj.is_read else 1)
+    return {user_id: delta for user_id, delta in deltas.items() if delta}
+
+
+def _apply_unread_deltas(session, deltas):
+    """UPDATE bộ đếm trên connection của flush rồi đọc lại giá trị mới (dòng đang bị khoá bởi UPDATE)."""
+    table = NotificationCounter.__table__
+    connection = session.connection()
+    now = datetime.now()
+    for user_id, delta in deltas.items():
+        # Dòng chưa tồn tại thì bỏ qua; unread_count() sẽ tạo dòng bằng số đếm chính xác
+        connection.execute(table.update().where(table.c.user_id == user_id).values(
+            unread_count=table.c.unread_count + delta, updated_at=now))
+    rows = connection.execute(db.select(table.c.user_id, table.c.unread_count, table.c.version).where(
+        table.c.user_id.in_(list(deltas)))).all()
+    counts = session.info.setdefault('unread_counts', {})
+    counts.update({user_id: (max(count, 0), version) for user_id, count, version in rows})
+
+
+def reconcile_unread_counters(batch_size=1000):
+    """Đếm lại số chưa đọc của mọi user có dòng bộ đếm. Returns: số dòng đã sửa."""
+    table = NotificationCounter.__table__
+    fixed, last_user_id = 0, 0
+    while True:
+        counters = db.session.query(NotificationCounter.user_id, NotificationCounter.unread_count).filter(
+            NotificationCounter.user_id > last_user_id
+        ).order_by(NotificationCounter.user_id).limit(batch_size).all()
+        if not counters:
+            break
+        user_ids = [user_id for user_id, _ in counters]
+        actual = dict(db.session.query(Notification.user_id, db.func.count(Notification.id)).filter(
+            Notification.user_id.in_(user_ids),
+            Notification.is_read == False
+        ).group_by(Notification.user_id).all())
+        for user_id, stored in counters:
+            if actual.get(user_id, 0) != stored:
+                db.session.execute(table.update().where(table.c.user_id == user_id).values(
+                    unread_count=actual.get(user_id, 0), updated_at=datetime.now()))
+                fixed += 1
+        db.session.commit()
+        last_user_id = user_ids[-1]
+    return fixed
+
+
+# --- Listener session: publish sau commit ---
+
+def _before_flush(session, flush_context, instances):
+    _assign_versions(session)
+
+
+def _after_flush(session, flush_context):
+    # Thông báo mới và thông báo gộp vừa được cập nhật nội dung
+    created = [obj for obj in session.new if isinstance(obj, Notification)] + [
+        obj for obj in session.dirty
+        if isinstance(obj, Notification) and sa_inspect(obj).attrs.group_count.history.has_changes()
+    ]
+    if created:
+        session.info.setdefault('notification_events', []).extend(
+            (n.user_id, 'notification', serialize_notification(n)) for n in created
+        )
+    deltas = _unread_deltas(session)
+    if deltas:
+        _apply_unread_deltas(session, deltas)
+
+
+def _after_commit(session):
+    events = session.info.pop('notification_events', None) or []
+    counts = session.info.pop('unread_counts', None) or {}
+    for user_id, (count, version) in counts.items():
+        events.append((user_id, 'unread', {'unread_count': count, 'version': version}))
+    if events:
+        bus.publish(events)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    session.info.pop('notification_events', None)
+    session.info.pop('unread_counts', None)
+
+
+def register_listeners(app):
+    """Cấu hình bus và gắn listener publish-sau-commit vào session (gọi một lần lúc khởi động app)."""
+    bus.configure(app)
+    for name, fn in (('before_flush', _before_flush), ('after_flush', _after_flush),
+                     ('after_commit', _after_commit), ('after_soft_rollback', _after_soft_rollback)):
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
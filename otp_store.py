@@ -0,0 +1,169 @@
+"""otp_store.py
+
+Backend lưu OTP (email/sđt) có thể thay thế, dùng bởi `email_service.py` và `phone_service.py`.
+
+Mỗi yêu cầu OTP trước đây chạy COUNT + DELETE + INSERT (và SELECT khi verify) trên bảng
+EmailVerification/PhoneVerification của DB chính. Khi có đợt đăng ký dồn dập, các dòng sống vài phút
+này tạo tải không cần thiết cho DB. Module này tách phần lưu trữ ra sau một interface chung:
+
+- SharedMemoryOTPStore (mặc định, OTP_STORE_BACKEND=shared): lưu trong SQLite đặt trên tmpfs
+  (`SHARED_STATE_DIR`, mặc định /dev/shm), dùng chung cho mọi worker gunicorn trên cùng máy.
+  Mã OTP tự hết hạn theo TTL; rate limit theo cửa sổ trượt cũng tính trong bộ nhớ.
+- DatabaseOTPStore (OTP_STORE_BACKEND=database): giữ nguyên hành vi cũ trên bảng DB — dùng khi
+  chỉ có một node đơn giản hoặc nhiều máy chủ không chia sẻ bộ nhớ.
+
+Interface:
+    issue(kind, key, code, ttl_seconds, max_sends, window_seconds) -> bool
+        Ghi nhận một lần gửi và thay thế mã chưa dùng; False nếu vượt rate limit.
+    verify(kind, key, code) -> 'ok' | 'invalid' | 'expired'
+        Mã chỉ dùng được một lần.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import db, EmailVerification, PhoneVerification
+
+
+class DatabaseOTPStore:
+    """Lưu OTP trong bảng EmailVerification/PhoneVerification (hành vi cũ)."""
+
+    MODELS = {
+        'email': (EmailVerification, 'email'),
+        'phone': (PhoneVerification, 'phone'),
+    }
+
+    def issue(self, kind, key, code, ttl_seconds, max_sends, window_seconds):
+        model, column = self.MODELS[kind]
+        key_col = getattr(model, column)
+        since = datetime.now() - timedelta(seconds=window_seconds)
+        recent_attempts = model.query.filter(key_col == key, model.created_at >= since).count()
+        if recent_attempts >= max_sends:
+            return False
+
+        # Xóa các OTP cũ chưa verify của key này
+        model.query.filter(key_col == key, model.verified == False).delete(synchronize_session=False)
+        db.session.add(model(**{
+            column: key,
+            'otp_code': code,
+            'expires_at': datetime.now() + timedelta(seconds=ttl_seconds),
+        }))
+        db.session.commit()
+        return True
+
+    def verify(self, kind, key, code):
+        model, column = self.MODELS[kind]
+        verification = model.query.filter(
+            getattr(model, column) == key,
+            model.otp_code == code,
+            model.verified == False
+        ).first()
+        if not verification:
+            return 'invalid'
+        if datetime.now() > verification.expires_at:
+            return 'expired'
+        verification.verified = True
+        db.session.commit()
+        return 'ok'
+
+
+class SharedMemoryOTPStore:
+    """OTP store TTL dùng chung giữa các process trên cùng máy (SQLite trên tmpfs).
+
+    Bảng:
+    - otp_code(kind, key, code, expires_at): tối đa một mã đang hiệu lực cho mỗi (kind, key)
+    - otp_send(kind, key, sent_at): lịch sử gửi để tính rate limit theo cửa sổ trượt
+    Các dòng hết hạn được dọn dẹp dần mỗi lần issue().
+    """
+
+    # Lịch sử gửi được giữ tối đa bấy nhiêu giây (phải >= mọi window_seconds đang dùng)
+    SEND_HISTORY_SECONDS = 3600
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._connect().conn.execute('PRAGMA journal_mode=WAL')
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS otp_code ('
+                         'kind TEXT NOT NULL, key TEXT NOT NULL, code TEXT NOT NULL, expires_at REAL NOT NULL, '
+                         'PRIMARY KEY (kind, key))')
+            conn.execute('CREATE TABLE IF NOT EXISTS otp_send (kind TEXT NOT NULL, key TEXT NOT NULL, sent_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_otp_send_key ON otp_send (kind, key, sent_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def issue(self, kind, key, code, ttl_seconds, max_sends, window_seconds):
+        now = time.time()
+        with self._connect() as conn:
+            recent = conn.execute(
+                'SELECT COUNT(*) FROM otp_send WHERE kind = ? AND key = ? AND sent_at >= ?',
+                (kind, key, now - window_seconds)
+            ).fetchone()[0]
+            if recent >= max_sends:
+                return False
+            conn.execute('INSERT INTO otp_send (kind, key, sent_at) VALUES (?, ?, ?)', (kind, key, now))
+            conn.execute('INSERT OR REPLACE INTO otp_code (kind, key, code, expires_at) VALUES (?, ?, ?, ?)',
+                         (kind, key, code, now + ttl_seconds))
+            conn.execute('DELETE FROM otp_code WHERE expires_at < ?', (now,))
+            conn.execute('DELETE FROM otp_send WHERE sent_at < ?', (now - self.SEND_HISTORY_SECONDS,))
+        return True
+
+    def verify(self, kind, key, code):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT code, expires_at FROM otp_code WHERE kind = ? AND key = ?',
+                               (kind, key)).fetchone()
+            if not row or row[0] != code:
+                return 'invalid'
+            if now > row[1]:
+                return 'expired'
+            conn.execute('DELETE FROM otp_code WHERE kind = ? AND key = ?', (kind, key))
+        return 'ok'
+
+
+class _Transaction:
+    """`with` block = một transaction BEGIN IMMEDIATE (khoá ghi giữa các process)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_otp_store():
+    """Trả về OTP store theo config OTP_STORE_BACKEND ('shared' hoặc 'database'), khởi tạo một lần mỗi process."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = current_app.config.get('OTP_STORE_BACKEND', 'shared')
+                if backend == 'database':
+                    _store = DatabaseOTPStore()
+                else:
+                    path = os.path.join(current_app.config['SHARED_STATE_DIR'], 'otp_store.sqlite3')
+                    try:
+                        _store = SharedMemoryOTPStore(path)
+                    except (OSError, sqlite3.Error) as e:
+                        print(f"⚠ Không khởi tạo được OTP store dùng chung ({e}), dùng DB.")
+                        _store = DatabaseOTPStore()
+    return _store
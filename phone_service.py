@@ -3,14 +3,13 @@
 Service để xử lý xác thực số điện thoại.
 
 Chức năng:
-- Tạo và lưu OTP code cho phone verification
+- Tạo và lưu OTP code cho phone verification (qua OTP store, xem otp_store.py)
 - Mock gửi SMS (in ra console)
 - Verify OTP codes
 - Rate limiting
 """
 
-from models import db, PhoneVerification
-from datetime import datetime, timedelta
+from otp_store import get_otp_store
 import random
 import string
 
@@ -21,37 +20,20 @@ def generate_otp_code(length=6):
 def create_phone_verification(phone):
     """Tạo OTP code mới cho phone verification.
     
+    Lưu trữ qua OTP store (xem otp_store.py), mặc định nằm trong bộ nhớ dùng chung thay vì DB.
+    
     Args:
         phone: Số điện thoại cần xác thực
         
     Returns:
         tuple: (otp_code, success, message)
     """
-    # Kiểm tra rate limiting: tối đa 3 lần trong 5 phút
-    five_minutes_ago = datetime.now() - timedelta(minutes=5)
-    recent_attempts = PhoneVerification.query.filter(
-        PhoneVerification.phone == phone,
-        PhoneVerification.created_at >= five_minutes_ago
-    ).count()
-    
-    if recent_attempts >= 3:
-        return None, False, "Bạn đã gửi quá nhiều yêu cầu. Vui lòng thử lại sau 5 phút."
-    
-    # Xóa các OTP cũ chưa verify của sđt này
-    PhoneVerification.query.filter_by(phone=phone, verified=False).delete()
-    
-    # Tạo OTP mới
     otp_code = generate_otp_code()
-    expires_at = datetime.now() + timedelta(minutes=5)
-    
-    verification = PhoneVerification(
-        phone=phone,
-        otp_code=otp_code,
-        expires_at=expires_at
-    )
-    
-    db.session.add(verification)
-    db.session.commit()
+    # Rate limiting: tối đa 3 lần trong 5 phút; OTP mới thay thế OTP cũ chưa verify, hết hạn sau 5 phút
+    issued = get_otp_store().issue('phone', phone, otp_code,
+                                   ttl_seconds=5 * 60, max_sends=3, window_seconds=5 * 60)
+    if not issued:
+        return None, False, "Bạn đã gửi quá nhiều yêu cầu. Vui lòng thử lại sau 5 phút."
     
     return otp_code, True, "OTP đã được tạo thành công."
 
@@ -65,22 +47,14 @@ def verify_phone_otp(phone, otp_code):
     Returns:
         tuple: (success, message)
     """
-    verification = PhoneVerification.query.filter_by(
-        phone=phone,
-        otp_code=otp_code,
-        verified=False
-    ).first()
+    result = get_otp_store().verify('phone', phone, otp_code)
     
-    if not verification:
+    if result == 'invalid':
         return False, "Mã OTP không hợp lệ."
     
-    if datetime.now() > verification.expires_at:
+    if result == 'expired':
         return False, "Mã OTP đã hết hạn. Vui lòng yêu cầu mã mới."
     
-    # Đánh dấu đã verify
-    verification.verified = True
-    db.session.commit()
-    
     return True, "Xác thực số điện thoại thành công!"
 
 def send_sms_otp(phone, otp_code):
@@ -0,0 +1,45 @@
+"""query_counter.py
+
+Đếm số câu SQL mỗi request để phát hiện N+1 query.
+
+- Listener `before_cursor_execute` trên engine tăng bộ đếm trong `flask.g` khi đang ở trong request
+  (job nền / CLI không bị đếm).
+- Sau mỗi request: thêm header `X-Query-Count` (khi QUERY_COUNTER_HEADER bật) và ghi log cảnh báo nếu vượt
+  QUERY_COUNT_WARN — trang danh sách phải chạy số query không đổi dù page size lớn bao nhiêu.
+"""
+
+import logging
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def current_query_count():
+    """Số câu SQL đã chạy trong request hiện tại."""
+    return g.get('query_count', 0) if has_request_context() else 0
+
+
+def init_query_counter(app):
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _count_query):
+        event.listen(engine, 'before_cursor_execute', _count_query)
+
+    @app.after_request
+    def _report_query_count(response):
+        count = current_query_count()
+        if app.config.get('QUERY_COUNTER_HEADER'):
+            response.headers['X-Query-Count'] = str(count)
+        threshold = app.config.get('QUERY_COUNT_WARN', 30)
+        if threshold and count > threshold:
+            logger.warning("%s %s chạy %d câu SQL (ngưỡng %d)", request.method, request.path, count, threshold)
+        return response
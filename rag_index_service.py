@@ -0,0 +1,155 @@
+"""rag_index_service.py
+
+Đồng bộ tăng dần RAG index (ChromaDB, routes/chatbot.py) với bảng Book.
+
+Trước đây build_index() upsert TOÀN BỘ sách active mỗi lần gọi — cả thư viện bị embedding lại qua Gemini dù chỉ
+một mô tả thay đổi, còn sách đã ẩn thì không bao giờ bị xóa khỏi collection. Giờ:
+
+- Mỗi sách đã index có một dòng RagIndexState(book_id, content_hash). Hash = sha256(văn bản embedding + model),
+  nên chỉ sách mới hoặc có tựa/tác giả/thể loại/mô tả thay đổi mới được embedding lại. Số lượng còn lại trong
+  metadata chỉ là ảnh chụp lúc index (chatbot luôn đọc số thực từ DB).
+- Sách không còn active hoặc đã bị xóa: xóa id khỏi collection và xóa dòng trạng thái.
+- sync_index(book_ids) chỉ xét các sách được chỉ định; sync_index() quét cả catalog theo batch keyset, chỉ đọc DB và
+  so hash — chi phí embedding tỉ lệ với số sách thay đổi. Quét toàn bộ cũng dọn các id "mồ côi" trong collection.
+- request_reindex(book_ids): các route ghi sách của admin gọi sau commit; các id được gom lại và đồng bộ trong
+  thread nền sau RAG_REINDEX_DELAY_SECONDS (request không phải chờ Gemini).
+"""
+
+import hashlib
+import threading
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, Book, RagIndexState
+
+_pending = set()
+_pending_lock = threading.Lock()
+_timer = None
+
+
+def content_hash(document, model):
+    return hashlib.sha256(f'{model}\x1f{document}'.encode('utf-8')).hexdigest()
+
+
+def _sync_batch(chatbot, book_ids, force, stats):
+    """Đồng bộ một nhóm id: embedding sách mới/đổi, xóa sách ẩn/đã xóa. Commit trạng thái sau khi Chroma thành công."""
+    books = {b.id: b for b in Book.query.filter(Book.id.in_(book_ids)).all()}
+    states = {s.book_id: s for s in RagIndexState.query.filter(RagIndexState.book_id.in_(book_ids)).all()}
+
+    upsert_ids, documents, metadatas, hashes = [], [], [], {}
+    delete_ids = []
+    for book_id in book_ids:
+        book = books.get(book_id)
+        if book is None or not book.is_active:
+            delete_ids.append(book_id)
+            continue
+        document, metadata = chatbot.book_document(book)
+        digest = content_hash(document, chatbot.EMBEDDING_MODEL)
+        state = states.get(book_id)
+        if not force and state is not None and state.content_hash == digest:
+            stats['unchanged'] += 1
+            continue
+        upsert_ids.append(str(book_id))
+        documents.append(document)
+        metadatas.append(metadata)
+        hashes[book_id] = digest
+
+    if upsert_ids:
+        chatbot.collection.upsert(ids=upsert_ids, documents=documents, metadatas=metadatas)
+    if delete_ids:
+        chatbot.collection.delete(ids=[str(book_id) for book_id in delete_ids])
+
+    now = datetime.now()
+    for book_id, digest in hashes.items():
+        state = states.get(book_id)
+        if state is None:
+            db.session.add(RagIndexState(book_id=book_id, content_hash=digest, indexed_at=now))
+        else:
+            state.content_hash = digest
+            state.indexed_at = now
+    removed = [book_id for book_id in delete_ids if book_id in states]
+    if removed:
+        RagIndexState.query.filter(RagIndexState.book_id.in_(removed)).delete(synchronize_session=False)
+    db.session.commit()
+    stats['embedded'] += len(hashes)
+    stats['deleted'] += len(delete_ids)
+
+
+def sync_index(book_ids=None, force=False, batch_size=100):
+    """Đồng bộ collection với DB.
+
+    Args:
+        book_ids: chỉ các sách này; None = quét toàn bộ catalog (kể cả dọn id mồ côi trong collection).
+        force: embedding lại cả sách không đổi (ví dụ sau khi đổi định dạng văn bản).
+        batch_size: số sách mỗi lần upsert (embedding_service tách tiếp theo EMBEDDING_BATCH_SIZE và chạy song song).
+
+    Returns:
+        tuple: (success, message, stats) với stats {'embedded', 'deleted', 'unchanged'}
+    """
+    from routes import chatbot
+
+    stats = {'embedded': 0, 'deleted': 0, 'unchanged': 0}
+    if not chatbot.collection:
+        return False, "ChromaDB not initialized", stats
+
+    try:
+        if book_ids is not None:
+            book_ids = sorted(set(book_ids))
+            for start in range(0, len(book_ids), batch_size):
+                _sync_batch(chatbot, book_ids[start:start + batch_size], force, stats)
+        else:
+            last_id = 0
+            while True:
+                chunk = [book_id for (book_id,) in db.session.query(Book.id).filter(
+                    Book.id > last_id).order_by(Book.id).limit(batch_size)]
+                if not chunk:
+                    break
+                _sync_batch(chatbot, chunk, force, stats)
+                last_id = chunk[-1]
+            _remove_orphans(chatbot, stats)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Incremental indexing failed: {e}")
+        return False, str(e), stats
+
+    return True, (f"Embedded {stats['embedded']} books, removed {stats['deleted']}, "
+                  f"{stats['unchanged']} unchanged"), stats
+
+
+def _remove_orphans(chatbot, stats):
+    """Xóa khỏi collection/trạng thái các id không còn là sách active (sách bị xóa hẳn, index cũ trước khi có hash)."""
+    active = {str(book_id) for (book_id,) in db.session.query(Book.id).filter(Book.is_active == True)}
+    orphan_ids = [book_id for book_id in chatbot.collection.get(include=[])['ids'] if book_id not in active]
+    if orphan_ids:
+        chatbot.collection.delete(ids=orphan_ids)
+    RagIndexState.query.filter(~RagIndexState.book_id.in_(
+        db.session.query(Book.id).filter(Book.is_active == True))).delete(synchronize_session=False)
+    db.session.commit()
+    stats['deleted'] += len(orphan_ids)
+
+
+def request_reindex(book_ids):
+    """Xếp các sách vừa thêm/sửa/ẩn vào hàng đợi đồng bộ nền (gom các thay đổi trong RAG_REINDEX_DELAY_SECONDS)."""
+    global _timer
+    app = current_app._get_current_object()
+    with _pending_lock:
+        _pending.update(book_ids)
+        if _timer is None:
+            _timer = threading.Timer(app.config.get('RAG_REINDEX_DELAY_SECONDS', 5), _run_pending, args=(app,))
+            _timer.daemon = True
+            _timer.start()
+
+
+def _run_pending(app):
+    global _timer
+    with _pending_lock:
+        book_ids = list(_pending)
+        _pending.clear()
+        _timer = None
+    with app.app_context():
+        success, message, _ = sync_index(book_ids)
+        if not success:
+            # Hash chưa được cập nhật nên lần build_index/đồng bộ sau sẽ embedding lại các sách này
+            app.logger.error(f"RAG reindex failed for {len(book_ids)} books: {message}")
+        db.session.remove()
@@ -0,0 +1,66 @@
+"""rate_limit.py
+
+Bộ giới hạn tốc độ dùng chung cho các tác vụ gọi dịch vụ bên ngoài (SMTP, API...).
+
+TokenBucket:
+ - `rate`: số token được nạp lại mỗi giây (tốc độ trung bình cho phép).
+ - `capacity`: số token tối đa (cho phép "burst" ngắn).
+ - acquire() chặn (sleep) cho tới khi đủ token; an toàn khi gọi từ nhiều thread.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket thread-safe.
+
+    Ví dụ: TokenBucket(rate=5, capacity=10) cho phép tối đa 10 lần gọi liên tiếp,
+    sau đó trung bình 5 lần/giây.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate phải lớn hơn 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Lấy token nếu đủ, không chờ. Trả về True/False."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Chờ tới khi lấy được `tokens` token.
+
+        Returns:
+            bool: True nếu lấy được, False nếu hết `timeout` (giây).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
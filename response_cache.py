@@ -0,0 +1,119 @@
+"""response_cache.py
+
+Cache câu trả lời của chatbot theo ngữ nghĩa (routes/chatbot.get_ai_response).
+
+Mỗi tin nhắn /chat trước đây đều gọi Gemini sinh câu trả lời (vài giây + hạn mức API), kể cả khi nhiều sinh viên
+hỏi gần như cùng một câu trong vài phút. Giờ:
+
+- Câu hỏi được embedding (embedding_client.embed_query: đã chuẩn hoá và có cache, nên bước này thường không gọi
+  API, và chính vector đó được Strategy C dùng lại). Vector của các câu hỏi đã trả lời được giữ trong một ma trận
+  numpy đã chuẩn hoá; tra cứu = một phép nhân ma trận-vector (cosine similarity) trên toàn bộ cache.
+- Câu hỏi mới có độ tương đồng >= CHAT_CACHE_SIMILARITY với một câu đã trả lời thì trả ngay câu trả lời cũ.
+- Mỗi mục gắn với phiên bản (CATALOG, AVAILABILITY) của catalog_version.py lúc sinh câu trả lời: thêm/sửa/ẩn sách
+  hoặc bất kỳ lượt mượn/trả nào làm phiên bản đổi và cả cache bị bỏ — câu trả lời không bao giờ nói sai tồn kho.
+- Hết hạn sau CHAT_CACHE_TTL_SECONDS; tối đa CHAT_CACHE_MAX_ENTRIES mục mỗi worker (đầy thì thay mục hết hạn hoặc
+  lâu không dùng nhất). CHAT_CACHE_MAX_ENTRIES = 0 để tắt.
+- Chỉ lưu câu trả lời sinh thành công (không lưu thông báo lỗi). Tỉ lệ trúng: counter
+  `chat_response_cache_total{result="hit|miss"}` trong metrics.py.
+"""
+
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+
+import catalog_version
+from metrics import chat_response_cache
+
+
+def current_version():
+    return catalog_version.current(catalog_version.CATALOG), catalog_version.current(catalog_version.AVAILABILITY)
+
+
+class SemanticResponseCache:
+    """Các slot cố định: ma trận vector (đã chuẩn hoá), câu trả lời, hạn dùng và lần dùng cuối của từng slot."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._version = None
+        self._reset(None)
+
+    def _reset(self, dim):
+        self._vectors = None if dim is None else np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._answers = [None] * self.max_entries
+        self._expires = np.zeros(self.max_entries)
+        self._last_used = np.zeros(self.max_entries)
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def lookup(self, vector, version, threshold, now=None):
+        """Câu trả lời của câu hỏi gần nhất nếu similarity >= threshold, ngược lại None."""
+        now = time.time() if now is None else now
+        query = self._unit(vector)
+        with self._lock:
+            if self._version != version:
+                self._version = version
+                self._reset(None)
+            if query is None or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                return None
+            scores = self._vectors @ query
+            scores[self._expires <= now] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            self._last_used[best] = now
+            return self._answers[best]
+
+    def store(self, vector, answer, version, ttl, now=None):
+        now = time.time() if now is None else now
+        vector = self._unit(vector)
+        if vector is None:
+            return
+        with self._lock:
+            if self._version != version:
+                return  # catalog/tồn kho đã đổi trong lúc sinh câu trả lời
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._reset(vector.shape[0])
+            # Slot trống/hết hạn trước, sau đó slot lâu không dùng nhất
+            priority = np.where(self._expires > now, self._last_used, -1.0)
+            slot = int(np.argmin(priority))
+            self._vectors[slot] = vector
+            self._answers[slot] = answer
+            self._expires[slot] = now + ttl
+            self._last_used[slot] = now
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Cache của worker (None nếu CHAT_CACHE_MAX_ENTRIES = 0)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                max_entries = current_app.config.get('CHAT_CACHE_MAX_ENTRIES', 500)
+                _cache = SemanticResponseCache(max_entries) if max_entries > 0 else False
+    return _cache or None
+
+
+def cached_answer(vector, version):
+    cache = get_response_cache()
+    if cache is None:
+        return None
+    answer = cache.lookup(vector, version, current_app.config.get('CHAT_CACHE_SIMILARITY', 0.95))
+    chat_response_cache.inc(result='hit' if answer is not None else 'miss')
+    return answer
+
+
+def remember_answer(vector, answer, version):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.store(vector, answer, version, current_app.config.get('CHAT_CACHE_TTL_SECONDS', 600))
@@ -0,0 +1,188 @@
+"""retention_service.py
+
+Dọn dẹp định kỳ các bảng chỉ tăng mà không bao giờ bị xóa (retention / garbage collection).
+
+Chính sách (POLICIES):
+- email_verification, phone_verification: OTP đã hết hạn quá 1 ngày.
+- password_reset: mã đã dùng, hoặc đã hết hạn quá 1 ngày.
+- notification: thông báo đã đọc cũ hơn NOTIFICATION_RETENTION_DAYS, chưa đọc cũ hơn 1 năm.
+
+Cách xóa:
+- Theo từng batch nhỏ giới hạn bằng keyset (`id > last_id ORDER BY id LIMIT n`) rồi `DELETE ... WHERE id IN (...)`,
+  mỗi batch một transaction ngắn để không giữ lock lâu trên bảng đang phục vụ request.
+- Nếu cấu hình RETENTION_ARCHIVE_DIR, các dòng bị xóa được ghi ra file JSON Lines nén gzip trước khi xóa.
+- Mỗi lần chạy ghi một dòng RetentionRun (số dòng đã xóa, số batch, file lưu trữ) để theo dõi.
+- exclusive_job(): khoá file dùng chung để các worker gunicorn (mỗi worker có scheduler riêng) không chạy trùng.
+"""
+
+import fcntl
+import gzip
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_, and_
+
+from models import (
+    db, EmailVerification, PhoneVerification, PasswordReset, Notification, RetentionRun
+)
+
+
+class RetentionPolicy:
+    """Chính sách dọn dẹp cho một bảng.
+
+    - model: model SQLAlchemy (phải có khóa chính `id` tăng dần)
+    - condition: hàm (now, config) -> biểu thức SQLAlchemy chọn các dòng được phép xóa
+    - archive: có ghi ra file trước khi xóa hay không (khi RETENTION_ARCHIVE_DIR được cấu hình)
+    """
+
+    def __init__(self, model, condition, archive=True):
+        self.model = model
+        self.condition = condition
+        self.archive = archive
+
+    @property
+    def table_name(self):
+        return self.model.__tablename__
+
+
+POLICIES = [
+    RetentionPolicy(
+        EmailVerification,
+        lambda now, config: EmailVerification.expires_at < now - timedelta(days=1),
+        archive=False
+    ),
+    RetentionPolicy(
+        PhoneVerification,
+        lambda now, config: PhoneVerification.expires_at < now - timedelta(days=1),
+        archive=False
+    ),
+    RetentionPolicy(
+        PasswordReset,
+        lambda now, config: or_(PasswordReset.used == True,
+                                PasswordReset.expires_at < now - timedelta(days=1)),
+        archive=False
+    ),
+    RetentionPolicy(
+        Notification,
+        lambda now, config: or_(
+            and_(Notification.is_read == True,
+                 Notification.created_at < now - timedelta(days=config.get('NOTIFICATION_RETENTION_DAYS', 90))),
+            Notification.created_at < now - timedelta(days=365)
+        )
+    ),
+]
+
+
+def _serialize(row):
+    data = {}
+    for column in row.__table__.columns:
+        value = getattr(row, column.key)
+        data[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+
+@contextmanager
+def exclusive_job(name):
+    """Khoá file trong SHARED_STATE_DIR để chỉ một worker gunicorn chạy job `name` tại một thời điểm.
+
+    Yields:
+        bool: True nếu lấy được khoá, False nếu worker khác đang chạy (caller nên bỏ qua).
+    """
+    lock_dir = current_app.config['SHARED_STATE_DIR']
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, f'{name}.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def purge_table(policy, now=None, batch_size=None, archive_dir=None, pause_seconds=0.0, archive_name=None):
+    """Xóa các dòng thỏa `policy` theo batch keyset.
+
+    archive_name: tên file lưu trữ (không kèm đuôi); mặc định `<bảng>-<thời điểm chạy>`.
+
+    Returns:
+        dict: {'table', 'rows_deleted', 'batches', 'archive_path', 'seconds', 'error'}
+    """
+    config = current_app.config
+    now = now or datetime.now()
+    batch_size = batch_size or config.get('RETENTION_BATCH_SIZE', 500)
+    archive_dir = config.get('RETENTION_ARCHIVE_DIR') if archive_dir is None else archive_dir
+    model = policy.model
+
+    run = RetentionRun(table_name=policy.table_name, started_at=now)
+    db.session.add(run)
+    db.session.commit()
+
+    archive_file = None
+    if archive_dir and policy.archive:
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_name = archive_name or f"{policy.table_name}-{now.strftime('%Y%m%d-%H%M%S')}"
+        run.archive_path = os.path.join(archive_dir, f"{archive_name}.jsonl.gz")
+
+    started = time.monotonic()
+    last_id, deleted, batches, error = 0, 0, 0, None
+    try:
+        while True:
+            ids = [row_id for (row_id,) in db.session.query(model.id).filter(
+                model.id > last_id,
+                policy.condition(now, config)
+            ).order_by(model.id).limit(batch_size).all()]
+            if not ids:
+                break
+
+            if run.archive_path:
+                if archive_file is None:
+                    archive_file = gzip.open(run.archive_path, 'at', encoding='utf-8')
+                for row in model.query.filter(model.id.in_(ids)).order_by(model.id).all():
+                    archive_file.write(json.dumps(_serialize(row), ensure_ascii=False) + '\n')
+                archive_file.flush()
+
+            deleted += model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            batches += 1
+            last_id = ids[-1]
+            if pause_seconds:
+                time.sleep(pause_seconds)
+    except Exception as e:
+        db.session.rollback()
+        error = str(e)[:255]
+        print(f"Lỗi khi dọn dẹp bảng {policy.table_name}: {e}")
+    finally:
+        if archive_file is not None:
+            archive_file.close()
+
+    run.rows_deleted = deleted
+    run.batches = batches
+    run.error = error
+    run.finished_at = datetime.now()
+    if not deleted and archive_file is None:
+        run.archive_path = None
+    db.session.commit()
+
+    return {
+        'table': policy.table_name,
+        'rows_deleted': deleted,
+        'batches': batches,
+        'archive_path': run.archive_path,
+        'seconds': round(time.monotonic() - started, 3),
+        'error': error,
+    }
+
+
+def purge_expired_rows(now=None):
+    """Chạy tất cả chính sách retention. Trả về list kết quả của từng bảng ([] nếu worker khác đang chạy)."""
+    with exclusive_job('retention') as acquired:
+        if not acquired:
+            return []
+        return [purge_table(policy, now=now) for policy in POLICIES]
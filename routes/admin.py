@@ -2,64 +2,59 @@
 
 Blueprint cho các chức năng quản trị (admin):
  - dashboard: thống kê nhanh
- - books: quản lý sách (thêm/sửa/ẩn)
+ - books: quản lý sách (thêm/sửa/ẩn, import hàng loạt từ CSV/JSON)
  - users: quản lý người dùng (tìm kiếm, thay đổi vai trò, xóa)
  - borrows: xem và xử lý lịch sử mượn (admin có thể đánh dấu trả sách)
+ - campaigns: gửi email thông báo hàng loạt (tạo, chạy, tạm dừng/tiếp tục, xem tiến độ)
+ - analytics: thống kê lưu thông sách (xu hướng mượn, top sách/tác giả, thể loại, quá hạn theo role)
+ - activity: nhật ký hoạt động (infinite scroll, JSON phân trang theo cursor `before`)
+ - export: xuất borrows/users/audit dạng CSV hoặc JSONL (stream, tùy chọn gzip)
 
 Ghi chú: tất cả route admin đều dùng decorator `@admin_required` để bảo đảm quyền truy cập.
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from models import db, User, Book, Borrow, Audit, Notification
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from models import db, User, Book, Borrow, Audit, Notification, EmailCampaign, CatalogImport
 from decorators import admin_required
 from config import CATEGORY_MAP, LOAN_PERIOD_DAYS
 from datetime import datetime, timedelta
+from sqlalchemy.orm import contains_eager, joinedload
 from email_service import send_borrow_approved_email, send_borrow_rejected_email
-import re
+from bulk_mail_service import (
+    create_campaign, start_campaign, pause_campaign, cancel_campaign, campaign_progress, ACTIVE_STATUSES
+)
+from activity_service import activity_page, serialize_item
+from stats_service import get_dashboard_stats
+from analytics_service import get_analytics
+from catalog_import_service import create_import, start_import, import_progress
+from account_service import remove_users
+from export_service import borrows_export_query, users_export_query, audit_export_query, stream_export
+from circulation_service import filter_borrows, order_borrows, filter_counts, due_soon_days, STATUS_FILTERS
+from metrics import panel_data
+from rag_index_service import request_reindex
 
 admin = Blueprint('admin_bp', __name__)
 
 @admin.route('/')
 @admin_required
 def dashboard():
-    total_books = Book.query.count()
-    total_users = User.query.filter_by(is_admin=False).count()
-    active_borrows = Borrow.query.filter_by(return_date=None).count()
-    total_borrows = Borrow.query.count()
-    recent_activities = Audit.query.order_by(Audit.timestamp.desc()).limit(10).all()
-
-    # Prepare display versions of the activity details: replace user IDs with usernames when possible
-    recent_activities_display = []
-    user_ref_pattern = re.compile(r"\b(User|user|Admin|admin|Người dùng|người dùng)\s+(\d+)\b")
-
-    for a in recent_activities:
-        details = a.details or ''
-
-        def _replace_user(match):
-            label = match.group(1)
-            uid = match.group(2)
-            try:
-                u = User.query.get(int(uid))
-            except Exception:
-                u = None
-            if u:
-                return f"{label} {u.username}"
-            return match.group(0)
-
-        display_details = user_ref_pattern.sub(_replace_user, details)
-
-        recent_activities_display.append({
-            'timestamp': a.timestamp,
-            'action': a.action,
-            'details': display_details
-        })
+    # Bộ đếm đọc từ bảng dashboard_stats (một dòng), không COUNT(*) trên từng bảng
+    stats = get_dashboard_stats()
+    # Hoạt động gần đây: username được resolve theo lô (một truy vấn IN + cache), không còn N+1
+    recent_activities, _ = activity_page(limit=10)
+
+    active_campaigns = EmailCampaign.query.filter(
+        EmailCampaign.status.in_(ACTIVE_STATUSES)
+    ).order_by(EmailCampaign.id.desc()).all()
 
     return render_template('admin/dashboard.html',
-                         total_books=total_books,
-                         total_users=total_users,
-                         active_borrows=active_borrows,
-                         total_borrows=total_borrows,
-                         recent_activities=recent_activities_display)
+                         total_books=stats['total_books'],
+                         total_users=stats['total_users'],
+                         active_borrows=stats['active_borrows'],
+                         total_borrows=stats['total_borrows'],
+                         stats=stats,
+                         recent_activities=recent_activities,
+                         campaigns=[campaign_progress(c) for c in active_campaigns])
 
 @admin.route('/books')
 @admin_required
@@ -136,6 +131,8 @@ def toggle_user_active(user_id):
         actor_user_id=session.get('user_id'),
         target_borrow_id=None,
         target_book_id=None,
+        target_user_id=user.id,
+        details_json={'is_active': user.is_active},
         details=f'Admin {session.get("user_id")} set is_active={user.is_active} for user {user.id}'
     )
     db.session.add(audit)
@@ -151,54 +148,26 @@ def borrows():
     user_filter = request.args.get('user', '')
     book_filter = request.args.get('book', '')
     status = request.args.get('status', '')
+    if status not in STATUS_FILTERS:
+        status = ''  # giá trị lạ: không lọc, để tổng số (counts['all']) khớp với danh sách
+    sort = request.args.get('sort', '')
+    due_days = due_soon_days(request.args.get('due_days'))
+    counts = filter_counts(due_days)
     
-    # Query with explicit joins and select all needed columns
-    query = db.session.query(Borrow, User, Book).join(User, Borrow.user_id == User.id).join(Book, Borrow.book_id == Book.id)
-    
-    if user_filter:
-        query = query.filter(User.username.like(f'%{user_filter}%'))
-    if book_filter:
-        query = query.filter(Book.title.like(f'%{book_filter}%'))
-    if status == 'pending':
-        query = query.filter(Borrow.status == 'pending')
-    elif status == 'borrowing':
-        query = query.filter(Borrow.status == 'approved', Borrow.return_date == None)
-    elif status == 'returned':
-        query = query.filter(Borrow.return_date != None)
-    
-    pagination = query.order_by(Borrow.borrow_date.desc()).paginate(page=page, per_page=10)
-    
-    # Transform results to include user and book objects
-    borrows_with_relations = []
-    for borrow, user, book in pagination.items:
-        borrow.user = user
-        borrow.book = book
-        borrows_with_relations.append(borrow)
-    
-    # Create a new pagination object with transformed items
-    class BorrowPagination:
-        def __init__(self, items, page, pages, total, has_prev, has_next, prev_num, next_num):
-            self.items = items
-            self.page = page
-            self.pages = pages
-            self.total = total
-            self.has_prev = has_prev
-            self.has_next = has_next
-            self.prev_num = prev_num
-            self.next_num = next_num
-    
-    borrows = BorrowPagination(
-        items=borrows_with_relations,
-        page=pagination.page,
-        pages=pagination.pages,
-        total=pagination.total,
-        has_prev=pagination.has_prev,
-        has_next=pagination.has_next,
-        prev_num=pagination.prev_num,
-        next_num=pagination.next_num
+    # Join User/Book để lọc; contains_eager dùng luôn các cột đã join để điền borrow.user / borrow.book
+    query = Borrow.query.join(User, Borrow.user_id == User.id).join(Book, Borrow.book_id == Book.id).options(
+        contains_eager(Borrow.user), contains_eager(Borrow.book)
     )
+    query = order_borrows(filter_borrows(query, user_filter, book_filter, status, due_days=due_days), sort, status)
+    if user_filter or book_filter:
+        borrows = query.paginate(page=page, per_page=10)
+    else:
+        # Không lọc theo user/sách: dùng số lượng đã cache thay vì COUNT(*) mỗi lần tải trang
+        borrows = query.paginate(page=page, per_page=10, count=False)
+        borrows.total = counts.get(status or 'all', 0)
     
-    return render_template('admin/borrows.html', borrows=borrows, timedelta=timedelta)
+    return render_template('admin/borrows.html', borrows=borrows, counts=counts, due_days=due_days,
+                           now=datetime.now(), timedelta=timedelta)
 
 @admin.route('/books/add', methods=['GET', 'POST'])
 @admin_required
@@ -214,12 +183,57 @@ def add_book():
                    quantity=quantity, available_quantity=quantity, image_url=image_url)
         db.session.add(book)
         db.session.commit()
+        request_reindex([book.id])
         
         flash('Thêm sách mới thành công!', 'success')
         return redirect(url_for('admin_bp.books'))
         
     return render_template('admin/add_book.html', categories=CATEGORY_MAP.values())
 
+@admin.route('/books/import', methods=['GET', 'POST'])
+@admin_required
+def import_books():
+    """Import sách hàng loạt từ CSV/JSON (chạy nền, xem catalog_import_service.py)."""
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename:
+            flash('Vui lòng chọn file CSV hoặc JSON.', 'danger')
+            return redirect(url_for('admin_bp.import_books'))
+
+        job, success, message = create_import(
+            file,
+            update_existing=bool(request.form.get('update_existing')),
+            created_by=session.get('user_id')
+        )
+        if not success:
+            flash(message, 'danger')
+            return redirect(url_for('admin_bp.import_books'))
+
+        audit = Audit(
+            action='import_books',
+            actor_user_id=session.get('user_id'),
+            details_json={'import_id': job.id, 'filename': job.filename},
+            details=f'Admin {session.get("user_id")} import sách từ file {job.filename} (job {job.id})'
+        )
+        db.session.add(audit)
+        db.session.commit()
+
+        start_import(job.id)
+        flash(message, 'success')
+        return redirect(url_for('admin_bp.import_books'))
+
+    jobs = CatalogImport.query.order_by(CatalogImport.id.desc()).limit(20).all()
+    return render_template('admin/import_books.html', jobs=[import_progress(j) for j in jobs],
+                           categories=CATEGORY_MAP)
+
+
+@admin.route('/books/import/progress')
+@admin_required
+def import_books_progress():
+    """JSON tiến độ các job import gần nhất (trang import poll định kỳ)."""
+    jobs = CatalogImport.query.order_by(CatalogImport.id.desc()).limit(20).all()
+    return jsonify({'success': True, 'jobs': [import_progress(j) for j in jobs]})
+
 @admin.route('/books/edit/<int:book_id>', methods=['GET', 'POST'])
 @admin_required
 def edit_book(book_id):
@@ -239,6 +253,7 @@ def edit_book(book_id):
         if hasattr(book, 'description'):
             book.description = request.form.get('description')
         db.session.commit()
+        request_reindex([book.id])
         flash('Cập nhật sách thành công!', 'success')
         return redirect(url_for('admin_bp.books'))
     return render_template('admin/edit_book.html', book=book, categories=CATEGORY_MAP.values())
@@ -249,6 +264,7 @@ def delete_book(book_id):
     book = Book.query.get_or_404(book_id)
     book.is_active = False
     db.session.commit()
+    request_reindex([book.id])
     flash('Đã ẩn sách khỏi thư viện.', 'success')
     return redirect(url_for('admin_bp.books'))
 
@@ -264,17 +280,8 @@ def delete_user(user_id):
         flash('Không thể xóa tài khoản admin.', 'danger')
         return redirect(url_for('admin_bp.users'))
         
-    # Process user's borrows
-    borrows = Borrow.query.filter_by(user_id=user_id).all()
-    for borrow in borrows:
-        if not borrow.return_date:
-            book = Book.query.get(borrow.book_id)
-            if book:
-                book.quantity += 1
-        db.session.delete(borrow)
-    
-    db.session.delete(user)
-    db.session.commit()
+    # Hoàn lại sách đang mượn, xóa lịch sử mượn và tài khoản (set-based, xem account_service.py)
+    remove_users([user.id], actor_user_id=session.get('user_id'))
     flash('Đã xóa người dùng và lịch sử mượn sách của họ.', 'success')
     return redirect(url_for('admin_bp.users'))
 
@@ -282,7 +289,9 @@ def delete_user(user_id):
 @admin_required
 def user_history(user_id):
     user = User.query.get_or_404(user_id)
-    borrows = Borrow.query.filter_by(user_id=user_id).order_by(Borrow.borrow_date.desc()).all()
+    borrows = Borrow.query.filter_by(user_id=user_id).options(
+        joinedload(Borrow.book)
+    ).order_by(Borrow.borrow_date.desc()).all()
     has_unreturned_books = any(not borrow.return_date for borrow in borrows)
     
     return render_template('admin/user_history.html', 
@@ -328,6 +337,8 @@ def return_book(borrow_id):
             actor_user_id=session.get('user_id'),
             target_borrow_id=borrow.id,
             target_book_id=borrow.book_id,
+            target_user_id=borrow.user_id,
+            details_json={'condition': book_condition, 'notes': return_notes or None},
             details=audit_details
         )
         db.session.add(audit)
@@ -367,6 +378,8 @@ def update_student_id(user_id):
         actor_user_id=session['user_id'],
         target_borrow_id=None,
         target_book_id=None,
+        target_user_id=user.id,
+        details_json={'old_student_staff_id': old_id, 'new_student_staff_id': new_id},
         details=f'Admin {session["user_id"]} cập nhật MSSV/MSCB của user {user.id} từ {old_id} thành {new_id}'
     )
     
@@ -407,6 +420,8 @@ def approve_borrow(borrow_id):
         actor_user_id=session.get('user_id'),
         target_borrow_id=borrow.id,
         target_book_id=borrow.book_id,
+        target_user_id=borrow.user_id,
+        details_json={'expected_return_date': borrow.expected_return_date.isoformat() if borrow.expected_return_date else None},
         details=f'Admin {session.get("user_id")} duyệt yêu cầu mượn sách ID {borrow.id}'
     )
     db.session.add(audit)
@@ -462,6 +477,7 @@ def reject_borrow(borrow_id):
         actor_user_id=session.get('user_id'),
         target_borrow_id=borrow.id,
         target_book_id=borrow.book_id,
+        target_user_id=borrow.user_id,
         details=f'Admin {session.get("user_id")} từ chối yêu cầu mượn sách ID {borrow.id}'
     )
     db.session.add(audit)
@@ -494,3 +510,158 @@ def reject_borrow(borrow_id):
     
     flash('Đã từ chối yêu cầu mượn sách.', 'info')
     return redirect(url_for('admin_bp.borrows'))
+
+
+@admin.route('/campaigns', methods=['GET', 'POST'])
+@admin_required
+def campaigns():
+    """Danh sách và tạo chiến dịch email thông báo hàng loạt."""
+    if request.method == 'POST':
+        campaign, success, message = create_campaign(
+            request.form.get('subject'),
+            request.form.get('body'),
+            created_by=session.get('user_id')
+        )
+        if not success:
+            flash(message, 'danger')
+            return redirect(url_for('admin_bp.campaigns'))
+
+        audit = Audit(
+            action='create_campaign',
+            actor_user_id=session.get('user_id'),
+            target_borrow_id=None,
+            target_book_id=None,
+            details_json={'campaign_id': campaign.id, 'subject': campaign.subject},
+            details=f'Admin {session.get("user_id")} tạo chiến dịch email ID {campaign.id}: {campaign.subject}'
+        )
+        db.session.add(audit)
+        db.session.commit()
+
+        if request.form.get('send_now'):
+            success, message = start_campaign(campaign.id)
+        flash(message, 'success' if success else 'danger')
+        return redirect(url_for('admin_bp.campaigns'))
+
+    page = request.args.get('page', 1, type=int)
+    pagination = EmailCampaign.query.order_by(EmailCampaign.id.desc()).paginate(page=page, per_page=10)
+    progress = [campaign_progress(c) for c in pagination.items]
+    return render_template('admin/campaigns.html', campaigns=pagination, progress=progress)
+
+
+@admin.route('/campaigns/<int:campaign_id>/start', methods=['POST'])
+@admin_required
+def start_campaign_route(campaign_id):
+    """Bắt đầu hoặc tiếp tục (resume) chiến dịch."""
+    success, message = start_campaign(campaign_id)
+    flash(message, 'success' if success else 'warning')
+    return redirect(request.referrer or url_for('admin_bp.campaigns'))
+
+
+@admin.route('/campaigns/<int:campaign_id>/pause', methods=['POST'])
+@admin_required
+def pause_campaign_route(campaign_id):
+    success, message = pause_campaign(campaign_id)
+    flash(message, 'success' if success else 'warning')
+    return redirect(request.referrer or url_for('admin_bp.campaigns'))
+
+
+@admin.route('/campaigns/<int:campaign_id>/cancel', methods=['POST'])
+@admin_required
+def cancel_campaign_route(campaign_id):
+    success, message = cancel_campaign(campaign_id)
+    flash(message, 'success' if success else 'warning')
+    return redirect(request.referrer or url_for('admin_bp.campaigns'))
+
+
+@admin.route('/campaigns/progress')
+@admin_required
+def campaigns_progress():
+    """JSON tiến độ các chiến dịch đang hoạt động (dashboard poll định kỳ)."""
+    active = EmailCampaign.query.filter(
+        EmailCampaign.status.in_(ACTIVE_STATUSES)
+    ).order_by(EmailCampaign.id.desc()).all()
+    return jsonify({'success': True, 'campaigns': [campaign_progress(c) for c in active]})
+
+
+@admin.route('/activity')
+@admin_required
+def activity():
+    items, next_before = activity_page()
+    return render_template('admin/activity.html', activities=items, next_before=next_before)
+
+
+@admin.route('/activity/feed')
+@admin_required
+def activity_feed():
+    """JSON cho infinite scroll: ?before=<audit id>&limit=<n>"""
+    items, next_before = activity_page(
+        before_id=request.args.get('before', type=int),
+        limit=request.args.get('limit', type=int)
+    )
+    return jsonify({'items': [serialize_item(i) for i in items], 'next_before': next_before})
+
+
+ANALYTICS_WINDOWS = (7, 30, 90, 365)
+
+
+def _analytics_days():
+    days = request.args.get('days', 30, type=int)
+    return days if days in ANALYTICS_WINDOWS else 30
+
+
+@admin.route('/analytics')
+@admin_required
+def analytics():
+    days = _analytics_days()
+    return render_template('admin/analytics.html', data=get_analytics(days), days=days, windows=ANALYTICS_WINDOWS)
+
+
+@admin.route('/analytics/data')
+@admin_required
+def analytics_data():
+    return jsonify(get_analytics(_analytics_days()))
+
+
+@admin.route('/monitoring')
+@admin_required
+def monitoring():
+    """Trang Giám sát: số liệu vận hành hiện tại gộp từ mọi worker (metrics.py)."""
+    return render_template('admin/monitoring.html', data=panel_data())
+
+
+@admin.route('/monitoring/data')
+@admin_required
+def monitoring_data():
+    return jsonify(panel_data())
+
+
+def _export_options():
+    return request.args.get('format', 'csv'), request.args.get('gzip') == '1'
+
+
+@admin.route('/export/borrows')
+@admin_required
+def export_borrows():
+    """Xuất borrows với cùng bộ lọc user/book/status như trang borrows."""
+    fmt, compress = _export_options()
+    query = borrows_export_query(
+        request.args.get('user', ''), request.args.get('book', ''), request.args.get('status', ''),
+        due_days=request.args.get('due_days'), sort=request.args.get('sort', '')
+    )
+    return stream_export(query, 'borrows', fmt, compress)
+
+
+@admin.route('/export/users')
+@admin_required
+def export_users():
+    fmt, compress = _export_options()
+    return stream_export(users_export_query(request.args.get('search', '')), 'users', fmt, compress)
+
+
+@admin.route('/export/audit')
+@admin_required
+def export_audit():
+    """Xuất audit log (dữ liệu nóng), lọc tùy chọn theo ?actor=<user id>&book=<book id>."""
+    fmt, compress = _export_options()
+    query = audit_export_query(request.args.get('actor', type=int), request.args.get('book', type=int))
+    return stream_export(query, 'audit', fmt, compress)
@@ -13,12 +13,25 @@ Lưu ý:
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from datetime import datetime, timedelta
-from models import db, Book, Borrow, Audit, User, Notification
+from models import db, Book, Borrow, Audit, User
 from email_service import send_borrow_confirmation_email
+from notification_service import create_notifications
 from config import LOAN_PERIOD_DAYS
 
 book = Blueprint('book', __name__)
 
+
+def notify_admins_borrow_request(user, book):
+    admin_ids = [admin_id for (admin_id,) in User.query.filter_by(is_admin=True).with_entities(User.id)]
+    create_notifications(
+        admin_ids,
+        message=f"Người dùng {user.username} yêu cầu mượn sách: {book.title}",
+        link=url_for('admin_bp.borrows', status='pending'),
+        type='info',
+        group_key='borrow_request',
+        group_message='{count} yêu cầu mượn sách mới đang chờ duyệt (mới nhất: {message})'
+    )
+
 @book.route('/book/<int:book_id>')
 def detail(book_id):
     """Trang chi tiết một cuốn sách."""
@@ -110,16 +123,8 @@ def borrow(book_id):
                 if user and user.email:
                     send_borrow_confirmation_email(user.email, user.username, book.title, book.author, borrow_date, expected_return_date)
                 
-                # Create notification for all admins
-                admins = User.query.filter_by(is_admin=True).all()
-                for admin in admins:
-                    notification = Notification(
-                        user_id=admin.id,
-                        message=f"Người dùng {user.username} yêu cầu mượn sách: {book.title}",
-                        link=url_for('admin_bp.borrows', status='pending'),
-                        type='info'
-                    )
-                    db.session.add(notification)
+                # Thông báo cho tất cả admin (gộp các yêu cầu liên tiếp thành một thông báo)
+                notify_admins_borrow_request(user, book)
                 db.session.commit()
             except Exception as e:
                 print(f"Lỗi gửi email/notification: {e}")
@@ -215,6 +220,7 @@ def borrow_ajax(book_id):
             actor_user_id=session['user_id'],
             target_book_id=book.id,
             target_borrow_id=borrow.id,
+            details_json={'book_title': book.title},
             details=f'Người dùng {session["user_id"]} mượn sách {book.title}'
         )
         db.session.add(audit)
@@ -227,16 +233,8 @@ def borrow_ajax(book_id):
                 deadline = datetime.now() + timedelta(days=LOAN_PERIOD_DAYS)
                 send_borrow_confirmation_email(user.email, user.username, book.title, book.author, borrow.borrow_date, deadline)
             
-            # Create notification for all admins
-            admins = User.query.filter_by(is_admin=True).all()
-            for admin in admins:
-                notification = Notification(
-                    user_id=admin.id,
-                    message=f"Người dùng {user.username} yêu cầu mượn sách: {book.title}",
-                    link=url_for('admin_bp.borrows', status='pending'),
-                    type='info'
-                )
-                db.session.add(notification)
+            # Thông báo cho tất cả admin (gộp các yêu cầu liên tiếp thành một thông báo)
+            notify_admins_borrow_request(user, book)
             db.session.commit()
         except Exception as e:
             print(f"Lỗi gửi email/notification: {e}")
@@ -322,6 +320,7 @@ def return_book(borrow_id):
                     actor_user_id=session.get('user_id'),
                     target_borrow_id=borrow.id,
                     target_book_id=borrow.book_id,
+                    details_json={'book_title': book.title},
                     details=f'Admin {session.get("user_id")} đánh dấu trả sách {book.title} (ID borrow {borrow.id})'
                 )
                 db.session.add(audit)
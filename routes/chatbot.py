@@ -5,6 +5,12 @@ from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
 import os
 import logging
+import time
+from metrics import chat_in_flight, chat_duration
+from embedding_service import EmbeddingClient
+from title_matcher import find_mentioned_books
+from availability_service import get_availability
+from response_cache import current_version, cached_answer, remember_answer
 from models import Book, db
 
 # Load environment variables
@@ -30,26 +36,17 @@ if GOOGLE_API_KEY:
 else:
     logger.error("GOOGLE_API_KEY not found in environment variables")
 
+embedding_client = EmbeddingClient(EMBEDDING_MODEL)
+
 # Initialize ChromaDB
 try:
     chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
     
-    # Custom Embedding Function using Gemini API
+    # Custom Embedding Function using Gemini API (batch, giới hạn tốc độ, thử lại: embedding_service.py)
     class GeminiEmbeddingFunction(embedding_functions.EmbeddingFunction):
         def __call__(self, input: list[str]) -> list[list[float]]:
-            try:
-                # Gemini API expects 'content' for embed_content, handling batching if needed
-                # But for simplicity, we loop or use batch method if available.
-                # The SDK supports batch embedding via embed_content(..., content=list)
-                result = genai.embed_content(
-                    model=EMBEDDING_MODEL,
-                    content=input,
-                    task_type="retrieval_document" # or retrieval_query depending on usage
-                )
-                return result['embedding']
-            except Exception as e:
-                logger.error(f"Error generating embeddings: {e}")
-                return [[] for _ in input] # Return empty on error to avoid crash
+            # Lỗi được raise (EmbeddingError) để upsert thất bại, thay vì ghi vector rỗng vào collection
+            return embedding_client.embed_documents(input)
 
     # Use our custom embedding function
     embedding_func = GeminiEmbeddingFunction()
@@ -65,53 +62,44 @@ except Exception as e:
     collection = None
 
 
-def build_index():
-    """Re-index all books from MySQL to ChromaDB"""
-    if not collection:
-        return False, "ChromaDB not initialized"
-    
-    try:
-        # Fetch all active books
-        books = Book.query.filter_by(is_active=True).all()
-        
-        if not books:
-            return True, "No books to index"
+def book_document(book):
+    """Text dùng để embedding và metadata của một cuốn sách trong ChromaDB."""
+    # Create a rich text representation for embedding
+    # Include Title, Author, Category, and Description
+    text_content = f"Tựa sách: {book.title}. Tác giả: {book.author}. Thể loại: {book.category}. Mô tả: {book.description or 'Không có mô tả'}."
+    metadata = {
+        "title": book.title,
+        "author": book.author,
+        "category": book.category or "",
+        "available_quantity": book.available_quantity or 0,
+        "id": book.id
+    }
+    return text_content, metadata
 
-        ids = []
-        documents = []
-        metadatas = []
 
-        for book in books:
-            # Create a rich text representation for embedding
-            # Include Title, Author, Category, and Description
-            text_content = f"Tựa sách: {book.title}. Tác giả: {book.author}. Thể loại: {book.category}. Mô tả: {book.description or 'Không có mô tả'}."
-            
-            ids.append(str(book.id))
-            documents.append(text_content)
-            metadatas.append({
-                "title": book.title,
-                "author": book.author,
-                "category": book.category or "",
-                "available_quantity": book.available_quantity or 0,
-                "id": book.id
-            })
-
-        # Add to ChromaDB (upsert overwrites existing IDs)
-        # Process in batches to avoid API limits if necessary, but for small library it's fine
-        collection.upsert(
-            ids=ids,
-            documents=documents,
-            metadatas=metadatas
-        )
-        
-        return True, f"Indexed {len(books)} books successfully"
-    except Exception as e:
-        logger.error(f"Indexing failed: {e}")
-        return False, str(e)
+def index_books(book_ids, batch_size=100):
+    """Đồng bộ chỉ các sách trong `book_ids` vào ChromaDB (xem rag_index_service.sync_index).
+
+    Sách không đổi nội dung thì bỏ qua; sách không còn active sẽ bị xóa khỏi collection.
+    """
+    from rag_index_service import sync_index
+    success, message, _ = sync_index(book_ids, batch_size=batch_size)
+    return success, message
+
 
+def build_index(force=False):
+    """Đồng bộ tăng dần toàn bộ catalog sang ChromaDB: chỉ embedding sách mới/thay đổi, xóa sách đã ẩn/xóa"""
+    from rag_index_service import sync_index
+    success, message, _ = sync_index(force=force)
+    return success, message
 
-def get_rag_context(query_text, n_results=5):
-    """Retrieve relevant books using Hybrid Approach (SQL + Vector Search)"""
+
+def get_rag_context(query_text, query_embedding, n_results=5):
+    """Retrieve relevant books using Hybrid Approach (SQL + Vector Search)
+
+    `query_embedding` is the question's embedding computed by the caller (None if embedding failed:
+    the vector search is skipped instead of retrying the embedding API).
+    """
     
     # 1. Keyword/Category Detection for "List All" queries
     query_lower = query_text.lower()
@@ -161,16 +149,13 @@ def get_rag_context(query_text, n_results=5):
             # Fallback to Vector Search if SQL fails
 
     # --- STRATEGY B: Specific Title Match (High Precision for specific books) ---
-    # Since the library is small, we can check if any book title appears in the query
+    # Aho-Corasick over titles/authors built once per worker (title_matcher.py): one pass over the query
     try:
-        # Get all titles to check against query
-        all_books = Book.query.filter_by(is_active=True).all()
+        book_ids = find_mentioned_books(query_text)
         found_specific_books = []
-        
-        for book in all_books:
-            # Check if title is in query (case insensitive)
-            if book.title.lower() in query_lower:
-                found_specific_books.append(book)
+        if book_ids:
+            books = {b.id: b for b in Book.query.filter(Book.id.in_(book_ids), Book.is_active == True)}
+            found_specific_books = [books[book_id] for book_id in book_ids if book_id in books]
         
         if found_specific_books:
             context_parts = ["📚 **Thông tin chi tiết sách bạn hỏi:**"]
@@ -192,13 +177,14 @@ def get_rag_context(query_text, n_results=5):
         logger.error(f"Specific Title Match failed: {e}")
 
     # --- STRATEGY C: Vector Search (Semantic Search) ---
-    if not collection:
+    if not collection or query_embedding is None:
         return ""
     
     try:
         # Query ChromaDB
+        # Embedding câu hỏi dùng task_type 'retrieval_query' (khác với văn bản sách lúc index)
         results = collection.query(
-            query_texts=[query_text],
+            query_embeddings=[query_embedding],
             n_results=n_results
         )
         
@@ -208,21 +194,22 @@ def get_rag_context(query_text, n_results=5):
         if not results['documents'] or not results['documents'][0]:
             return "Không tìm thấy sách nào liên quan trong cơ sở dữ liệu."
 
+        # Fetch real-time quantity and views for all hits at once (availability_service.py)
+        try:
+            live = get_availability(meta['id'] for meta in results['metadatas'][0])
+        except Exception as e:
+            logger.error(f"Error fetching real-time data for RAG results: {e}")
+            live = None
+
         for i, doc in enumerate(results['documents'][0]):
             meta = results['metadatas'][0][i]
-            book_id = meta['id']
-            
-            # Fetch real-time quantity and views from DB
-            real_time_qty = 0
-            real_time_views = 0
-            try:
-                book = Book.query.get(book_id)
-                if book:
-                    real_time_qty = book.available_quantity or 0
-                    real_time_views = book.views_count or 0
-            except Exception as e:
-                logger.error(f"Error fetching real-time data for book {book_id}: {e}")
+            if live is None:
                 real_time_qty = meta.get('available_quantity', 0)
+                real_time_views = 0
+            else:
+                book = live.get(meta['id'], {})
+                real_time_qty = book.get('available_quantity', 0)
+                real_time_views = book.get('views_count', 0)
 
             status = "✅ Còn sẵn" if real_time_qty > 0 else "❌ Hết sách"
             
@@ -242,13 +229,37 @@ def get_rag_context(query_text, n_results=5):
 
 
 def get_ai_response(user_message):
-    """Generate response using Gemini with RAG context"""
+    """Answer from the semantic response cache (response_cache.py) or generate one with Gemini + RAG context"""
+    version = current_version()
     try:
-        # 1. Get Context via RAG
-        context = get_rag_context(user_message)
-        
-        # 2. Construct System Prompt
-        system_instruction = """Bạn là trợ lý ảo thông minh của thư viện. Nhiệm vụ của bạn là hỗ trợ người dùng tìm kiếm sách và giải đáp thắc mắc về thư viện.
+        vector = embedding_client.embed_query(user_message)
+    except Exception as e:
+        logger.error(f"Query embedding failed, skipping response cache: {e}")
+        vector = None
+
+    if vector is not None:
+        answer = cached_answer(vector, version)
+        if answer is not None:
+            return answer
+
+    try:
+        answer = generate_answer(user_message, vector)
+    except Exception as e:
+        logger.error(f"AI Generation failed: {e}")
+        return "Xin lỗi, hệ thống đang gặp sự cố khi xử lý yêu cầu của bạn."
+
+    if vector is not None and answer:
+        remember_answer(vector, answer, version)
+    return answer
+
+
+def generate_answer(user_message, query_embedding):
+    """Generate response using Gemini with RAG context (raises on failure)"""
+    # 1. Get Context via RAG
+    context = get_rag_context(user_message, query_embedding)
+    
+    # 2. Construct System Prompt
+    system_instruction = """Bạn là trợ lý ảo thông minh của thư viện. Nhiệm vụ của bạn là hỗ trợ người dùng tìm kiếm sách và giải đáp thắc mắc về thư viện.
 
 HƯỚNG DẪN TRẢ LỜI:
 1. Dựa CHỦ YẾU vào thông tin được cung cấp trong phần 'THÔNG TIN TỪ THƯ VIỆN' dưới đây.
@@ -266,22 +277,18 @@ HƯỚNG DẪN TRẢ LỜI:
 
 THÔNG TIN TỪ THƯ VIỆN:
 """
-        
-        # 3. Call Gemini API
-        model = genai.GenerativeModel(
-            model_name=CHAT_MODEL,
-            system_instruction=system_instruction
-        )
-        
-        # Combine context and user message
-        full_prompt = f"{context}\n\nCâu hỏi của người dùng: {user_message}"
-        
-        response = model.generate_content(full_prompt)
-        return response.text
-        
-    except Exception as e:
-        logger.error(f"AI Generation failed: {e}")
-        return "Xin lỗi, hệ thống đang gặp sự cố khi xử lý yêu cầu của bạn."
+    
+    # 3. Call Gemini API
+    model = genai.GenerativeModel(
+        model_name=CHAT_MODEL,
+        system_instruction=system_instruction
+    )
+    
+    # Combine context and user message
+    full_prompt = f"{context}\n\nCâu hỏi của người dùng: {user_message}"
+    
+    response = model.generate_content(full_prompt)
+    return response.text
 
 
 # --- Routes ---
@@ -294,14 +301,17 @@ def chat():
     if not message:
         return jsonify({'error': 'No message provided'}), 400
         
-    response_text = get_ai_response(message)
+    started = time.perf_counter()
+    with chat_in_flight.track():
+        response_text = get_ai_response(message)
+    chat_duration.observe(time.perf_counter() - started)
     return jsonify({'reply': response_text})
 
 
 @chatbot.route('/rag/index', methods=['POST'])
 def trigger_indexing():
     """Manually trigger re-indexing of books"""
-    success, msg = build_index()
+    success, msg = build_index(force=request.args.get('force') == '1')
     if success:
         return jsonify({'status': 'success', 'message': msg})
     else:
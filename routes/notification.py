@@ -1,13 +1,20 @@
 """routes/notification.py
 
 Chứa các route xử lý thông báo:
-- get_notifications: lấy danh sách thông báo (JSON)
+- get_notifications: lấy danh sách thông báo (JSON); số chưa đọc đọc từ bộ đếm notification_counter
+- get_notifications_delta: chỉ các thay đổi kể từ con trỏ `since` (204 khi không có gì mới)
 - mark_read: đánh dấu đã đọc một thông báo
 - mark_all_read: đánh dấu đã đọc tất cả
+- stream: kênh Server-Sent Events đẩy thông báo mới (`notification`) và số chưa đọc mới (`unread`) ngay khi thay đổi
+  (notification_service.py); get_notifications chỉ còn dùng cho lần tải đầu, polling dự phòng dùng delta
 """
 
-from flask import Blueprint, jsonify, session, request
+from flask import Blueprint, Response, current_app, jsonify, session, request
 from models import db, Notification
+from notification_service import (
+    bus, mark_all_read as mark_all_read_for, notification_delta, serialize_notification, stream_events, sync_cursor,
+    unread_count
+)
 
 notification_bp = Blueprint('notification_bp', __name__)
 
@@ -16,30 +23,39 @@ def get_notifications():
     if not session.get('user_id'):
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
 
+    # Con trỏ đọc trước danh sách: thay đổi xảy ra giữa hai truy vấn sẽ xuất hiện (lại) ở lần delta sau
+    cursor = sync_cursor(session['user_id'])
+
     # Lấy 10 thông báo gần nhất
     notifications = Notification.query.filter_by(user_id=session['user_id'])\
-        .order_by(Notification.created_at.desc())\
+        .order_by(Notification.created_at.desc(), Notification.id.desc())\
         .limit(10).all()
     
-    # Đếm số thông báo chưa đọc
-    unread_count = Notification.query.filter_by(
-        user_id=session['user_id'], 
-        is_read=False
-    ).count()
-
     return jsonify({
         'success': True,
-        'unread_count': unread_count,
-        'notifications': [{
-            'id': n.id,
-            'message': n.message,
-            'link': n.link,
-            'is_read': n.is_read,
-            'type': n.type,
-            'created_at': n.created_at.strftime('%d/%m/%Y %H:%M')
-        } for n in notifications]
+        'unread_count': unread_count(session['user_id']),
+        'cursor': cursor,
+        'notifications': [serialize_notification(n) for n in notifications]
     })
 
+@notification_bp.route('/notifications/delta', methods=['GET'])
+def get_notifications_delta():
+    """Chỉ các thông báo mới/đổi kể từ `since` (con trỏ từ get_notifications hoặc lần delta trước).
+
+    204 khi không có thay đổi; `reset: true` khi client nên tải lại danh sách đầy đủ.
+    """
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'success': False, 'message': 'Thiếu tham số since'}), 400
+    delta = notification_delta(session['user_id'], since)
+    if delta is None:
+        return '', 204
+    return jsonify({'success': True, **delta})
+
+
 @notification_bp.route('/notifications/mark-read/<int:notification_id>', methods=['POST'])
 def mark_read(notification_id):
     if not session.get('user_id'):
@@ -60,9 +76,29 @@ def mark_all_read():
     if not session.get('user_id'):
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
 
-    Notification.query.filter_by(user_id=session['user_id'], is_read=False)\
-        .update({Notification.is_read: True})
-    
+    mark_all_read_for(session['user_id'])
     db.session.commit()
     
     return jsonify({'success': True})
+
+
+@notification_bp.route('/stream', methods=['GET'])
+def stream():
+    """Kênh SSE: sự kiện `notification` (thông báo mới) và `unread` (số chưa đọc). 503 khi worker đã đủ kết nối -> client chuyển sang polling.
+
+    Khung đầu là `sync` (thay đổi kể từ con trỏ Last-Event-ID / `since`); id của mọi sự kiện là version của bộ đếm.
+    """
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    if bus.connection_count >= current_app.config.get('NOTIFICATION_STREAM_MAX', 48):
+        return jsonify({'success': False, 'message': 'Busy'}), 503
+
+    # Con trỏ version: Last-Event-ID khi trình duyệt tự kết nối lại, `since` (từ get_notifications) ở lần đầu
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    since = int(last_event_id) if last_event_id.isdigit() else request.args.get('since', type=int)
+
+    response = Response(stream_events(user_id, since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # tắt buffer của nginx/proxy
+    return response
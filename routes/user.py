@@ -4,6 +4,7 @@
 Chứa các route liên quan tới user:
  - profile: xem và cập nhật thông tin cá nhân, upload avatar, đổi mật khẩu
  - borrows: danh sách lịch sử mượn của user
+ - email_preference: chọn nhận email ngay (immediate) hay gộp theo ngày (digest)
  - list_users, history, delete_user: các chức năng quản lý user (chỉ admin)
 
 Ghi chú:
@@ -13,9 +14,10 @@ Ghi chú:
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
 from werkzeug.exceptions import RequestEntityTooLarge
-from models import db, User, Book, Borrow, Audit
+from models import db, User, Book, Borrow
 from decorators import admin_required
 from datetime import datetime
+from sqlalchemy.orm import joinedload
 from config import allowed_file, UPLOAD_FOLDER
 import os
 from werkzeug.utils import secure_filename
@@ -23,6 +25,9 @@ from werkzeug.utils import secure_filename
 from routes.auth import hash_password, verify_password
 from phone_service import create_phone_verification, verify_phone_otp, send_sms_otp
 from email_service import create_email_verification, send_verification_email
+from digest_service import get_email_mode, set_email_mode
+from activity_service import user_names
+from account_service import remove_users
 from flask import jsonify
 
 user = Blueprint('user', __name__)
@@ -142,6 +147,7 @@ def profile():
         try:
             # Cập nhật thông tin cơ bản
             user.username = new_username
+            user_names.invalidate(user.id)
             
             # Xử lý thay đổi email
             email_changed = False
@@ -187,7 +193,18 @@ def profile():
             flash('Có lỗi xảy ra khi cập nhật thông tin. Vui lòng thử lại.', 'danger')
             return redirect(url_for('user_bp.profile'))
 
-    return render_template('user/profile.html', user=user)
+    return render_template('user/profile.html', user=user, email_mode=get_email_mode(user.id))
+
+@user.route('/email-preference', methods=['POST'])
+def email_preference():
+    """Lưu tuỳ chọn nhận email nhắc nhở/thông báo: 'immediate' hoặc 'digest'."""
+    if not session.get('user_id'):
+        flash('Vui lòng đăng nhập.', 'warning')
+        return redirect(url_for('auth_bp.login'))
+
+    success, message = set_email_mode(session['user_id'], request.form.get('email_mode'))
+    flash(message, 'success' if success else 'danger')
+    return redirect(url_for('user_bp.profile'))
 
 @user.route('/verify-phone/send', methods=['POST'])
 def send_phone_otp():
@@ -242,7 +259,9 @@ def borrows():
         flash("Vui lòng đăng nhập để xem lịch sử mượn!", "warning")
         return redirect(url_for("auth_bp.login"))
     user_id = session["user_id"]
-    records = Borrow.query.filter_by(user_id=user_id).order_by(Borrow.borrow_date.desc()).all()
+    records = Borrow.query.filter_by(user_id=user_id).options(
+        joinedload(Borrow.book)
+    ).order_by(Borrow.borrow_date.desc()).all()
     return render_template("user/borrows.html", records=records)
 
 # @user.route('/users')
@@ -268,37 +287,7 @@ def delete(user_id):
         flash('Không thể xóa user admin.', 'danger')
         return redirect(url_for('user.list_users'))
         
-    borrows = Borrow.query.filter_by(user_id=user_id).all()
-    processed_ids = []
-    restored_per_book = {}
-
-    for b in borrows:
-        processed_ids.append(b.id)
-        if not b.return_date:
-            book = Book.query.get(b.book_id)
-            if book:
-                book.available_quantity = (book.available_quantity or 0) + 1
-                restored_per_book[b.book_id] = restored_per_book.get(b.book_id, 0) + 1
-        db.session.delete(b)
-
-    details = f'Admin {session.get("user_id")} deleted user {user_id}. '
-    details += f'Processed borrows: {processed_ids}.'
-    if restored_per_book:
-        details += f' Restored counts: {restored_per_book}.'
-
-    try:
-        audit = Audit(
-            action='delete_user',
-            actor_user_id=session.get('user_id'),
-            target_borrow_id=None,
-            target_book_id=None,
-            details=details
-        )
-        db.session.add(audit)
-    except Exception:
-        db.session.rollback()
-
-    db.session.delete(user)
-    db.session.commit()
+    # Hoàn lại sách đang mượn, xóa lịch sử mượn và tài khoản (set-based, xem account_service.py)
+    remove_users([user.id], actor_user_id=session.get('user_id'))
     flash('Đã xóa user và lịch sử mượn liên quan.', 'info')
     return redirect(url_for('user_bp.list_users'))
\ No newline at end of file
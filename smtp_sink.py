@@ -0,0 +1,171 @@
+"""smtp_sink.py
+
+SMTP server giả lập chạy trong cùng process (chỉ dùng cho test và benchmark).
+
+Mục đích:
+ - Thay thế MAIL_SERVER thật (Gmail) khi chạy test, để các hàm gửi mail trong `email_service.py`
+   có thể được kiểm tra offline mà không gửi email thật.
+ - Ghi nhận số kết nối, số message và thời điểm nhận để đo throughput.
+
+Hỗ trợ tập lệnh SMTP tối thiểu mà smtplib dùng: EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT.
+Không hỗ trợ STARTTLS/AUTH — cấu hình MAIL_USE_TLS=False và để trống MAIL_USERNAME khi dùng sink.
+
+Ví dụ:
+    sink = LocalSMTPSink().start()
+    app.config['MAIL_SERVER'], app.config['MAIL_PORT'] = sink.host, sink.port
+    ...
+    sink.stop()
+"""
+
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Xử lý một kết nối SMTP."""
+
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            if line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+            if line.startswith(b'..'):
+                line = line[1:]  # dot-unstuffing
+            lines.append(line)
+
+    def handle(self):
+        sink = self.server.sink
+        sink._on_connect()
+        self._reply(f'220 {sink.host} LocalSMTPSink ready')
+        mail_from, rcpt_tos = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                break
+            command = raw.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self._reply(f'250-{sink.host}')
+                self._reply('250-8BITMIME')
+                self._reply('250 SMTPUTF8')
+            elif verb == 'HELO':
+                self._reply(f'250 {sink.host}')
+            elif verb == 'MAIL':
+                mail_from, rcpt_tos = command.split(':', 1)[-1].strip(), []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                rcpt_tos.append(command.split(':', 1)[-1].strip())
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                if mail_from is None or not rcpt_tos:
+                    self._reply('503 Bad sequence of commands')
+                    continue
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self._read_data()
+                if data is None:
+                    break
+                sink._on_message(mail_from, rcpt_tos, data)
+                mail_from, rcpt_tos = None, []
+                self._reply('250 OK: queued')
+            elif verb == 'RSET':
+                mail_from, rcpt_tos = None, []
+                self._reply('250 OK')
+            elif verb == 'NOOP':
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                break
+            else:
+                self._reply('502 Command not implemented')
+
+
+class _ThreadingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalSMTPSink:
+    """SMTP sink trong process: nhận và lưu mọi message gửi tới.
+
+    Thuộc tính:
+    - messages: list dict {mail_from, rcpt_tos, data, received_at}
+    - connections: tổng số kết nối SMTP đã mở tới sink
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, keep_messages=True):
+        self.host = host
+        self._requested_port = port
+        self.port = None
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.connections = 0
+        self.message_count = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = _ThreadingSMTPServer((self.host, self._requested_port), _SMTPHandler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset(self):
+        with self._lock:
+            self.messages = []
+            self.connections = 0
+            self.message_count = 0
+
+    def _on_connect(self):
+        with self._lock:
+            self.connections += 1
+
+    def _on_message(self, mail_from, rcpt_tos, data):
+        with self._lock:
+            self.message_count += 1
+            if self.keep_messages:
+                self.messages.append({
+                    'mail_from': mail_from,
+                    'rcpt_tos': list(rcpt_tos),
+                    'data': data,
+                    'received_at': time.monotonic(),
+                })
+
+    def messages_to(self, address):
+        """Các message có người nhận chứa `address`."""
+        with self._lock:
+            return [m for m in self.messages if any(address in r for r in m['rcpt_tos'])]
+
+    def mail_config(self):
+        """Biến môi trường / config Flask-Mail trỏ về sink."""
+        return {
+            'MAIL_SERVER': self.host,
+            'MAIL_PORT': str(self.port),
+            'MAIL_USE_TLS': 'False',
+            'MAIL_USE_SSL': 'False',
+            'MAIL_USERNAME': '',
+            'MAIL_PASSWORD': '',
+            'MAIL_DEFAULT_SENDER': 'library@localhost',
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
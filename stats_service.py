@@ -0,0 +1,158 @@
+"""stats_service.py
+
+Bộ đếm thống kê cho dashboard admin, lưu sẵn trong bảng một dòng `dashboard_stats`.
+
+Trước đây mỗi lần mở dashboard chạy 4 câu COUNT(*) (Book, User, Borrow chưa trả, tất cả Borrow) — quét toàn bảng
+khi bảng borrow lên tới hàng triệu dòng. Giờ dashboard chỉ đọc MỘT dòng:
+
+- Cộng dồn theo giao dịch: listener `after_flush` của session tính chênh lệch từ các đối tượng Book/User/Borrow
+  được thêm/xóa/sửa trong lần flush và chạy `UPDATE dashboard_stats SET x = x + :delta` trên cùng connection,
+  nên bộ đếm commit/rollback cùng với thao tác ghi. Mọi route hiện có (mượn, duyệt, từ chối, trả, xóa user,
+  thêm sách, đăng ký...) đều đi qua ORM nên không cần sửa từng route.
+- Đối chiếu định kỳ: reconcile_stats() đếm lại chính xác (job STATS_RECONCILE_MINUTES). Đây cũng là nơi duy nhất
+  tính `overdue_borrows` (thay đổi theo thời gian, không có thao tác ghi nào) và sửa sai lệch từ các câu
+  UPDATE/DELETE hàng loạt (query.update/delete) vốn không đi qua listener.
+- Thao tác ghi hàng loạt bằng Core (ví dụ import sách) tự gọi apply_deltas() trong transaction của mình.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from models import db, Book, Borrow, DashboardStats, User
+
+STATS_ROW_ID = 1
+COUNTERS = ('total_books', 'total_users', 'active_borrows', 'total_borrows', 'pending_requests')
+
+
+def _value(obj, attr, old):
+    """Giá trị thuộc tính trước (old=True) hoặc sau lần flush."""
+    if old:
+        history = sa_inspect(obj).attrs[attr].history
+        if history.deleted:
+            return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def _contribution(obj, old=False):
+    """Đóng góp của một đối tượng vào các bộ đếm."""
+    if isinstance(obj, Book):
+        return {'total_books': 1}
+    if isinstance(obj, User):
+        return {'total_users': 0 if _value(obj, 'is_admin', old) else 1}
+    if isinstance(obj, Borrow):
+        return {
+            'total_borrows': 1,
+            'active_borrows': 1 if _value(obj, 'return_date', old) is None else 0,
+            'pending_requests': 1 if _value(obj, 'status', old) == 'pending' else 0,
+        }
+    return {}
+
+
+def _collect_deltas(session):
+    deltas = dict.fromkeys(COUNTERS, 0)
+    today_checkouts = 0
+    today = datetime.now().date()
+
+    for obj in session.new:
+        for key, value in _contribution(obj).items():
+            deltas[key] += value
+        if isinstance(obj, Borrow) and (obj.borrow_date or datetime.now()).date() == today:
+            today_checkouts += 1
+    for obj in session.deleted:
+        for key, value in _contribution(obj, old=True).items():
+            deltas[key] -= value
+    for obj in session.dirty:
+        if not isinstance(obj, (User, Borrow)) or not session.is_modified(obj):
+            continue
+        before = _contribution(obj, old=True)
+        for key, value in _contribution(obj).items():
+            deltas[key] += value - before.get(key, 0)
+
+    return {k: v for k, v in deltas.items() if v}, today_checkouts
+
+
+def _after_flush(session, flush_context):
+    deltas, today_checkouts = _collect_deltas(session)
+    apply_deltas(session.connection(), deltas, today_checkouts)
+
+
+def apply_deltas(connection, deltas, today_checkouts=0):
+    """Cộng `deltas` ({counter: số}) vào dòng thống kê trên `connection` (cùng transaction với thao tác ghi).
+
+    Dùng trực tiếp cho các thao tác ghi hàng loạt bằng Core (executemany) không đi qua listener.
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas and not today_checkouts:
+        return
+
+    table = DashboardStats.__table__
+    values = {table.c[key]: table.c[key] + delta for key, delta in deltas.items()}
+    if today_checkouts:
+        today = datetime.now().date()
+        values[table.c.today_checkouts] = db.case(
+            (table.c.stats_date == today, table.c.today_checkouts + today_checkouts),
+            else_=today_checkouts
+        )
+        values[table.c.stats_date] = today
+    values[table.c.updated_at] = datetime.now()
+    # Dòng chưa tồn tại thì UPDATE không làm gì; lần reconcile đầu tiên sẽ tạo dòng với số liệu chính xác
+    connection.execute(table.update().where(table.c.id == STATS_ROW_ID).values(values))
+
+
+def register_listeners():
+    """Gắn listener cộng dồn bộ đếm vào session (gọi một lần lúc khởi động app)."""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def exact_counts(now=None):
+    """Đếm lại chính xác tất cả bộ đếm (các câu COUNT như dashboard cũ + quá hạn + mượn hôm nay)."""
+    now = now or datetime.now()
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        'total_books': Book.query.count(),
+        'total_users': User.query.filter_by(is_admin=False).count(),
+        'active_borrows': Borrow.query.filter_by(return_date=None).count(),
+        'total_borrows': Borrow.query.count(),
+        'pending_requests': Borrow.query.filter_by(status='pending').count(),
+        'overdue_borrows': Borrow.query.filter(
+            Borrow.status == 'approved',
+            Borrow.return_date.is_(None),
+            Borrow.expected_return_date < now
+        ).count(),
+        'today_checkouts': Borrow.query.filter(Borrow.borrow_date >= day_start).count(),
+    }
+
+
+def reconcile_stats(now=None):
+    """Ghi đè dòng thống kê bằng số đếm chính xác. Trả về dict chênh lệch đã sửa (giá trị mới - cũ)."""
+    now = now or datetime.now()
+    counts = exact_counts(now)
+    stats = DashboardStats.query.get(STATS_ROW_ID)
+    if stats is None:
+        stats = DashboardStats(id=STATS_ROW_ID)
+        db.session.add(stats)
+    drift = {key: value - (getattr(stats, key) or 0) for key, value in counts.items()
+             if value != (getattr(stats, key) or 0)}
+    for key, value in counts.items():
+        setattr(stats, key, value)
+    stats.stats_date = now.date()
+    stats.reconciled_at = now
+    stats.updated_at = now
+    db.session.commit()
+    return drift
+
+
+def get_dashboard_stats():
+    """Đọc dòng thống kê (một truy vấn). Chưa có dòng thì reconcile để tạo."""
+    stats = DashboardStats.query.get(STATS_ROW_ID)
+    if stats is None:
+        reconcile_stats()
+        stats = DashboardStats.query.get(STATS_ROW_ID)
+    data = {key: getattr(stats, key) or 0 for key in COUNTERS + ('overdue_borrows', 'today_checkouts')}
+    # Sang ngày mới mà chưa có lượt mượn nào thì số của hôm qua không còn đúng
+    if stats.stats_date != datetime.now().date():
+        data['today_checkouts'] = 0
+    data['reconciled_at'] = stats.reconciled_at
+    return data
@@ -0,0 +1,51 @@
+"""Xóa tài khoản có lượt mượn đã được ghi audit (audit.target_borrow_id là khóa ngoại tới borrow)."""
+
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from account_service import remove_users
+from app import app, db
+from models import User, Book, Borrow, Audit
+
+
+def test_delete_user_with_audited_loan():
+    tag = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            # SQLite chỉ kiểm tra khóa ngoại khi bật; MySQL luôn kiểm tra
+            db.session.execute(text('PRAGMA foreign_keys=ON'))
+        user = User(username=f'grad_{tag}', student_staff_id=f'GRAD_{tag}', password_hash='x')
+        book = Book(title=f'Audit {tag}', author='A', quantity=2, available_quantity=1)
+        db.session.add_all([user, book])
+        db.session.flush()
+        borrow = Borrow(user_id=user.id, book_id=book.id, book_title=book.title, status='approved',
+                        borrow_date=datetime.now(), expected_return_date=datetime.now() + timedelta(days=14))
+        db.session.add(borrow)
+        db.session.flush()
+        audit = Audit(action='approve_borrow', target_borrow_id=borrow.id, target_book_id=book.id,
+                      details=f'Approved borrow {borrow.id}')
+        db.session.add(audit)
+        db.session.commit()
+        user_id, book_id, borrow_id, audit_id = user.id, book.id, borrow.id, audit.id
+
+        try:
+            result = remove_users([user_id], mode='delete')
+
+            assert result['users'] == 1 and result['borrows'] == 1
+            db.session.expire_all()
+            assert db.session.get(User, user_id) is None
+            assert db.session.get(Borrow, borrow_id) is None
+            kept = db.session.get(Audit, audit_id)
+            assert kept is not None and kept.target_borrow_id is None
+            assert db.session.get(Book, book_id).available_quantity == 2
+        finally:
+            db.session.rollback()
+            Audit.query.filter(db.or_(Audit.id == audit_id, Audit.target_user_id == user_id)).delete(
+                synchronize_session=False)
+            Borrow.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+            User.query.filter_by(id=user_id).delete(synchronize_session=False)
+            Book.query.filter_by(id=book_id).delete(synchronize_session=False)
+            db.session.commit()
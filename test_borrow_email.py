@@ -1,5 +1,6 @@
 from app import app, db
 from models import User, Book, Borrow
+import os
 from datetime import datetime, timedelta
 from email_service import send_borrow_confirmation_email
 from config import LOAN_PERIOD_DAYS
@@ -9,7 +10,8 @@ def test_borrow_email():
         print("--- BẮT ĐẦU TEST EMAIL BORROW ---")
         
         # 1. Cấu hình email nhận test
-        test_email = "huyphanquoc8@gmail.com"
+        # Đặt TEST_EMAIL để chọn người nhận; khi chạy qua pytest, mail đi vào SMTP sink (conftest.py)
+        test_email = os.getenv('TEST_EMAIL', 'huyphanquoc8@gmail.com')
         print(f"Email nhận test: {test_email}")
         
         # 2. Tìm user
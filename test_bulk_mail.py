@@ -0,0 +1,87 @@
+"""Pause rồi resume ngay khi một batch đang gửi không được làm người nhận nhận email hai lần."""
+
+import threading
+import time
+import uuid
+
+import bulk_mail_service
+from app import app, db
+from email_service import mail
+from models import User, EmailCampaign, EmailCampaignRecipient
+
+mail.init_app(app)
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _campaign(campaign_id):
+    db.session.expire_all()
+    return db.session.get(EmailCampaign, campaign_id)
+
+
+def test_pause_resume_during_batch_sends_once(smtp_sink, monkeypatch):
+    app.config.update(BULK_MAIL_BATCH_SIZE=3, BULK_MAIL_CONCURRENCY=1,
+                      BULK_MAIL_RATE_PER_SECOND=1000, BULK_MAIL_BURST=1000)
+    tag = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        users = [User(username=f'bulk_{tag}_{i}', email=f'bulk_{tag}_{i}@example.com',
+                      student_staff_id=f'BULK_{tag}_{i}', password_hash='x') for i in range(6)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [u.id for u in users]
+        emails = [u.email for u in users]
+
+    # Chỉ gửi cho user của test; batch đầu tiên bị giữ lại cho tới khi test cho phép
+    original_query = bulk_mail_service._recipient_query
+    monkeypatch.setattr(bulk_mail_service, '_recipient_query',
+                        lambda: original_query().filter(User.id.in_(user_ids)))
+    in_flight, release = threading.Event(), threading.Event()
+    original_send = bulk_mail_service._send_chunk
+
+    def gated_send(*args):
+        if not release.is_set():
+            in_flight.set()
+            release.wait(10)
+        return original_send(*args)
+
+    monkeypatch.setattr(bulk_mail_service, '_send_chunk', gated_send)
+
+    campaign_id = None
+    try:
+        with app.app_context():
+            campaign, _, _ = bulk_mail_service.create_campaign('Thông báo', 'Nội dung', None)
+            campaign_id = campaign.id
+            assert bulk_mail_service.start_campaign(campaign_id)[0]
+            assert in_flight.wait(10)
+
+            assert bulk_mail_service.pause_campaign(campaign_id)[0]
+            # Lần chạy cũ vẫn đang gửi batch: resume phải bị từ chối
+            resumed, _ = bulk_mail_service.start_campaign(campaign_id)
+            assert not resumed
+
+        release.set()
+        with app.app_context():
+            # Lần chạy cũ dừng sau batch và trả token; lúc này resume mới chạy tiếp phần còn lại
+            assert _wait_for(lambda: _campaign(campaign_id).run_id is None)
+            assert _campaign(campaign_id).status == 'paused'
+            assert bulk_mail_service.start_campaign(campaign_id)[0]
+            assert _wait_for(lambda: _campaign(campaign_id).status == 'completed')
+
+        for email in emails:
+            assert len(smtp_sink.messages_to(email)) == 1, email
+    finally:
+        release.set()
+        with app.app_context():
+            EmailCampaignRecipient.query.filter(EmailCampaignRecipient.user_id.in_(user_ids)).delete(
+                synchronize_session=False)
+            EmailCampaign.query.filter_by(id=campaign_id).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+from config import app, LOAN_PERIOD_DAYS
+from email_service import (
+    mail, send_verification_email, send_password_reset_email, send_return_reminder_email,
+    send_borrow_confirmation_email, send_borrow_approved_email, send_borrow_rejected_email
+)
+
+mail.init_app(app)
+
+
+def test_send_paths_deliver_to_local_sink(smtp_sink):
+    """Mỗi hàm gửi mail trong email_service phải gửi đúng 1 message tới người nhận (qua SMTP sink)."""
+    borrow_date = datetime.now()
+    deadline = borrow_date + timedelta(days=LOAN_PERIOD_DAYS)
+    with app.app_context():
+        results = [
+            send_verification_email('a@example.com', '123456'),
+            send_password_reset_email('b@example.com', '654321', 'Bob'),
+            send_return_reminder_email('c@example.com', 'Carol', 'Clean Code', deadline),
+            send_borrow_confirmation_email('d@example.com', 'Dan', 'Clean Code', 'R. Martin', borrow_date, deadline),
+            send_borrow_approved_email('e@example.com', 'Eve', 'Clean Code', 'R. Martin', borrow_date, deadline),
+            send_borrow_rejected_email('f@example.com', 'Fay', 'Clean Code', 'R. Martin'),
+        ]
+
+    assert all(success for success, _ in results), results
+    assert smtp_sink.message_count == 6
+    # Flask-Mail mở một kết nối SMTP cho mỗi lần mail.send()
+    assert smtp_sink.connections == 6
+    assert b'123456' in smtp_sink.messages_to('a@example.com')[0]['data']
+    assert len(smtp_sink.messages_to('c@example.com')) == 1
@@ -0,0 +1,122 @@
+"""Đồng bộ thông báo giữa các worker: số chưa đọc trả về luôn khớp version của notification_counter."""
+
+import json
+import uuid
+from datetime import datetime
+
+from app import app, db
+from models import User, Notification, NotificationCounter
+from notification_service import create_notifications, notification_delta, sync_cursor, unread_count
+
+
+def _make_user(tag):
+    user = User(username=f'notif_{tag}', student_staff_id=f'NOTIF_{tag}', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def _cleanup(user_id):
+    db.session.rollback()
+    Notification.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    NotificationCounter.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def test_delta_unread_count_matches_cursor():
+    tag = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        user_id = _make_user(tag)
+        try:
+            since = sync_cursor(user_id)
+            assert unread_count(user_id) == 0
+
+            # Worker khác commit một thông báo: ghi thẳng bảng, không đi qua listener của worker này
+            counter = NotificationCounter.__table__
+            db.session.execute(counter.update().where(counter.c.user_id == user_id).values(
+                unread_count=counter.c.unread_count + 1, version=counter.c.version + 1))
+            db.session.execute(Notification.__table__.insert().values(
+                user_id=user_id, message='Yêu cầu mượn đã được duyệt', type='success', is_read=False,
+                group_count=1, version=since + 1, created_at=datetime.now()))
+            db.session.commit()
+
+            delta = notification_delta(user_id, since)
+            assert delta['cursor'] == since + 1
+            assert delta['unread_count'] == 1
+            assert [n['message'] for n in delta['notifications']] == ['Yêu cầu mượn đã được duyệt']
+            assert notification_delta(user_id, delta['cursor']) is None
+        finally:
+            _cleanup(user_id)
+
+
+def test_notifications_badge_reads_counter_row():
+    app.config.update(SECRET_KEY=app.config.get('SECRET_KEY') or 'test')
+    tag = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        user_id = _make_user(tag)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    try:
+        assert client.get('/notification/notifications').json['unread_count'] == 0
+        with app.app_context():
+            # Worker khác vừa tăng bộ đếm
+            counter = NotificationCounter.__table__
+            db.session.execute(counter.update().where(counter.c.user_id == user_id).values(unread_count=3))
+            db.session.commit()
+        assert client.get('/notification/notifications').json['unread_count'] == 3
+    finally:
+        with app.app_context():
+            _cleanup(user_id)
+
+
+def _sync_frame(client, headers=None, query=''):
+    """Khung `sync` đầu tiên của /notification/stream -> (id, data)."""
+    body = client.get(f'/notification/stream{query}', headers=headers or {}).get_data(as_text=True)
+    frame = next(f for f in body.split('\n\n') if 'event: sync' in f)
+    fields = dict(line.split(': ', 1) for line in frame.splitlines())
+    return int(fields['id']), json.loads(fields['data'])
+
+
+def test_stream_backfills_changes_after_last_event_id(monkeypatch):
+    app.config.update(SECRET_KEY=app.config.get('SECRET_KEY') or 'test')
+    monkeypatch.setitem(app.config, 'NOTIFICATION_STREAM_SECONDS', 0)
+    tag = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        user_id = _make_user(tag)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    try:
+        cursor, data = _sync_frame(client)
+        assert data == {'cursor': cursor}
+
+        # Trong lúc trình duyệt đang chờ kết nối lại: một thông báo mới, rồi được gộp thêm một lần (cùng id)
+        with app.app_context():
+            create_notifications([user_id], 'Yêu cầu mượn mới', group_key=f'borrow_{tag}')
+            db.session.commit()
+            create_notifications([user_id], 'Yêu cầu mượn mới', group_key=f'borrow_{tag}',
+                                 group_message='{count} yêu cầu mượn mới')
+            db.session.commit()
+
+        event_id, data = _sync_frame(client, {'Last-Event-ID': str(cursor)})
+        assert event_id == data['cursor'] > cursor
+        assert data['unread_count'] == 1
+        assert [n['message'] for n in data['notifications']] == ['2 yêu cầu mượn mới']
+
+        # Chỉ số chưa đọc đổi (đánh dấu đã đọc ở tab khác) cũng được gửi bù
+        with app.app_context():
+            Notification.query.filter_by(user_id=user_id).first().is_read = True
+            db.session.commit()
+        next_id, data = _sync_frame(client, {'Last-Event-ID': str(event_id)})
+        assert next_id > event_id and data['unread_count'] == 0
+
+        # Lần kết nối đầu dùng `since` (con trỏ của get_notifications); không có gì mới -> chỉ con trỏ
+        assert _sync_frame(client, query=f'?since={next_id}') == (next_id, {'cursor': next_id})
+    finally:
+        with app.app_context():
+            _cleanup(user_id)
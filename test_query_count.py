@@ -0,0 +1,71 @@
+"""Các trang danh sách lượt mượn phải chạy số câu SQL không đổi dù trang có 1 hay 10 lượt (header X-Query-Count)."""
+
+import uuid
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import User, Book, Borrow
+
+
+def _make_user(tag, suffix, books, is_admin=False):
+    user = User(username=f'qc_{tag}_{suffix}', student_staff_id=f'QC_{tag}_{suffix}', password_hash='x',
+                is_admin=is_admin)
+    db.session.add(user)
+    db.session.flush()
+    now = datetime.now()
+    # Mỗi lượt một sách khác nhau và không có snapshot book_title: template phải đọc borrow.book,
+    # nên lazy load sẽ lộ ra thành N câu SQL
+    for i, book in enumerate(books):
+        db.session.add(Borrow(user_id=user.id, book_id=book.id, book_title=None, status='approved',
+                              borrow_date=now - timedelta(days=i), expected_return_date=now + timedelta(days=7)))
+    return user
+
+
+def _query_count(client, url, user_id, is_admin=False):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['is_admin'] = is_admin
+    response = client.get(url)
+    assert response.status_code == 200, url
+    return int(response.headers['X-Query-Count'])
+
+
+def test_listing_pages_run_constant_queries():
+    app.config.update(QUERY_COUNTER_HEADER=True, SECRET_KEY=app.config.get('SECRET_KEY') or 'test')
+    tag = uuid.uuid4().hex[:8]
+    with app.app_context():
+        db.create_all()
+        books = [Book(title=f'Query count {tag} {i}', author='A', quantity=2, available_quantity=1)
+                 for i in range(10)]
+        db.session.add_all(books)
+        db.session.flush()
+        admin = _make_user(tag, 'admin', [], is_admin=True)
+        one = _make_user(tag, 'one', books[:1])
+        ten = _make_user(tag, 'ten', books)
+        db.session.commit()
+        ids = {'admin': admin.id, 'one': one.id, 'ten': ten.id}
+        book_ids = [b.id for b in books]
+
+    pages = [
+        # (url theo user, session là admin?)
+        (lambda key: f'/admin/borrows?user=qc_{tag}_{key}', True),
+        (lambda key: f'/admin/users/history/{ids[key]}', True),
+        (lambda key: '/user/borrows', False),
+    ]
+    client = app.test_client()
+    try:
+        for url, as_admin in pages:
+            counts = {}
+            # Lượt đầu làm nóng các cache (bộ đếm trang mượn, tên user, số thông báo chưa đọc)
+            for _ in range(2):
+                for key in ('one', 'ten'):
+                    session_user = ids['admin'] if as_admin else ids[key]
+                    counts[key] = _query_count(client, url(key), session_user, as_admin)
+            assert counts['one'] == counts['ten'], (url('ten'), counts)
+    finally:
+        with app.app_context():
+            user_ids = [ids['admin'], ids['one'], ids['ten']]
+            Borrow.query.filter(Borrow.user_id.in_(user_ids)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            Book.query.filter(Book.id.in_(book_ids)).delete(synchronize_session=False)
+            db.session.commit()
@@ -1,5 +1,6 @@
 from app import app, db, check_overdue_books
 from models import User, Book, Borrow
+import os
 from datetime import datetime, timedelta
 
 def test_reminder():
@@ -7,8 +8,8 @@ def test_reminder():
         print("--- BẮT ĐẦU TEST EMAIL REMINDER ---")
         
         # 1. Cấu hình email nhận test
-        # HÃY SỬA EMAIL DƯỚI ĐÂY THÀNH EMAIL CỦA BẠN
-        test_email = "huyphanquoc8@gmail.com"  # <--- SỬA TẠI ĐÂY
+        # Đặt TEST_EMAIL để chọn người nhận; khi chạy qua pytest, mail đi vào SMTP sink (conftest.py)
+        test_email = os.getenv('TEST_EMAIL', 'huyphanquoc8@gmail.com')
         
         print(f"Email nhận test: {test_email}")
         
@@ -0,0 +1,134 @@
+"""title_matcher.py
+
+Tìm các sách được nhắc tới trong tin nhắn chatbot (Strategy B trong routes/chatbot.get_rag_context).
+
+Trước đây mỗi tin nhắn chạy `Book.query.filter_by(is_active=True).all()` — nạp cả catalog thành ORM object — rồi
+kiểm tra `book.title.lower() in query_lower` từng cuốn: chi phí DB và Python tỉ lệ với số sách, cho MỌI tin nhắn.
+
+Giờ mỗi worker dựng một automaton Aho-Corasick từ tựa sách và tên tác giả (đã chuẩn hoá) của các sách active:
+- Dựng một lần (một truy vấn chỉ lấy id/title/author) và dựng lại khi catalog_version thay đổi (thêm/sửa/ẩn/import
+  sách ở bất kỳ worker nào); kiểm tra phiên bản chỉ là một os.stat().
+- So khớp một lượt qua tin nhắn — thời gian tuyến tính theo độ dài tin nhắn (cộng số kết quả), không phụ thuộc
+  số sách. Chỉ nhận kết quả đứng trọn vẹn như một cụm từ (ký tự trước/sau không phải chữ/số), để "an" không
+  khớp bên trong "bàn" hay "sang". Điều đó không chặn được tựa quá ngắn trùng một từ thông dụng (sách "An" vẫn
+  khớp chữ "an" trong "an toàn"), nên tựa ngắn hơn MIN_TITLE_LENGTH ký tự bị bỏ qua.
+- Tựa sách được ưu tiên; tên tác giả (>= MIN_AUTHOR_LENGTH ký tự) trả thêm các sách của tác giả đó.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import deque
+
+import catalog_version
+from models import db, Book
+
+MIN_TITLE_LENGTH = 3
+MIN_AUTHOR_LENGTH = 4
+MAX_MATCHES = 10
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFC', text or '').lower()).strip()
+
+
+class AhoCorasick:
+    """Automaton Aho-Corasick: add() các mẫu kèm giá trị, build() một lần, rồi iter() trên văn bản."""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+    def add(self, pattern, value):
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append((len(pattern), value))
+
+    def build(self):
+        # BFS: liên kết fail của một node = trạng thái dài nhất là hậu tố thực sự của nó; gộp output theo fail
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, nxt in self._goto[state].items():
+                pending.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                if self._fail[nxt] == nxt:
+                    self._fail[nxt] = 0
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+        return self
+
+    def iter(self, text):
+        """Sinh (start, end, value) cho mọi mẫu xuất hiện trong `text` (end không bao gồm)."""
+        state = 0
+        for index, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, value in self._output[state]:
+                yield index + 1 - length, index + 1, value
+
+
+def _is_boundary(text, index):
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+class TitleMatcher:
+    def __init__(self, version, rows):
+        self.version = version
+        self.automaton = AhoCorasick()
+        for book_id, title, author in rows:
+            title = normalize(title)
+            if len(title) >= MIN_TITLE_LENGTH:
+                self.automaton.add(title, ('title', book_id))
+            author = normalize(author)
+            if len(author) >= MIN_AUTHOR_LENGTH:
+                self.automaton.add(author, ('author', book_id))
+        self.automaton.build()
+
+    def find(self, text, limit=MAX_MATCHES):
+        text = normalize(text)
+        by_title, by_author = [], []
+        for start, end, (kind, book_id) in self.automaton.iter(text):
+            if _is_boundary(text, start - 1) and _is_boundary(text, end):
+                target = by_title if kind == 'title' else by_author
+                if book_id not in target:
+                    target.append(book_id)
+        matched = by_title + [book_id for book_id in by_author if book_id not in by_title]
+        return matched[:limit]
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """Matcher của worker, dựng lại khi phiên bản catalog đổi (cần app context)."""
+    global _matcher
+    version = catalog_version.current()
+    matcher = _matcher
+    if matcher is None or matcher.version != version:
+        with _matcher_lock:
+            if _matcher is None or _matcher.version != version:
+                rows = db.session.query(Book.id, Book.title, Book.author).filter(Book.is_active == True).all()
+                _matcher = TitleMatcher(version, rows)
+            matcher = _matcher
+    return matcher
+
+
+def find_mentioned_books(text, limit=MAX_MATCHES):
+    """Id các sách active có tựa (hoặc tác giả) xuất hiện trong `text`, tựa sách trước, theo thứ tự xuất hiện."""
+    return get_matcher().find(text, limit)